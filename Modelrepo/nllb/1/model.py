@@ -1,35 +1,392 @@
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+from transformers.modeling_outputs import BaseModelOutput
+import contextlib
+import json
+import time
 import numpy as np
 import torch
 import triton_python_backend_utils as pb_utils
 
+DEFAULT_TARGET_LANG = "asm_Beng"
+# Columns of the optional STAGE_TIMES_MS output, as in nllb_serving.stages.STAGES.
+# Triton measures queueing itself (nv_inference_queue_duration_us) and the
+# client tokenizes, so those columns are NaN here.
+STAGES = ("queue_wait", "batch_formation", "tokenize", "encode", "decode", "detokenize", "serialize")
+
 class TritonPythonModel:
     def initialize(self, args):
+        model_config = json.loads(args["model_config"])
+        parameters = model_config.get("parameters", {})
+        # KIND_CPU instances run on the CPU, each pinned to its own cores
+        self.device = "cuda" if args["model_instance_kind"] == "GPU" else "cpu"
+        if self.device == "cpu":
+            self.place_cpu_instance(args["model_instance_name"], model_config, parameters)
         self.tokenizer = AutoTokenizer.from_pretrained("facebook/nllb-200-distilled-600M")
-        self.model = AutoModelForSeq2SeqLM.from_pretrained("facebook/nllb-200-distilled-600M").to("cuda")
+        self.model = AutoModelForSeq2SeqLM.from_pretrained("facebook/nllb-200-distilled-600M").to(self.device)
+        self.time_encoder(self.model.get_encoder())
+        # Python backend metrics are counters and gauges only: per-stage totals,
+        # divided by nv_inference_request_success for the mean
+        stage_family = pb_utils.MetricFamily(
+            name="nllb_stage_seconds_total",
+            description="Time requests spent in each serving stage", kind=pb_utils.MetricFamily.COUNTER
+        )
+        self.stage_metrics = {
+            name: stage_family.Metric(labels={"model": "nllb", "stage": name})
+            for name in ("batch_formation", "encode", "decode", "serialize")
+        }
 
-    def execute(self, requests: list):
-        batch_sizes, input_ids, attention_mask = build_input(requests)
-        responses = []
-
-        translated_tokens = self.model.generate(
-            input_ids=input_ids, 
-            attention_mask=attention_mask,
-            forced_bos_token_id=self.tokenizer.lang_code_to_id["asm_Beng"],
-            max_length=128 
-        ).to("cpu")
-
-        start = 0
-        for batch_shape in batch_sizes:
-            out_tensor = pb_utils.Tensor(
-                "OUTPUT_IDS", translated_tokens[start : start + batch_shape[0], :].numpy().astype(np.int32)
+        self.profile_dir = parameters.get("profile_dir", {}).get("string_value") or "/tmp/nllb-profiles"
+        self.profiler = None
+        draft_model = parameters.get("draft_model", {}).get("string_value")
+        self.speculative = None
+        if draft_model:
+            from nllb_serving.speculative import SpeculativeDecoder
+
+            draft_length = int(parameters.get("draft_length", {}).get("string_value") or 4)
+            draft = AutoModelForSeq2SeqLM.from_pretrained(draft_model).to(self.device)
+            self.time_encoder(draft.get_encoder())
+            self.speculative = SpeculativeDecoder(self.model, draft, draft_length)
+            counter = pb_utils.MetricFamily.COUNTER
+            self.speculative_metrics = {
+                "proposed": pb_utils.MetricFamily(
+                    name="nllb_speculative_draft_tokens_total",
+                    description="Tokens proposed by the draft model", kind=counter
+                ).Metric(labels={"model": "nllb"}),
+                "accepted": pb_utils.MetricFamily(
+                    name="nllb_speculative_accepted_tokens_total",
+                    description="Draft tokens accepted by the target model", kind=counter
+                ).Metric(labels={"model": "nllb"}),
+                "passes": pb_utils.MetricFamily(
+                    name="nllb_speculative_verify_passes_total",
+                    description="Target model decoder passes", kind=counter
+                ).Metric(labels={"model": "nllb"}),
+            }
+
+        # Finished-row compaction: rows leave the batch as soon as they emit EOS
+        self.compactor = None
+        if (parameters.get("compact_decoding", {}).get("string_value") or "false").lower() == "true":
+            from nllb_serving.compaction import CompactingDecoder
+
+            self.compactor = CompactingDecoder(self.model)
+            counter = pb_utils.MetricFamily.COUNTER
+            self.compaction_metrics = {
+                "steps": pb_utils.MetricFamily(
+                    name="nllb_compaction_decode_steps_total",
+                    description="Decoder steps run", kind=counter
+                ).Metric(labels={"model": "nllb"}),
+                "row_steps": pb_utils.MetricFamily(
+                    name="nllb_compaction_row_steps_total",
+                    description="Rows decoded, summed over decoder steps", kind=counter
+                ).Metric(labels={"model": "nllb"}),
+                "padded_row_steps": pb_utils.MetricFamily(
+                    name="nllb_compaction_padded_row_steps_total",
+                    description="Rows a padded batch would have decoded, summed over decoder steps", kind=counter
+                ).Metric(labels={"model": "nllb"}),
+            }
+
+        # ONNX Runtime engine over graphs written by `python -m nllb_serving export-onnx`
+        self.onnx_engine = None
+        onnx_model_dir = parameters.get("onnx_model_dir", {}).get("string_value")
+        if onnx_model_dir:
+            from nllb_serving.onnx_engine import OnnxEngine
+
+            self.onnx_engine = OnnxEngine(
+                onnx_model_dir,
+                intra_op_threads=int(parameters.get("onnx_intra_op_threads", {}).get("string_value") or 0),
+                inter_op_threads=int(parameters.get("onnx_inter_op_threads", {}).get("string_value") or 0),
+                optimization_level=parameters.get("onnx_optimization_level", {}).get("string_value") or "all",
+            )
+
+        # Per-target-language LM head shortlists (`python -m nllb_serving build-shortlist`)
+        self.shortlist = None
+        shortlist_path = parameters.get("shortlist_path", {}).get("string_value")
+        if shortlist_path:
+            from nllb_serving.shortlist import VocabularyShortlist
+
+            self.shortlist = VocabularyShortlist(
+                self.model, shortlist_path,
+                audit_interval=int(parameters.get("shortlist_audit_interval", {}).get("string_value") or 64),
+                log=pb_utils.Logger.log_warn,
             )
-            start += batch_shape[0]
-            responses.append(pb_utils.InferenceResponse(output_tensors=[out_tensor]))
+
+        # Batches estimated to need more activation and KV-cache memory than the
+        # budget run as consecutive sub-batches instead of failing with OOM
+        self.memory_budget = None
+        memory_budget_mb = parameters.get("memory_budget_mb", {}).get("string_value")
+        budget_bytes = None
+        if memory_budget_mb:
+            try:
+                from nllb_serving.memory import MemoryBudget, MemoryEstimator, resolve_budget
+            except ImportError:
+                # The default deployment does not mount nllb_serving; run batches whole
+                pb_utils.Logger.log_warn("memory_budget_mb needs nllb_serving on PYTHONPATH; batches are not split")
+            else:
+                # Every instance of the model draws on the same memory
+                instances = sum(int(group.get("count") or 1) for group in model_config.get("instance_group", []))
+                budget_bytes = resolve_budget(memory_budget_mb, self.device, shares=instances or 1)
+        if budget_bytes:
+            self.memory_budget = MemoryBudget(MemoryEstimator.from_model(self.model, max_length=128), budget_bytes)
+            pb_utils.Logger.log_info(f"Memory budget per batch: {budget_bytes / 2 ** 20:.1f} MB")
+            self.memory_metrics = {
+                "estimate": pb_utils.MetricFamily(
+                    name="nllb_batch_memory_estimate_bytes",
+                    description="Estimated peak memory of the last batch before splitting",
+                    kind=pb_utils.MetricFamily.GAUGE
+                ).Metric(labels={"model": "nllb"}),
+                "split": pb_utils.MetricFamily(
+                    name="nllb_memory_split_batches_total",
+                    description="Batches split because they exceeded the memory budget",
+                    kind=pb_utils.MetricFamily.COUNTER
+                ).Metric(labels={"model": "nllb"}),
+                "sub_batches": pb_utils.MetricFamily(
+                    name="nllb_memory_sub_batches_total",
+                    description="Sub-batches run for batches that were split",
+                    kind=pb_utils.MetricFamily.COUNTER
+                ).Metric(labels={"model": "nllb"}),
+                "oversized": pb_utils.MetricFamily(
+                    name="nllb_memory_oversized_rows_total",
+                    description="Sentences over the memory budget on their own (run alone)",
+                    kind=pb_utils.MetricFamily.COUNTER
+                ).Metric(labels={"model": "nllb"}),
+            }
+
+    def place_cpu_instance(self, instance_name, model_config, parameters):
+        # Instances are named <group name>_<index>, groups default to <model>_<group index>;
+        # the placement splits the host's cores over every KIND_CPU instance
+        try:
+            from nllb_serving.placement import apply_placement, plan_placement
+        except ImportError:
+            # The default deployment does not mount nllb_serving; run unpinned
+            pb_utils.Logger.log_warn("cpu_placement needs nllb_serving on PYTHONPATH; the instance is not pinned")
+            return
+
+        policy = parameters.get("cpu_placement", {}).get("string_value") or "numa"
+        threads = int(parameters.get("cpu_threads_per_instance", {}).get("string_value") or 0)
+        groups = [group for group in model_config.get("instance_group", []) if group.get("kind") == "KIND_CPU"]
+        instances = [
+            f"{group.get('name') or model_config['name'] + '_' + str(i)}_{k}"
+            for i, group in enumerate(groups) for k in range(int(group.get("count") or 1))
+        ]
+        index = instances.index(instance_name) if instance_name in instances else 0
+        placement = plan_placement(max(1, len(instances)), policy, threads)[index]
+        apply_placement(placement)
+        pb_utils.Logger.log_info(f"{instance_name}: {placement}")
+
+    def shortlisted(self, target_langs):
+        # The ONNX graphs keep the full LM head
+        if self.shortlist is None or self.onnx_engine:
+            return contextlib.nullcontext()
+        return self.shortlist.restrict(target_langs, max_length=128)
+
+    def onnx_generate(self, input_ids, attention_mask, **kwargs):
+        from nllb_serving.stages import collect_stages
+
+        # The engine reports its encoder runs as the "encode" stage
+        with collect_stages() as stages:
+            translated_tokens = self.onnx_engine.generate(input_ids, attention_mask, max_length=128, **kwargs)
+        self.encode_seconds += stages.get("encode", 0.0)
+        return translated_tokens
+
+    def split_batch(self, attention_mask, target_langs):
+        # (start, end) row ranges of the batch that fit the memory budget
+        if self.memory_budget is None:
+            return [(0, attention_mask.shape[0])]
+        lengths = attention_mask.sum(dim=1).tolist()
+        ranges, stats = self.memory_budget.split(lengths, len(target_langs))
+        self.memory_metrics["estimate"].set(stats["estimate_bytes"])
+        if len(ranges) > 1:
+            self.memory_metrics["split"].increment(1)
+            self.memory_metrics["sub_batches"].increment(len(ranges))
+        if stats["oversized_rows"]:
+            self.memory_metrics["oversized"].increment(stats["oversized_rows"])
+        return ranges
+
+    def compact_generate(self, **kwargs):
+        translated_tokens, stats = self.compactor.generate(max_length=128, **kwargs)
+        self.compaction_metrics["steps"].increment(stats["steps"])
+        self.compaction_metrics["row_steps"].increment(stats["row_steps"])
+        self.compaction_metrics["padded_row_steps"].increment(stats["steps"] * translated_tokens.shape[0])
+        return translated_tokens
+
+    def time_encoder(self, encoder):
+        # Encoder passes are timed wherever generation runs them, so "encode"
+        # can be told apart from "decode"
+        def start(*_):
+            if self.device == "cuda":
+                torch.cuda.synchronize()
+            self.encode_started = time.perf_counter()
+
+        def stop(*_):
+            if self.device == "cuda":
+                torch.cuda.synchronize()
+            self.encode_seconds += time.perf_counter() - self.encode_started
+
+        self.encode_seconds = 0.0
+        encoder.register_forward_pre_hook(start)
+        encoder.register_forward_hook(stop)
+
+    def maybe_profile(self, requests):
+        # A request with the "profile_s" parameter starts a bounded capture of the
+        # live model (nllb_serving.profiling, needs it on PYTHONPATH). torch.profiler
+        # must start and stop on this thread, so both happen here in execute(); the
+        # trace is written by the first execute() after the capture ends.
+        for request in requests:
+            duration = json.loads(request.parameters() or "{}").get("profile_s")
+            if not duration:
+                continue
+            if self.profiler is None:
+                from nllb_serving.profiling import ProfileCapture
+
+                self.profiler = ProfileCapture(self.profile_dir)
+            try:
+                capture = self.profiler.start(duration)
+                pb_utils.Logger.log_info(f"Profiling for {duration}s: {capture['trace']}, {capture['stacks']}")
+            except (RuntimeError, ValueError) as e:
+                pb_utils.Logger.log_warn(f"Profile request ignored: {e}")
+        if self.profiler is not None:
+            self.profiler.poll()
+
+    def execute(self, requests: list):
+        # Requests may pick their target language with the "target_lang"
+        # parameter, or several with "target_langs" (a JSON list), in which
+        # case OUTPUT_IDS holds len(target_langs) rows per input row. Each
+        # language (or language list) is generated as its own sub-batch.
+        # Requests asking for STAGE_TIMES_MS also get their sub-batch's stage
+        # times in milliseconds, one row per output row.
+        self.maybe_profile(requests)
+        groups = {}
+        for index, request in enumerate(requests):
+            groups.setdefault(target_langs_of(request), []).append(index)
+
+        responses = [None] * len(requests)
+        for target_langs, indices in groups.items():
+            unsupported = [lang for lang in target_langs if lang not in self.tokenizer.lang_code_to_id]
+            if unsupported:
+                error = pb_utils.TritonError(f"Target language code '{unsupported[0]}' is not supported.")
+                for index in indices:
+                    responses[index] = pb_utils.InferenceResponse(output_tensors=[], error=error)
+                continue
+
+            group = [requests[i] for i in indices]
+            started = time.perf_counter()
+            batch_sizes, input_ids, attention_mask = build_input(group, self.device)
+            ranges = self.split_batch(attention_mask, target_langs)
+            formed = time.perf_counter()
+            self.encode_seconds = 0.0
+
+            with self.shortlisted(target_langs):
+                if len(ranges) == 1:
+                    translated_tokens = self.generate(input_ids, attention_mask, target_langs)
+                else:
+                    # Sub-batches run in sequence, each trimmed to its longest row
+                    sub_batches = []
+                    for start, end in ranges:
+                        width = int(attention_mask[start:end].sum(dim=1).max())
+                        sub_batches.append(self.generate(
+                            input_ids[start:end, :width], attention_mask[start:end, :width], target_langs
+                        ))
+                    translated_tokens = pad_and_concatenate(sub_batches, self.model.config.pad_token_id)
+            decoded = time.perf_counter()
+
+            start = 0
+            output_ids = []
+            for batch_shape in batch_sizes:
+                rows = batch_shape[0] * len(target_langs)
+                output_ids.append(translated_tokens[start : start + rows, :].numpy().astype(np.int32))
+                start += rows
+            stages = {
+                "batch_formation": formed - started,
+                "encode": self.encode_seconds,
+                "decode": decoded - formed - self.encode_seconds,
+                "serialize": time.perf_counter() - decoded,
+            }
+            stage_times = np.array([stages.get(name, np.nan) * 1000 for name in STAGES], dtype=np.float32)
+            for name, seconds in stages.items():
+                self.stage_metrics[name].increment(seconds * len(indices))
+
+            for index, ids in zip(indices, output_ids):
+                out_tensors = [pb_utils.Tensor("OUTPUT_IDS", ids)]
+                if "STAGE_TIMES_MS" in requests[index].requested_output_names():
+                    out_tensors.append(pb_utils.Tensor("STAGE_TIMES_MS", np.tile(stage_times, (len(ids), 1))))
+                responses[index] = pb_utils.InferenceResponse(output_tensors=out_tensors)
 
         return responses
 
-def build_input(requests: list):
+    def generate(self, input_ids, attention_mask, target_langs):
+        # Output ids of one (sub-)batch on the CPU, len(target_langs) rows per input row
+        if len(target_langs) == 1 and self.speculative:
+            translated_tokens, stats = self.speculative.generate(
+                input_ids, attention_mask,
+                forced_bos_token_id=self.tokenizer.lang_code_to_id[target_langs[0]],
+                max_length=128
+            )
+            for name, value in stats.items():
+                self.speculative_metrics[name].increment(value)
+            return translated_tokens.to("cpu")
+        if len(target_langs) == 1 and self.onnx_engine:
+            return self.onnx_generate(
+                input_ids, attention_mask,
+                forced_bos_token_id=self.tokenizer.lang_code_to_id[target_langs[0]],
+            ).to("cpu")
+        if len(target_langs) == 1 and self.compactor:
+            return self.compact_generate(
+                input_ids=input_ids, attention_mask=attention_mask,
+                forced_bos_token_id=self.tokenizer.lang_code_to_id[target_langs[0]],
+            ).to("cpu")
+        if len(target_langs) == 1:
+            return self.model.generate(
+                input_ids=input_ids, 
+                attention_mask=attention_mask,
+                forced_bos_token_id=self.tokenizer.lang_code_to_id[target_langs[0]],
+                max_length=128 
+            ).to("cpu")
+        return self.generate_targets(input_ids, attention_mask, target_langs).to("cpu")
+
+    def generate_targets(self, input_ids, attention_mask, target_langs):
+        # Encode once, repeat the encoder output for every target language and
+        # decode all (row, target) pairs as one batch; row i * n + j is input
+        # row i translated into target_langs[j].
+        n = len(target_langs)
+        lang_ids = torch.tensor(
+            [self.tokenizer.lang_code_to_id[lang] for lang in target_langs], device=input_ids.device
+        ).repeat(input_ids.shape[0])
+        decoder_input_ids = torch.stack(
+            [torch.full_like(lang_ids, self.model.config.decoder_start_token_id), lang_ids], dim=1
+        )
+        if self.onnx_engine:
+            return self.onnx_generate(input_ids, attention_mask, decoder_input_ids=decoder_input_ids, repeats=n)
+        with torch.no_grad():
+            encoder_outputs = self.model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask)
+        encoder_outputs = BaseModelOutput(
+            last_hidden_state=encoder_outputs.last_hidden_state.repeat_interleave(n, dim=0)
+        )
+        if self.compactor:
+            return self.compact_generate(
+                encoder_outputs=encoder_outputs,
+                attention_mask=attention_mask.repeat_interleave(n, dim=0),
+                decoder_input_ids=decoder_input_ids,
+            )
+        return self.model.generate(
+            encoder_outputs=encoder_outputs,
+            attention_mask=attention_mask.repeat_interleave(n, dim=0),
+            decoder_input_ids=decoder_input_ids,
+            max_length=128
+        )
+
+def target_langs_of(request):
+    parameters = json.loads(request.parameters() or "{}")
+    if "target_langs" in parameters:
+        return tuple(json.loads(parameters["target_langs"]))
+    return (parameters.get("target_lang", DEFAULT_TARGET_LANG),)
+
+def pad_and_concatenate(sub_batches, pad_token_id):
+    # Sub-batches finish at different lengths; pad them to the longest before stacking
+    width = max(tokens.shape[1] for tokens in sub_batches)
+    return torch.cat([
+        torch.nn.functional.pad(tokens, (0, width - tokens.shape[1]), value=pad_token_id) for tokens in sub_batches
+    ], dim=0)
+
+def build_input(requests: list, device="cuda"):
     batch_sizes = [np.shape(pb_utils.get_input_tensor_by_name(request, "INPUT_IDS").as_numpy()) for request in requests]
     max_len = np.max([bs[1] for bs in batch_sizes])
     
@@ -42,7 +399,7 @@ def build_input(requests: list):
                 mode='constant', constant_values=0  # padding with zeros
             ) for batch_size, request in zip(batch_sizes, requests)
         ], axis=0)
-    ).to("cuda")
+    ).to(device)
     
     # Create attention masks
     attention_mask = torch.tensor(
@@ -53,7 +410,7 @@ def build_input(requests: list):
                 mode='constant', constant_values=0  # padding with zeros
             ) for batch_size in batch_sizes
         ], axis=0)
-    ).to("cuda")
+    ).to(device)
     
     return batch_sizes, input_ids, attention_mask
 
@@ -4,53 +4,119 @@ import socket
 import json
 import psutil
 import os
+import sys
 import tritonclient.grpc.aio
 from tritonclient.utils import np_to_triton_dtype
 from transformers import AutoTokenizer
 import numpy as np
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from nllb_serving.client.streaming import AsyncInferStream, build_stream_request
+from nllb_serving.corpus import TokenCorpus, corpus_path
+
 TRITON_SERVER_URL = "127.0.0.1:8001"
 STANDARD_SERVER_URL = "127.0.0.1"
+# The standard server also speaks KServe v2 gRPC, so both backends can be
+# driven by the same tritonclient load generator
+STANDARD_KSERVE_URL = "127.0.0.1:8006"
 MODEL_NAME = "nllb"
+# "stream" writes every request onto one bidirectional ModelStreamInfer call;
+# "unary" sends a separate infer RPC per sentence
+TRITON_TRANSPORT = "stream"
 SENTENCES_FILE = "sentences.txt"
+# Server-side stages reported by both servers (STAGE_TIMES_MS / "timings_ms")
+STAGES = ("queue_wait", "batch_formation", "tokenize", "encode", "decode", "detokenize", "serialize")
 
 
-# Benchmarking function for Triton Inference Server
-async def benchmark_triton(texts, source_lang, target_lang):
-    client = tritonclient.grpc.aio.InferenceServerClient(TRITON_SERVER_URL)
-    tokenizer = AutoTokenizer.from_pretrained("facebook/nllb-200-distilled-600M", src_lang=source_lang)
+def mean_stage_times(breakdowns):
+    """Average per-stage milliseconds over requests; NaN for stages a server does not report."""
+    return {
+        stage: float(np.nanmean([b.get(stage, np.nan) for b in breakdowns])) if any(stage in b for b in breakdowns)
+        else float("nan")
+        for stage in STAGES
+    }
+
+
+def load_corpus(source_lang):
+    """
+    The compiled corpus of SENTENCES_FILE for `source_lang`, if there is an
+    up-to-date one (python -m nllb_serving compile-corpus sentences.txt -s eng_Latn).
+    """
+    path = corpus_path(SENTENCES_FILE, source_lang)
+    if not os.path.exists(path):
+        return None
+    corpus = TokenCorpus(path)
+    if not corpus.matches(SENTENCES_FILE):
+        print(f"Ignoring {path}: {SENTENCES_FILE} changed since it was compiled")
+        return None
+    return corpus
+
+
+# Benchmarking function for KServe v2 gRPC servers (Triton or the standard server)
+async def benchmark_triton(texts, source_lang, target_lang, server_url=TRITON_SERVER_URL, transport=TRITON_TRANSPORT):
+    if transport == "stream":
+        stream = AsyncInferStream(server_url)
+    else:
+        client = tritonclient.grpc.aio.InferenceServerClient(server_url)
+    # A compiled corpus holds ready INPUT_IDS rows, so no tokenizer is loaded
+    corpus = load_corpus(source_lang)
+    if corpus is None:
+        tokenizer = AutoTokenizer.from_pretrained("facebook/nllb-200-distilled-600M", src_lang=source_lang)
     
     latencies = []
     memory_usage = []
-
-    for sentence in texts:
-        # Tokenize sentence
-        encoded = tokenizer(sentence, return_tensors="np", padding=True, truncation=True, max_length=128)
-
-        input_ids = encoded['input_ids'].astype(np.int32)
-        attention_mask = encoded['attention_mask'].astype(np.int32)
-        token_type_ids = encoded.get('token_type_ids', None)  # Assuming the model might not need this
-        
-        # Create Triton inputs
-        inputs = [
-            tritonclient.grpc.aio.InferInput("INPUT_IDS", input_ids.shape, np_to_triton_dtype(input_ids.dtype)),
-            tritonclient.grpc.aio.InferInput("ATTENTION_MASK", attention_mask.shape, np_to_triton_dtype(attention_mask.dtype)),
-        ]
-        
-        inputs[0].set_data_from_numpy(input_ids)
-        inputs[1].set_data_from_numpy(attention_mask)
+    breakdowns = []
+
+    for index, sentence in enumerate(texts):
+        token_type_ids = None
+        if corpus is not None:
+            # Zero-copy [1, seq] view into the memory-mapped corpus
+            input_ids, attention_mask = corpus.batch([index])
+        else:
+            # Tokenize sentence
+            encoded = tokenizer(sentence, return_tensors="np", padding=True, truncation=True, max_length=128)
+
+            input_ids = encoded['input_ids'].astype(np.int32)
+            attention_mask = encoded['attention_mask'].astype(np.int32)
+            token_type_ids = encoded.get('token_type_ids', None)  # Assuming the model might not need this
         
-        if token_type_ids is not None:
-            inputs.append(tritonclient.grpc.aio.InferInput("TOKEN_TYPE_IDS", token_type_ids.shape, np_to_triton_dtype(token_type_ids.dtype)))
-            inputs[-1].set_data_from_numpy(token_type_ids)
-        
-        outputs = [tritonclient.grpc.aio.InferRequestedOutput("OUTPUT_IDS")]
+        if transport == "stream":
+            tensors = {"INPUT_IDS": input_ids, "ATTENTION_MASK": attention_mask}
+            if token_type_ids is not None:
+                tensors["TOKEN_TYPE_IDS"] = token_type_ids.astype(np.int32)
+            request = build_stream_request(
+                MODEL_NAME, tensors, ("OUTPUT_IDS", "STAGE_TIMES_MS"), parameters={"target_lang": target_lang}
+            )
+        else:
+            # Create Triton inputs
+            inputs = [
+                tritonclient.grpc.aio.InferInput("INPUT_IDS", input_ids.shape, np_to_triton_dtype(input_ids.dtype)),
+                tritonclient.grpc.aio.InferInput("ATTENTION_MASK", attention_mask.shape, np_to_triton_dtype(attention_mask.dtype)),
+            ]
+
+            inputs[0].set_data_from_numpy(input_ids)
+            inputs[1].set_data_from_numpy(attention_mask)
+
+            if token_type_ids is not None:
+                inputs.append(tritonclient.grpc.aio.InferInput("TOKEN_TYPE_IDS", token_type_ids.shape, np_to_triton_dtype(token_type_ids.dtype)))
+                inputs[-1].set_data_from_numpy(token_type_ids)
+
+            outputs = [
+                tritonclient.grpc.aio.InferRequestedOutput("OUTPUT_IDS"),
+                tritonclient.grpc.aio.InferRequestedOutput("STAGE_TIMES_MS"),
+            ]
 
         process = psutil.Process(os.getpid())
         initial_memory = process.memory_info().rss / (1024 * 1024)
         start_time = time.time()
 
-        res = await client.infer(model_name=MODEL_NAME, inputs=inputs, outputs=outputs)
+        if transport == "stream":
+            res = await stream.infer(request)
+        else:
+            res = await client.infer(
+                model_name=MODEL_NAME, inputs=inputs, outputs=outputs, parameters={"target_lang": target_lang}
+            )
         out_tokens = res.as_numpy("OUTPUT_IDS")
 
         latency = time.time() - start_time
@@ -59,6 +125,15 @@ async def benchmark_triton(texts, source_lang, target_lang):
 
         latencies.append(latency)
         memory_usage.append(memory_used)
+        # NaN columns are stages the server does not measure (Triton's queue wait)
+        breakdowns.append({
+            stage: value for stage, value in zip(STAGES, res.as_numpy("STAGE_TIMES_MS")[0]) if not np.isnan(value)
+        })
+
+    if transport == "stream":
+        await stream.close()
+    else:
+        await client.close()
 
     average_latency = sum(latencies) / len(latencies)
     average_memory_used = sum(memory_usage) / len(memory_usage)
@@ -67,7 +142,8 @@ async def benchmark_triton(texts, source_lang, target_lang):
     return {
         "average_latency": average_latency,
         "average_memory_used": average_memory_used,
-        "throughput": throughput
+        "throughput": throughput,
+        "stage_times": mean_stage_times(breakdowns),
     }
 
 
@@ -76,7 +152,8 @@ def send_request(text, source_lang, target_lang):
     request = {
         "text": text,
         "source_lang": source_lang,
-        "target_lang": target_lang
+        "target_lang": target_lang,
+        "timings": True
     }
     request_data = json.dumps(request)
 
@@ -94,6 +171,7 @@ def send_request(text, source_lang, target_lang):
 def benchmark_standard(texts, source_lang, target_lang):
     latencies = []
     memory_usage = []
+    breakdowns = []
 
     for sentence in texts:
         process = psutil.Process(os.getpid())
@@ -108,6 +186,7 @@ def benchmark_standard(texts, source_lang, target_lang):
 
         latencies.append(latency)
         memory_usage.append(memory_used)
+        breakdowns.append(response.get("timings_ms", {}))
 
     average_latency = sum(latencies) / len(latencies)
     average_memory_used = sum(memory_usage) / len(memory_usage)
@@ -116,7 +195,8 @@ def benchmark_standard(texts, source_lang, target_lang):
     return {
         "average_latency": average_latency,
         "average_memory_used": average_memory_used,
-        "throughput": throughput
+        "throughput": throughput,
+        "stage_times": mean_stage_times(breakdowns),
     }
 
 
@@ -129,15 +209,33 @@ def comparative_analysis(source_lang, target_lang):
     triton_metrics = asyncio.run(benchmark_triton(texts, source_lang, target_lang))
     print("Triton server metrics:", triton_metrics)
 
+    print("Benchmarking standard server (KServe v2)...")
+    kserve_metrics = asyncio.run(benchmark_triton(texts, source_lang, target_lang, STANDARD_KSERVE_URL))
+    print("Standard server (KServe v2) metrics:", kserve_metrics)
+
     print("Benchmarking standard server...")
     standard_metrics = benchmark_standard(texts, source_lang, target_lang)
     print("Standard server metrics:", standard_metrics)
 
+    # "Standard (KServe)" differs from "Triton Server" only in the backend, not the protocol
+    columns = (triton_metrics, kserve_metrics, standard_metrics)
     print("\nComparative Analysis:")
-    print(f"{'Metric':<25}{'Triton Server':<15}{'Standard Server':<15}")
-    print(f"{'Average Latency (ms)':<25}{triton_metrics['average_latency'] * 1000:<15.2f}{standard_metrics['average_latency'] * 1000:<15.2f}")
-    print(f"{'Average Memory Used (MB)':<25}{triton_metrics['average_memory_used']:<15.2f}{standard_metrics['average_memory_used']:<15.2f}")
-    print(f"{'Throughput (sentences/sec)':<25}{triton_metrics['throughput']:<15.2f}{standard_metrics['throughput']:<15.2f}")
+    print(f"{'Metric':<28}{'Triton Server':<18}{'Standard (KServe)':<18}{'Standard Server':<18}")
+    print(f"{'Average Latency (ms)':<28}" + "".join(f"{m['average_latency'] * 1000:<18.2f}" for m in columns))
+    print(f"{'Average Memory Used (MB)':<28}" + "".join(f"{m['average_memory_used']:<18.2f}" for m in columns))
+    print(f"{'Throughput (sentences/sec)':<28}" + "".join(f"{m['throughput']:<18.2f}" for m in columns))
+
+    # Server-side breakdown of the average latency; "other" is network, client
+    # work (tokenization for the tensor protocols) and unmeasured stages
+    print("\nLatency breakdown (ms):")
+    for stage in STAGES:
+        print(f"{'  ' + stage:<28}" + "".join(
+            f"{'n/a':<18}" if np.isnan(m['stage_times'][stage]) else f"{m['stage_times'][stage]:<18.2f}"
+            for m in columns
+        ))
+    print(f"{'  other':<28}" + "".join(
+        f"{m['average_latency'] * 1000 - np.nansum(list(m['stage_times'].values())):<18.2f}" for m in columns
+    ))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+"""
+Per-token decoding latency: eager `model.generate` vs. static KV caches with a
+compiled decoder step (nllb_serving.static_decoding) vs. finished-row
+compaction (nllb_serving.compaction), at several batch sizes.
+
+    python3 decode_benchmark.py --batch-sizes 1 8 32 --target asm_Beng
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from nllb_serving.compaction import CompactingDecoder
+from nllb_serving.static_decoding import StaticDecoder
+
+SENTENCES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sentences.txt")
+
+
+def time_decoding(generate, inputs, repeats):
+    """Return (seconds per decoder step, output ids) averaged over `repeats` runs."""
+    generate(inputs)  # warm-up (compiles the static path for this bucket)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        output_ids = generate(inputs)
+    elapsed = (time.perf_counter() - start_time) / repeats
+    # Every output position after the decoder start token is one decoder step
+    return elapsed / (output_ids.shape[1] - 1), output_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default="facebook/nllb-200-distilled-600M")
+    parser.add_argument("--source", default="eng_Latn")
+    parser.add_argument("--target", default="asm_Beng")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--max-length", type=int, default=128)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--compile-cache-dir", default=os.path.expanduser("~/.cache/nllb-serving/inductor"))
+    args = parser.parse_args()
+
+    with open(SENTENCES_FILE, "r") as file:
+        sentences = [line.strip() for line in file if line.strip()]
+    tokenizer = AutoTokenizer.from_pretrained(args.model, src_lang=args.source)
+    model = AutoModelForSeq2SeqLM.from_pretrained(args.model).eval()
+    forced_bos_token_id = tokenizer.convert_tokens_to_ids(args.target)
+    static = StaticDecoder(model, cache_dir=args.compile_cache_dir)
+    compactor = CompactingDecoder(model)
+    compaction_stats = {}
+
+    def eager(inputs):
+        with torch.no_grad():
+            return model.generate(**inputs, forced_bos_token_id=forced_bos_token_id, max_length=args.max_length)
+
+    def compiled(inputs):
+        return static.generate(
+            inputs["input_ids"], inputs["attention_mask"],
+            forced_bos_token_id=forced_bos_token_id, max_length=args.max_length,
+        )
+
+    def compacted(inputs):
+        output_ids, stats = compactor.generate(
+            inputs["input_ids"], inputs["attention_mask"],
+            forced_bos_token_id=forced_bos_token_id, max_length=args.max_length,
+        )
+        compaction_stats.update(stats)
+        return output_ids
+
+    print(f"{'Batch size':<12}{'Eager (ms/token)':<20}{'Static (ms/token)':<20}{'Speedup':<10}"
+          f"{'Compact (ms/token)':<20}{'Rows/step':<11}{'Same output'}")
+    for batch_size in args.batch_sizes:
+        batch = (sentences * (batch_size // len(sentences) + 1))[:batch_size]
+        inputs = tokenizer(batch, return_tensors="pt", padding=True)
+        eager_step, eager_ids = time_decoding(eager, inputs, args.repeats)
+        static_step, static_ids = time_decoding(compiled, inputs, args.repeats)
+        compact_step, compact_ids = time_decoding(compacted, inputs, args.repeats)
+        same = all(
+            eager_ids.shape == ids.shape and bool((eager_ids == ids).all()) for ids in (static_ids, compact_ids)
+        )
+        print(f"{batch_size:<12}{eager_step * 1000:<20.2f}{static_step * 1000:<20.2f}"
+              f"{eager_step / static_step:<10.2f}{compact_step * 1000:<20.2f}"
+              f"{compaction_stats['rows_per_step']:<11.2f}{same}")
+
+
+if __name__ == "__main__":
+    main()
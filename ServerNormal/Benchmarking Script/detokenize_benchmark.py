@@ -0,0 +1,73 @@
+"""
+Post-processing time of OUTPUT_IDS batches: `tokenizer.batch_decode` vs. the
+vectorized nllb_serving.detokenize.Detokenizer, at several batch sizes.
+
+The batches are laid out like generated output (decoder start token,
+target language code, tokens, EOS, padding), built by tokenizing the bundled
+sentences, so no model is needed.
+
+    python3 detokenize_benchmark.py --batch-sizes 1 8 32 128 --repeats 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from transformers import AutoTokenizer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from nllb_serving.detokenize import Detokenizer
+
+SENTENCES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sentences.txt")
+
+
+def output_batch(tokenizer, sentences, target_lang):
+    """Padded [batch, seq] int32 ids shaped like the model's OUTPUT_IDS."""
+    tokenizer.src_lang = target_lang
+    # NLLB encodes as [lang, tokens..., EOS]; generation starts with EOS as the decoder start token
+    rows = [[tokenizer.eos_token_id] + ids for ids in tokenizer(sentences)["input_ids"]]
+    width = max(len(row) for row in rows)
+    return np.array([row + [tokenizer.pad_token_id] * (width - len(row)) for row in rows], dtype=np.int32)
+
+
+def time_per_batch(decode, output_ids, repeats):
+    decode(output_ids)  # warm-up
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        texts = decode(output_ids)
+    return (time.perf_counter() - start_time) / repeats, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default="facebook/nllb-200-distilled-600M")
+    parser.add_argument("--target", default="asm_Beng")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(SENTENCES_FILE, "r") as file:
+        sentences = [line.strip() for line in file if line.strip()]
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    start_time = time.perf_counter()
+    detokenizer = Detokenizer(tokenizer)
+    print(f"Lookup tables for {len(detokenizer.pieces)} ids built in "
+          f"{(time.perf_counter() - start_time) * 1000:.1f} ms (once per process)")
+
+    def batch_decode(output_ids):
+        return tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+    print(f"{'Batch size':<12}{'batch_decode (ms)':<20}{'Detokenizer (ms)':<19}{'Speedup':<10}{'Same output'}")
+    for batch_size in args.batch_sizes:
+        batch = (sentences * (batch_size // len(sentences) + 1))[:batch_size]
+        output_ids = output_batch(tokenizer, batch, args.target)
+        reference_time, reference = time_per_batch(batch_decode, output_ids, args.repeats)
+        vectorized_time, texts = time_per_batch(detokenizer.decode, output_ids, args.repeats)
+        print(f"{batch_size:<12}{reference_time * 1000:<20.3f}{vectorized_time * 1000:<19.3f}"
+              f"{reference_time / vectorized_time:<10.2f}{texts == reference}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Parity and latency of the ONNX Runtime engine (nllb_serving.onnx_engine)
+against greedy PyTorch `model.generate`, on the bundled sentence files.
+
+    python3 -m nllb_serving export-onnx ~/nllb-onnx
+    python3 onnx_benchmark.py --onnx-model-dir ~/nllb-onnx --intra-op-threads 8 --batch-sizes 1 8
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import torch
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from nllb_serving.onnx_engine import OPTIMIZATION_LEVELS, OnnxEngine
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SENTENCE_FILES = sorted(glob.glob(os.path.join(SERVER_DIR, "*.txt"))) + [
+    os.path.join(SERVER_DIR, "Benchmarking Script", "sentences.txt")
+]
+
+
+def read_sentences(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def translate_all(generate, tokenizer, sentences, batch_size):
+    """Return (seconds, output id rows) for translating `sentences` in batches."""
+    outputs = []
+    start_time = time.perf_counter()
+    for start in range(0, len(sentences), batch_size):
+        inputs = tokenizer(sentences[start:start + batch_size], return_tensors="pt", padding=True)
+        output_ids = generate(inputs)
+        outputs.extend(row[row != tokenizer.pad_token_id].tolist() for row in output_ids)
+    return time.perf_counter() - start_time, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--onnx-model-dir", required=True, help="directory written by export-onnx")
+    parser.add_argument("--model", default="facebook/nllb-200-distilled-600M")
+    parser.add_argument("--source", default="eng_Latn")
+    parser.add_argument("--target", default="asm_Beng")
+    parser.add_argument("--files", nargs="+", default=SENTENCE_FILES, help="sentence files to translate")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--max-length", type=int, default=128)
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    parser.add_argument("--optimization-level", choices=OPTIMIZATION_LEVELS, default="all")
+    parser.add_argument("--torch-threads", type=int, help="torch.set_num_threads for the PyTorch path")
+    args = parser.parse_args()
+
+    if args.torch_threads:
+        torch.set_num_threads(args.torch_threads)
+    tokenizer = AutoTokenizer.from_pretrained(args.model, src_lang=args.source)
+    model = AutoModelForSeq2SeqLM.from_pretrained(args.model).eval()
+    engine = OnnxEngine(
+        args.onnx_model_dir, intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads,
+        optimization_level=args.optimization_level, providers=["CPUExecutionProvider"],
+    )
+    forced_bos_token_id = tokenizer.convert_tokens_to_ids(args.target)
+
+    def eager(inputs):
+        with torch.no_grad():
+            return model.generate(**inputs, forced_bos_token_id=forced_bos_token_id, max_length=args.max_length)
+
+    def onnx(inputs):
+        return engine.generate(
+            inputs["input_ids"], inputs["attention_mask"],
+            forced_bos_token_id=forced_bos_token_id, max_length=args.max_length,
+        )
+
+    # Warm-up, so neither side pays its first-run allocations in the table
+    warm_up = tokenizer(read_sentences(args.files[0])[:1], return_tensors="pt", padding=True)
+    eager(warm_up)
+    onnx(warm_up)
+
+    print(f"{'File':<16}{'Batch size':<12}{'Sentences':<11}{'PyTorch (s)':<13}{'ONNX (s)':<10}"
+          f"{'Speedup':<9}{'Identical'}")
+    for path in args.files:
+        sentences = read_sentences(path)
+        for batch_size in args.batch_sizes:
+            eager_time, eager_rows = translate_all(eager, tokenizer, sentences, batch_size)
+            onnx_time, onnx_rows = translate_all(onnx, tokenizer, sentences, batch_size)
+            identical = sum(a == b for a, b in zip(eager_rows, onnx_rows))
+            print(f"{os.path.basename(path):<16}{batch_size:<12}{len(sentences):<11}{eager_time:<13.2f}"
+                  f"{onnx_time:<10.2f}{eager_time / onnx_time:<9.2f}{identical}/{len(sentences)}")
+
+
+if __name__ == "__main__":
+    main()
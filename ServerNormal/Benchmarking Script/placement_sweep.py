@@ -0,0 +1,135 @@
+"""
+Sweep workers x threads splits of this host's CPU cores for CPU serving.
+
+Every split runs `workers` processes, each pinned by nllb_serving.placement
+and translating batches of the bundled sentences for a fixed time, and
+reports the combined throughput and per-batch latency. Use the best split for
+`python.py --workers N --threads-per-worker T` or a KIND_CPU instance group
+with `count: N` and `cpu_threads_per_instance`.
+
+    python3 placement_sweep.py --duration 30 --batch-size 8
+    python3 placement_sweep.py --splits 1x16 2x8 4x4 --placement compact
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from nllb_serving.metrics import percentile
+from nllb_serving.placement import POLICIES, apply_placement, cpu_topology, plan_placement
+
+SENTENCES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sentences.txt")
+
+
+def read_sentences(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def run_worker(index, placement, args, ready, results):
+    """Translate batches from the start signal until the duration is up; report (sentences, latencies)."""
+    apply_placement(placement)
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, src_lang=args.source)
+    model = AutoModelForSeq2SeqLM.from_pretrained(args.model).eval()
+    forced_bos_token_id = tokenizer.convert_tokens_to_ids(args.target)
+    sentences = read_sentences(args.file)
+    # Workers start at different offsets, so they do not all translate the same batch
+    start = index * args.batch_size
+
+    def translate(batch):
+        inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True, max_length=128)
+        with torch.no_grad():
+            model.generate(**inputs, forced_bos_token_id=forced_bos_token_id, max_length=128)
+
+    translate(sentences[:args.batch_size])  # warm-up
+    ready.wait()
+    translated, latencies = 0, []
+    deadline = time.perf_counter() + args.duration
+    while time.perf_counter() < deadline:
+        batch = [sentences[(start + i) % len(sentences)] for i in range(args.batch_size)]
+        started = time.perf_counter()
+        translate(batch)
+        latencies.append(time.perf_counter() - started)
+        translated += len(batch)
+        start += args.batch_size
+    results.put((translated, latencies))
+
+
+def run_split(workers, threads, args):
+    """Return (sentences per second, p50 and p95 batch latency) of one split."""
+    placements = plan_placement(workers, args.placement, threads)
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(workers + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker, args=(index, placement, args, ready, results))
+        for index, placement in enumerate(placements)
+    ]
+    for process in processes:
+        process.start()
+    # Timing starts once every worker has loaded its model
+    ready.wait()
+    translated, latencies = 0, []
+    for _ in processes:
+        count, worker_latencies = results.get()
+        translated += count
+        latencies.extend(worker_latencies)
+    for process in processes:
+        process.join()
+    return translated / args.duration, percentile(latencies, 50), percentile(latencies, 95)
+
+
+def default_splits(cores):
+    """workers x threads splits using every physical core: powers of two and the all-single-thread split."""
+    splits, workers = [], 1
+    while workers <= cores:
+        splits.append((workers, cores // workers))
+        workers *= 2
+    if splits[-1][0] != cores:
+        splits.append((cores, 1))
+    return splits
+
+
+def parse_split(text):
+    workers, _, threads = text.lower().partition("x")
+    return int(workers), int(threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default="facebook/nllb-200-distilled-600M")
+    parser.add_argument("--source", default="eng_Latn")
+    parser.add_argument("--target", default="asm_Beng")
+    parser.add_argument("--file", default=SENTENCES_FILE, help="sentences to translate, one per line")
+    parser.add_argument("--batch-size", type=int, default=8, help="sentences per batch in every worker")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds each split is measured")
+    parser.add_argument("--placement", choices=POLICIES, default="numa")
+    parser.add_argument("--splits", type=parse_split, nargs="+", metavar="WORKERSxTHREADS",
+                        help="splits to measure (default: powers of two using every physical core)")
+    args = parser.parse_args()
+
+    topology = cpu_topology()
+    cores = sum(len(node) for node in topology)
+    print(f"{cores} physical cores on {len(topology)} NUMA node(s) available to this process")
+    splits = args.splits or default_splits(cores)
+
+    print(f"{'Workers':<9}{'Threads':<9}{'Sentences/s':<13}{'p50 batch (ms)':<16}{'p95 batch (ms)'}")
+    results = []
+    for workers, threads in splits:
+        throughput, p50, p95 = run_split(workers, threads, args)
+        results.append((throughput, workers, threads, p95))
+        print(f"{workers:<9}{threads:<9}{throughput:<13.2f}{p50 * 1000:<16.1f}{p95 * 1000:.1f}")
+    # Ties go to the lower tail latency
+    throughput, workers, threads, p95 = max(results, key=lambda result: (result[0], -result[3]))
+    print(f"Best: {workers} workers x {threads} threads, {throughput:.2f} sentences/s (p95 {p95 * 1000:.1f} ms)")
+    print(f"  python3 python.py --workers {workers} --threads-per-worker {threads} --placement {args.placement}")
+
+
+if __name__ == "__main__":
+    main()
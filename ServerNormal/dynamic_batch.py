@@ -1,10 +1,18 @@
 import socket
 import json
+import sys
 import time
 import psutil
 import os
 
-BATCH_SIZE = 5  # Number of sentences to send in each batch
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nllb_serving.batching import batch_report, format_batch_report, pack_by_token_budget
+from nllb_serving.client.documents import TokenCounter
+from nllb_serving.protocol import MessageReader
+
+MAX_BATCH_TOKENS = 1024  # Budget for batch size x padded token length
+MAX_BATCH_SIZE = 32  # Upper bound on sentences per batch, whatever their length
 TIMEOUT_SECONDS = 10  # Timeout in seconds for batch processing
 
 def send_batch_request(batch_requests):
@@ -16,16 +24,15 @@ def send_batch_request(batch_requests):
 
         client_socket.send(request_data.encode())
         client_socket.settimeout(TIMEOUT_SECONDS)
-        response_data = client_socket.recv(4096).decode()
-
-        client_socket.close()
-
+        # Large batches do not fit in a single recv, so read the whole message
         try:
-            responses = json.loads(response_data)
-        except json.JSONDecodeError as e:
+            responses = MessageReader(client_socket).read() or []
+        except ValueError as e:
             # Handle the case where the response is not JSON
             print(f"Error decoding JSON: {e}")
             responses = []
+        finally:
+            client_socket.close()
     except ConnectionRefusedError:
         print("Connection to translation service refused.")
         responses = []
@@ -38,7 +45,7 @@ def send_batch_request(batch_requests):
 
     return responses
 
-def measure_metrics(batch_requests, results, index):
+def measure_metrics(batch_requests, results, indices):
     process = psutil.Process(os.getpid())
     initial_memory = process.memory_info().rss / (1024 * 1024)
 
@@ -54,42 +61,39 @@ def measure_metrics(batch_requests, results, index):
     memory_used = final_memory - initial_memory
     throughput = len(batch_requests) / latency
 
-    for i, response in enumerate(responses):
+    for i, request, response in zip(indices, batch_requests, responses):
         if isinstance(response, str):
             response = {'translated_text': response}  # Handle case where response is a string
-        original_text = batch_requests[i]['text']
-        translated_text = response.get('translated_text', 'Translation not available')
-        results[index + i] = (response, latency, memory_used, throughput, original_text)
+        results[i] = (response, latency, memory_used, throughput, request['text'])
 
 def process_file(file_path, source_lang, target_lang):
     with open(file_path, 'r') as file:
-        sentences = file.readlines()
+        sentences = [line.strip() for line in file]
 
-    results = [None] * len(sentences)
-    batch_requests = []
-    total_sentences = len(sentences)
+    # Batches are formed by token budget: length-bucketed sentences are packed
+    # until batch size x padded length would exceed MAX_BATCH_TOKENS.
+    count_tokens = TokenCounter()
+    lengths = [count_tokens(sentence) for sentence in sentences]
+    batches = pack_by_token_budget(lengths, MAX_BATCH_TOKENS, max_batch_size=MAX_BATCH_SIZE)
+    print(format_batch_report(batch_report(batches, lengths)))
 
-    for i, sentence in enumerate(sentences):
-        batch_requests.append({
-            'text': sentence.strip(),
+    results = [None] * len(sentences)
+    for batch in batches:
+        # The server drops work we would have given up on anyway
+        batch_requests = [{
+            'text': sentences[i],
             'source_lang': source_lang,
-            'target_lang': target_lang
-        })
-
-        if len(batch_requests) == BATCH_SIZE or i == total_sentences - 1:
-            print(f"Processing {len(batch_requests)} sentences with dynamic batching...")
-            measure_metrics(batch_requests, results, i - len(batch_requests) + 1)
-            batch_requests = []
+            'target_lang': target_lang,
+            'deadline_ms': TIMEOUT_SECONDS * 1000
+        } for i in batch]
+        print(f"Processing {len(batch_requests)} sentences with dynamic batching...")
+        measure_metrics(batch_requests, results, batch)
 
     total_latency = 0
     processed_count = 0  # Track how many sentences were actually processed
-    batch_index = 0
 
-    while batch_index < total_sentences:
-        batch_size = min(BATCH_SIZE, total_sentences - batch_index)
-        print(f"Processing {batch_size} sentences with dynamic batching...")
-
-        for result_index in range(batch_index, batch_index + batch_size):
+    for batch in batches:
+        for result_index in batch:
             result = results[result_index]
             if result is not None:  # Check if result is not None
                 response, latency, memory_used, throughput, original_text = result
@@ -103,8 +107,6 @@ def process_file(file_path, source_lang, target_lang):
             else:
                 print("Failed to process a sentence.")
 
-        batch_index += BATCH_SIZE
-
     if processed_count > 0:
         avg_latency = (total_latency / processed_count) * 1000
         throughput = processed_count / total_latency
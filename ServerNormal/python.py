@@ -1,77 +1,700 @@
+import argparse
+import atexit
+import contextlib
+import os
+import signal
 import socket
-import json
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import torch
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from transformers.modeling_outputs import BaseModelOutput
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nllb_serving.client.documents import TokenCounter
+from nllb_serving.compaction import CompactingDecoder
+from nllb_serving.detokenize import Detokenizer
+from nllb_serving.memory import MemoryBudget, MemoryEstimator, resolve_budget
+from nllb_serving.metrics import STAGE_BUCKETS, MetricsRegistry, serve_metrics
+from nllb_serving.onnx_engine import OPTIMIZATION_LEVELS as ONNX_OPTIMIZATION_LEVELS, OnnxEngine
+from nllb_serving.placement import POLICIES as PLACEMENT_POLICIES, apply_placement, plan_placement
+from nllb_serving.profiling import CaptureInProgress, ProfileCapture
+from nllb_serving.protocol import FRAME_MAGIC, MessageReader, encode_frame, encode_message, read_frame
+from nllb_serving.router import GrpcRouter, ReplicaSet, StandardRouter
+from nllb_serving.server import AIMDController, DeadlineExceeded, DynamicBatcher, InflightCoalescer, Overloaded
+from nllb_serving.server.kserve import KServeFrontend, serve_grpc, serve_http
+from nllb_serving.shortlist import VocabularyShortlist
+from nllb_serving.speculative import SpeculativeDecoder
+from nllb_serving.stages import stage, time_module, to_milliseconds
+from nllb_serving.static_decoding import StaticDecoder
+from nllb_serving.traffic import TrafficRecorder
 
 class NLLBInference:
-    def __init__(self, model_name="facebook/nllb-200-distilled-600M"):
+    def __init__(self, model_name="facebook/nllb-200-distilled-600M", draft_model_name=None, draft_length=4,
+                 metrics=None, static_decoding=False, compile_cache_dir=None, compact_decoding=False,
+                 onnx_model_dir=None, onnx_intra_op_threads=0, onnx_inter_op_threads=0,
+                 onnx_optimization_level="all", shortlist_path=None, shortlist_audit_interval=64):
         # Load the tokenizer and model from Hugging Face
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+        # Vectorized special-token stripping and table-driven id -> piece lookup
+        self.detokenizer = Detokenizer(self.tokenizer)
+        # Encoder passes count as the "encode" stage, however generation invokes them
+        time_module(self.model.get_encoder(), "encode")
+
+        # Optional speculative decoding: a small draft model with the same vocabulary
+        # proposes draft_length tokens that the model verifies in one pass
+        self.speculative = None
+        if draft_model_name:
+            draft_model = AutoModelForSeq2SeqLM.from_pretrained(draft_model_name)
+            time_module(draft_model.get_encoder(), "encode")
+            self.speculative = SpeculativeDecoder(self.model, draft_model, draft_length, metrics=metrics)
+
+        # Optional static decoding: preallocated KV caches per length bucket and a
+        # torch.compile'd decoder step, cached on disk across restarts
+        self.static_decoder = None
+        if static_decoding:
+            self.static_decoder = StaticDecoder(self.model, cache_dir=compile_cache_dir)
+
+        # Optional finished-row compaction: rows leave the batch (and its KV
+        # caches) as soon as they emit EOS instead of riding along to the end
+        self.compactor = None
+        if compact_decoding:
+            self.compactor = CompactingDecoder(self.model, metrics=metrics)
+
+        # Optional ONNX Runtime engine over graphs written by
+        # `python -m nllb_serving export-onnx`; it replaces the PyTorch greedy paths
+        self.onnx_engine = None
+        if onnx_model_dir:
+            self.onnx_engine = OnnxEngine(
+                onnx_model_dir, intra_op_threads=onnx_intra_op_threads, inter_op_threads=onnx_inter_op_threads,
+                optimization_level=onnx_optimization_level,
+            )
+
+        # Optional per-target-language vocabulary shortlists for the LM head,
+        # written by `python -m nllb_serving build-shortlist`
+        self.shortlist = None
+        if shortlist_path:
+            self.shortlist = VocabularyShortlist(
+                self.model, shortlist_path, audit_interval=shortlist_audit_interval, metrics=metrics
+            )
 
         # Print available language codes for debugging
         self.lang_code_to_id = self.tokenizer.lang_code_to_id
         print("Available language codes:", self.lang_code_to_id)
 
+    def _shortlisted(self, target_langs, max_length=None):
+        # The ONNX graphs and the compiled static steps keep the full LM head
+        single_static = self.static_decoder and not self.speculative and isinstance(target_langs, str)
+        if self.shortlist is None or self.onnx_engine or single_static:
+            return contextlib.nullcontext()
+        return self.shortlist.restrict(target_langs, max_length=max_length)
+
     def translate(self, text, source_lang, target_lang):
+        return self.translate_batch([text], source_lang, target_lang)[0]
+
+    def translate_batch(self, texts, source_lang, target_lang):
         # Ensure the target language code is valid
         if target_lang not in self.lang_code_to_id:
             raise ValueError(f"Target language code '{target_lang}' is not supported.")
 
-        # Set the source language for the tokenizer
-        self.tokenizer.src_lang = source_lang
+        with stage("tokenize"):
+            # Set the source language for the tokenizer
+            self.tokenizer.src_lang = source_lang
 
-        # Tokenize the input text
-        inputs = self.tokenizer(text, return_tensors="pt", padding=True)
+            # Tokenize the input text
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
         # Generate the translation
-        translated_tokens = self.model.generate(
-            **inputs,
-            forced_bos_token_id=self.lang_code_to_id[target_lang]
-        )
+        with stage("decode"), self._shortlisted(target_lang):
+            if self.speculative:
+                translated_tokens, _ = self.speculative.generate(
+                    inputs["input_ids"], inputs["attention_mask"],
+                    forced_bos_token_id=self.lang_code_to_id[target_lang]
+                )
+            elif self.static_decoder:
+                translated_tokens = self.static_decoder.generate(
+                    inputs["input_ids"], inputs["attention_mask"],
+                    forced_bos_token_id=self.lang_code_to_id[target_lang]
+                )
+            elif self.onnx_engine:
+                translated_tokens = self.onnx_engine.generate(
+                    inputs["input_ids"], inputs["attention_mask"],
+                    forced_bos_token_id=self.lang_code_to_id[target_lang]
+                )
+            elif self.compactor:
+                translated_tokens, _ = self.compactor.generate(
+                    inputs["input_ids"], inputs["attention_mask"],
+                    forced_bos_token_id=self.lang_code_to_id[target_lang]
+                )
+            else:
+                translated_tokens = self.model.generate(
+                    **inputs,
+                    forced_bos_token_id=self.lang_code_to_id[target_lang]
+                )
         # Decode the tokens to get the translated text
-        return self.tokenizer.batch_decode(translated_tokens, skip_special_tokens=True)[0]
+        with stage("detokenize"):
+            return self.detokenizer.decode(translated_tokens.cpu().numpy())
 
-def handle_client(client_socket):
+    def translate_targets(self, texts, source_lang, target_langs):
+        """
+        Translate each text into several target languages with one encoder pass.
+
+        Returns:
+            One {target_lang: translation} dict per text.
+        """
+        with stage("tokenize"):
+            self.tokenizer.src_lang = source_lang
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
+        with stage("decode"), self._shortlisted(target_langs):
+            translated_tokens = self._generate_targets(inputs["input_ids"], inputs["attention_mask"], target_langs)
+        with stage("detokenize"):
+            translations = self.detokenizer.decode(translated_tokens.cpu().numpy())
+        n = len(target_langs)
+        return [dict(zip(target_langs, translations[i * n:(i + 1) * n])) for i in range(len(texts))]
+
+    def _generate_targets(self, input_ids, attention_mask, target_langs, **generate_kwargs):
+        # The encoder runs once per row; its output is repeated for every target
+        # and all (row, target) pairs are decoded as one batch, each starting
+        # from its own language token. Output row i * n + j is input row i
+        # translated into target_langs[j].
+        for target_lang in target_langs:
+            if target_lang not in self.lang_code_to_id:
+                raise ValueError(f"Target language code '{target_lang}' is not supported.")
+        n = len(target_langs)
+        lang_ids = torch.tensor([self.lang_code_to_id[lang] for lang in target_langs]).repeat(len(input_ids))
+        decoder_input_ids = torch.stack(
+            [torch.full_like(lang_ids, self.model.config.decoder_start_token_id), lang_ids], dim=1
+        )
+        if self.onnx_engine:
+            return self.onnx_engine.generate(
+                input_ids, attention_mask, decoder_input_ids=decoder_input_ids, repeats=n, **generate_kwargs
+            )
+        with torch.no_grad():
+            encoder_outputs = self.model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask)
+
+        encoder_outputs = BaseModelOutput(
+            last_hidden_state=encoder_outputs.last_hidden_state.repeat_interleave(n, dim=0)
+        )
+        if self.compactor:
+            translated_tokens, _ = self.compactor.generate(
+                encoder_outputs=encoder_outputs,
+                attention_mask=attention_mask.repeat_interleave(n, dim=0),
+                decoder_input_ids=decoder_input_ids,
+                **generate_kwargs,
+            )
+            return translated_tokens
+        return self.model.generate(
+            encoder_outputs=encoder_outputs,
+            attention_mask=attention_mask.repeat_interleave(n, dim=0),
+            decoder_input_ids=decoder_input_ids,
+            **generate_kwargs,
+        )
+
+    def generate_ids(self, rows, target_lang, max_length=128):
+        """
+        Translate pre-tokenized inputs, as the Triton model does.
+
+        Args:
+            rows: Unpadded token id arrays, one per sentence.
+            target_lang: Target language code, or a tuple of codes to
+                translate every row into each of them.
+            max_length: Maximum length of the generated sequences.
+
+        Returns:
+            One int32 array of output ids per row, without trailing padding
+            (for several targets, one list of arrays per row, in target order).
+        """
+        multi_target = isinstance(target_lang, (list, tuple))
+        if not multi_target and target_lang not in self.lang_code_to_id:
+            raise ValueError(f"Target language code '{target_lang}' is not supported.")
+        pad_id = self.tokenizer.pad_token_id
+        # Padding the rows into one tensor is the last step of forming the batch
+        with stage("batch_formation"):
+            width = max(len(row) for row in rows)
+            input_ids = np.full((len(rows), width), pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(rows), width), dtype=np.int64)
+            for i, row in enumerate(rows):
+                input_ids[i, :len(row)] = row
+                attention_mask[i, :len(row)] = 1
+            input_ids, attention_mask = torch.from_numpy(input_ids), torch.from_numpy(attention_mask)
+        with stage("decode"), self._shortlisted(target_lang, max_length=max_length):
+            if multi_target:
+                translated_tokens = self._generate_targets(
+                    input_ids, attention_mask, target_lang, max_length=max_length
+                )
+            elif self.speculative:
+                translated_tokens, _ = self.speculative.generate(
+                    input_ids, attention_mask, forced_bos_token_id=self.lang_code_to_id[target_lang],
+                    max_length=max_length,
+                )
+            elif self.static_decoder:
+                translated_tokens = self.static_decoder.generate(
+                    input_ids, attention_mask, forced_bos_token_id=self.lang_code_to_id[target_lang],
+                    max_length=max_length,
+                )
+            elif self.onnx_engine:
+                translated_tokens = self.onnx_engine.generate(
+                    input_ids, attention_mask, forced_bos_token_id=self.lang_code_to_id[target_lang],
+                    max_length=max_length,
+                )
+            elif self.compactor:
+                translated_tokens, _ = self.compactor.generate(
+                    input_ids, attention_mask, forced_bos_token_id=self.lang_code_to_id[target_lang],
+                    max_length=max_length,
+                )
+            else:
+                translated_tokens = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    forced_bos_token_id=self.lang_code_to_id[target_lang],
+                    max_length=max_length,
+                )
+        # generate() pads to the longest output; trim each row to its own length
+        output_ids = translated_tokens.numpy().astype(np.int32)
+        lengths = output_ids.shape[1] - np.argmax((output_ids != pad_id)[:, ::-1], axis=1)
+        output_rows = [row[:length] for row, length in zip(output_ids, lengths)]
+        if multi_target:
+            n = len(target_lang)
+            return [output_rows[i * n:(i + 1) * n] for i in range(len(rows))]
+        return output_rows
+
+metrics = MetricsRegistry()
+# Shared with the batcher, which records the other stages
+stage_seconds = metrics.histogram(
+    'nllb_stage_seconds', "Time requests spend in each serving stage", buckets=STAGE_BUCKETS
+)
+# Optional request trace (--record-traffic) for nllb_serving's replay command
+recorder = None
+
+def error_response(e):
+    if isinstance(e, Overloaded):
+        return {'error': str(e), 'code': 'overloaded', 'retry_after_ms': round(e.retry_after * 1000)}
+    if isinstance(e, DeadlineExceeded):
+        return {'error': str(e), 'code': 'deadline_exceeded'}
+    return {'error': str(e)}
+
+def translate_requests(requests, arrival=None):
+    """
+    Translate a list of requests through the batcher, grouped by language pair.
+
+    A request with "target_langs" (a list) instead of "target_lang" is
+    translated into all of them and answered with a "translations" map.
+    Each request may set "priority" (lower is more urgent, default 0) and
+    "deadline_ms" (time budget counted from `arrival`). Requests still queued
+    when their deadline passes are dropped with a "deadline_exceeded" error.
+    With "timings": true the response carries a per-stage breakdown in
+    "timings_ms" (serialization is filled in by encode_response).
+
+    Returns one response dict per request, in request order.
+    """
+    arrival = time.monotonic() if arrival is None else arrival
+    responses = [None] * len(requests)
+    groups = {}
+    for i, request in enumerate(requests):
+        try:
+            priority = int(request.get('priority', 0))
+            deadline_ms = request.get('deadline_ms')
+            deadline = None if deadline_ms is None else arrival + float(deadline_ms) / 1000
+            if 'target_langs' in request:
+                key = ('targets', request['source_lang'], tuple(request['target_langs']))
+            else:
+                key = ('text', request['source_lang'], request['target_lang'])
+            groups.setdefault((key, priority, deadline), []).append((i, request['text']))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            responses[i] = {'error': f"Invalid request: {e!r}"}
+
+    # All groups are queued before waiting, so they can share batches with other clients.
+    # Admission is all-or-nothing for a message, so a client can retry it as a whole.
+    submissions = [
+        (key, [text for _, text in items], priority, deadline)
+        for (key, priority, deadline), items in groups.items()
+    ]
+    if recorder is not None:
+        for key, texts, _, _ in submissions:
+            record_traffic(key[1], key[2], texts, arrival)
+    try:
+        futures = submitter.submit_all(submissions)
+    except Overloaded as e:
+        return [response or error_response(e) for response in responses]
+    for items, future in zip(groups.values(), futures):
+        try:
+            translated = future.result()
+            for (i, _), translated_text in zip(items, translated):
+                if isinstance(translated_text, dict):
+                    responses[i] = {'translations': translated_text}
+                else:
+                    responses[i] = {'translated_text': translated_text}
+                if requests[i].get('timings'):
+                    responses[i]['timings_ms'] = to_milliseconds(future.timings)
+        except Exception as e:
+            for i, _ in items:
+                responses[i] = error_response(e)
+    return responses
+
+def handle_message(request, arrival=None):
+    # Control commands, e.g. {"command": "metrics"} or {"command": "profile", "duration_s": 10}
+    if isinstance(request, dict) and 'command' in request:
+        if request['command'] == 'metrics':
+            return metrics.snapshot()
+        if request['command'] == 'profile':
+            # Returns at once; the files are written when the capture ends
+            try:
+                return {'profile': profiler.start(request.get('duration_s', 10))}
+            except (CaptureInProgress, TypeError, ValueError) as e:
+                return {'error': str(e)}
+        return {'error': f"Unknown command '{request['command']}'"}
+    # A list is a client-side batch and gets a list of responses back
+    if isinstance(request, list):
+        return translate_requests(request, arrival)
+    return translate_requests([request], arrival)[0]
+
+def encode_response(response, encode=encode_message):
+    """
+    Serialize a response (or list of responses) with `encode`, timing it as
+    the "serialize" stage. Responses carrying "timings_ms" get that time
+    added and are serialized again.
+    """
+    start = time.perf_counter()
+    data = encode(response)
+    seconds = time.perf_counter() - start
+    stage_seconds.observe(seconds, stage='serialize')
+    timed = [r for r in (response if isinstance(response, list) else [response])
+             if isinstance(r, dict) and 'timings_ms' in r]
+    for r in timed:
+        r['timings_ms']['serialize'] = round(seconds * 1000, 3)
+    return encode(response) if timed else data
+
+def generate_rows(rows, target_lang, priority=0, deadline=None):
+    """
+    Queue pre-tokenized rows; returns (output id rows, stage timings).
+
+    With a tuple of target languages every row yields one output per target,
+    row-major: output i * n + j is row i in target_lang[j].
+    """
+    if recorder is not None and rows:
+        # Token rows start with the source language code
+        record_traffic(inference.tokenizer.convert_ids_to_tokens(int(rows[0][0])), target_lang, rows)
+    future = submitter.submit(('ids', target_lang), rows, priority, deadline)
+    outputs = future.result()
+    if isinstance(target_lang, tuple):
+        outputs = [output for per_row in outputs for output in per_row]
+    return outputs, future.timings
+
+def translate_ids(message, arrival):
+    """
+    Binary tensor mode: generate output ids for a frame of pre-tokenized rows.
+
+    Returns the response header and the output rows (None on error).
+    """
+    try:
+        rows = message['ids']
+        priority = int(message.get('priority', 0))
+        deadline_ms = message.get('deadline_ms')
+        deadline = None if deadline_ms is None else arrival + float(deadline_ms) / 1000
+        if 'target_langs' in message:
+            target_lang = tuple(message['target_langs'])
+        else:
+            target_lang = message['target_lang']
+    except (KeyError, TypeError, ValueError) as e:
+        return {'error': f"Invalid request: {e!r}"}, None
+    if not rows:
+        return {}, []
     try:
-        # Receive data from the client
-        data = client_socket.recv(1024).decode()
-        # Parse the JSON data
-        request = json.loads(data)
-        
-        text = request['text']
-        source_lang = request['source_lang']
-        target_lang = request['target_lang']
-
-        # Perform model inference
-        translated_text = inference.translate(text, source_lang, target_lang)
-
-        # Send the response back to the client
-        response = json.dumps({'translated_text': translated_text})
-        client_socket.send(response.encode())
+        outputs, timings = generate_rows(rows, target_lang, priority, deadline)
     except Exception as e:
-        # Handle any exceptions and send an error response
-        response = json.dumps({'error': str(e)})
-        client_socket.send(response.encode())
+        return error_response(e), None
+    return ({'timings_ms': to_milliseconds(timings)} if message.get('timings') else {}), outputs
+
+def handle_binary_client(client_socket):
+    # Binary tensor mode: one response frame per request frame
+    while True:
+        try:
+            message = read_frame(client_socket)
+        except ValueError as e:
+            # The stream cannot be resynchronized after a bad frame
+            client_socket.sendall(encode_frame({'error': str(e)}))
+            break
+        if message is None:
+            break
+        header, rows = translate_ids(message, time.monotonic())
+        client_socket.sendall(encode_response(header, lambda header: encode_frame(header, rows)))
+
+def handle_client(client_socket):
+    # Connections are kept alive: each newline-terminated JSON message gets one
+    # response until the client closes its end.
+    reader = MessageReader(client_socket)
+    try:
+        # The first byte selects the connection's mode: JSON or binary frames
+        first = client_socket.recv(1, socket.MSG_PEEK)
+        if first == FRAME_MAGIC[:1]:
+            handle_binary_client(client_socket)
+            return
+        while True:
+            try:
+                request = reader.read()
+            except ValueError as e:
+                client_socket.sendall(encode_message({'error': str(e)}))
+                continue
+            if request is None:
+                break
+            client_socket.sendall(encode_response(handle_message(request, time.monotonic())))
+    except OSError as e:
+        print(f"Connection error: {e}")
     finally:
         # Close the client connection
         client_socket.close()
 
+def infer_ids(input_ids, attention_mask, target_lang, priority=0, deadline=None):
+    """
+    KServe v2 inference: INT32 INPUT_IDS/ATTENTION_MASK in, (OUTPUT_IDS, stage timings) out.
+
+    Rows are queued individually, so tensor requests share batches with each
+    other; they never mix with text requests, which tokenize server-side.
+    """
+    rows = [ids[mask.astype(bool)] for ids, mask in zip(input_ids, attention_mask)]
+    outputs, timings = generate_rows(rows, target_lang, priority, deadline)
+    # Pad to [batch, max_len] like a single generate() call would
+    start = time.perf_counter()
+    width = max((len(row) for row in outputs), default=0)
+    output_ids = np.full((len(outputs), width), inference.tokenizer.pad_token_id, dtype=np.int32)
+    for i, row in enumerate(outputs):
+        output_ids[i, :len(row)] = row
+    timings = dict(timings, serialize=time.perf_counter() - start)
+    stage_seconds.observe(timings['serialize'], stage='serialize')
+    return output_ids, timings
+
+def run_batch(key, texts):
+    if key[0] == 'ids':
+        return inference.generate_ids(texts, key[1])
+    if key[0] == 'targets':
+        _, source_lang, target_langs = key
+        return inference.translate_targets(texts, source_lang, list(target_langs))
+    _, source_lang, target_lang = key
+    return inference.translate_batch(texts, source_lang, target_lang)
+
+def split_batch(key, texts):
+    # Multi-target keys decode one row per target language
+    target = key[2] if key[0] == 'targets' else key[1] if key[0] == 'ids' else None
+    targets = len(target) if isinstance(target, (list, tuple)) else 1
+    ranges, _ = memory_budget.split([count_batch_tokens(text) for text in texts], targets)
+    return ranges
+
+def record_traffic(source_lang, target_lang, items, arrival=None):
+    # Text is counted with the tokenizer, token rows by length
+    recorder.record(source_lang, target_lang, [count_recorded(item) for item in items], items, arrival)
+
+def token_counter():
+    count_text = TokenCounter()
+    def count_tokens(item):
+        # Text requests are counted with the tokenizer, tensor rows by length
+        return count_text(item) if isinstance(item, str) else len(item)
+    return count_tokens
+
+def worker_ports(args, index):
+    # Worker i listens on --worker-base-port + 10 * i, its metrics on +1 and KServe gRPC on +3
+    base = args.worker_base_port + 10 * index
+    return base, (base + 1 if args.metrics_port else 0), (base + 3 if args.kserve_grpc_port else 0)
+
+def run_workers(args):
+    """
+    Worker mode: start one pinned server process per worker and route the
+    JSON/binary port and the KServe gRPC port to them. Does not return.
+    """
+    if args.record_traffic:
+        raise SystemExit("--record-traffic is not supported with --workers; record on a single server or the client")
+    placements = plan_placement(args.workers, args.placement or "numa", args.threads_per_worker)
+    workers = []
+    for index, placement in enumerate(placements):
+        port, metrics_port, grpc_port = worker_ports(args, index)
+        print(f"Worker {index} on port {port}: {placement}")
+        # Later options override earlier ones, so the worker keeps every other setting
+        workers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + [
+            "--worker-index", str(index), "--host", "127.0.0.1", "--port", str(port),
+            "--metrics-port", str(metrics_port), "--kserve-http-port", "0", "--kserve-grpc-port", str(grpc_port),
+        ]))
+    atexit.register(lambda: [worker.terminate() for worker in workers])
+    # Exit through atexit on SIGTERM too, so the workers do not outlive the router
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    # Affinity keeps each language pair's batches on one worker while it keeps up
+    router_metrics = MetricsRegistry()
+    if args.metrics_port:
+        serve_metrics(router_metrics, args.host, args.metrics_port)
+    if args.kserve_grpc_port:
+        grpc_replicas = ReplicaSet([f"127.0.0.1:{worker_ports(args, i)[2]}" for i in range(args.workers)],
+                                   affinity=True, metrics=router_metrics)
+        grpc_router = GrpcRouter(grpc_replicas)
+        grpc_replicas.start_health_checks(grpc_router.check)
+        grpc_server = grpc_router.serve(args.host, args.kserve_grpc_port)  # referenced until exit
+    replicas = ReplicaSet([f"127.0.0.1:{worker_ports(args, i)[0]}" for i in range(args.workers)],
+                          affinity=True, metrics=router_metrics)
+    router = StandardRouter(replicas)
+    replicas.start_health_checks(router.check)
+    router.serve_forever(args.host, args.port, args.listen_backlog)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Standard NLLB translation server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8003)
+    parser.add_argument("--metrics-port", type=int, default=8004,
+                        help="port serving Prometheus metrics at /metrics (0 disables it)")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="sentences per model batch")
+    parser.add_argument("--max-queue-delay-ms", type=float, default=5.0,
+                        help="how long the oldest request may wait for a fuller batch")
+    parser.add_argument("--slo-ms", type=float,
+                        help="p95 latency objective; enables adaptive batch size and queue delay")
+    parser.add_argument("--max-queued-sentences", type=int, default=512,
+                        help="admission limit; beyond it requests get an 'overloaded' response")
+    parser.add_argument("--max-queued-tokens", type=int,
+                        help="admission limit on queued tokens (counted with the model tokenizer)")
+    parser.add_argument("--kserve-http-port", type=int, default=8005,
+                        help="port serving the KServe v2 HTTP/REST protocol (0 disables it)")
+    parser.add_argument("--kserve-grpc-port", type=int, default=8006,
+                        help="port serving the KServe v2 gRPC protocol (0 disables it)")
+    parser.add_argument("--draft-model",
+                        help="seq2seq model sharing the NLLB vocabulary; enables speculative decoding")
+    parser.add_argument("--draft-length", type=int, default=4,
+                        help="tokens proposed by the draft model per verification pass")
+    parser.add_argument("--static-decoding", action="store_true",
+                        help="decode with preallocated KV caches and a torch.compile'd decoder step")
+    parser.add_argument("--memory-budget-mb", default="auto",
+                        help="run batches whose estimated peak activation and KV-cache memory exceeds this many "
+                             "MB as sub-batches in sequence ('auto': 80%% of the memory available after loading the "
+                             "model, divided among --workers; 0 disables it)")
+    parser.add_argument("--compact-decoding", action="store_true",
+                        help="drop rows from the batch as soon as they finish instead of padding them along")
+    parser.add_argument("--onnx-model-dir",
+                        help="run the model on ONNX Runtime from graphs written by "
+                             "`python -m nllb_serving export-onnx`")
+    parser.add_argument("--onnx-intra-op-threads", type=int, default=0,
+                        help="ONNX Runtime threads per operator (0: one per physical core)")
+    parser.add_argument("--onnx-inter-op-threads", type=int, default=0,
+                        help="ONNX Runtime threads running independent operators in parallel")
+    parser.add_argument("--onnx-optimization-level", choices=ONNX_OPTIMIZATION_LEVELS, default="all",
+                        help="ONNX Runtime graph optimization level")
+    parser.add_argument("--shortlist",
+                        help="per-target-language vocabulary shortlists (see build-shortlist) for the LM head")
+    parser.add_argument("--shortlist-audit-interval", type=int, default=64,
+                        help="check every N-th shortlisted step against the full vocabulary (0 disables)")
+    parser.add_argument("--compile-cache-dir", default=os.path.expanduser("~/.cache/nllb-serving/inductor"),
+                        help="where compiled decoder steps are cached across restarts")
+    parser.add_argument("--profile-dir", default=os.path.expanduser("~/.cache/nllb-serving/profiles"),
+                        help="directory the 'profile' control command writes traces and stack files to")
+    parser.add_argument("--record-traffic",
+                        help="write a trace of arrival times, token lengths and language pairs to this file "
+                             "(.gz compresses it) for `python -m nllb_serving replay`")
+    parser.add_argument("--record-hash-content", action="store_true",
+                        help="add a content hash per sentence to the traffic trace")
+    parser.add_argument("--no-coalescing", action="store_true",
+                        help="queue every sentence, even when an identical one is already in flight")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="run this many model processes, each pinned to its own cores, behind a router on "
+                             "--port and --kserve-grpc-port (KServe HTTP is not served in this mode)")
+    parser.add_argument("--placement", choices=PLACEMENT_POLICIES,
+                        help="pin the model process(es) to cores by NUMA node ('numa'), in order ('compact') or "
+                             "not at all ('none'); default: numa with --workers, otherwise unpinned")
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="intra-op threads per model process (0: one per pinned physical core)")
+    parser.add_argument("--worker-base-port", type=int, default=18000,
+                        help="worker i listens on this port + 10 * i (metrics +1, KServe gRPC +3)")
+    parser.add_argument("--worker-index", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--listen-backlog", type=int, default=128)
+    parser.add_argument("--controller-max-batch-size", type=int, default=64)
+    parser.add_argument("--controller-max-queue-delay-ms", type=float, default=50.0)
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.workers > 1 and args.worker_index is None:
+        # This process only routes; the workers load the model
+        run_workers(args)
+
+    # Pinned cores and a matching thread count, before the model runs anything
+    placement = None
+    if args.worker_index is not None or args.placement:
+        placement = plan_placement(args.workers, args.placement or "numa", args.threads_per_worker)
+        placement = placement[args.worker_index or 0]
+        apply_placement(placement)
+        print(f"Placement: {placement}")
+
     # Initialize the NLLB inference class
-    inference = NLLBInference()
+    inference = NLLBInference(
+        draft_model_name=args.draft_model, draft_length=args.draft_length, metrics=metrics,
+        static_decoding=args.static_decoding, compile_cache_dir=args.compile_cache_dir,
+        compact_decoding=args.compact_decoding, onnx_model_dir=args.onnx_model_dir,
+        onnx_intra_op_threads=args.onnx_intra_op_threads or (placement.threads if placement else 0),
+        onnx_inter_op_threads=args.onnx_inter_op_threads,
+        onnx_optimization_level=args.onnx_optimization_level, shortlist_path=args.shortlist,
+        shortlist_audit_interval=args.shortlist_audit_interval,
+    )
+
+    # Batches estimated to need more memory than the budget are split, so a
+    # worst-case batch does not fail every request in it with out-of-memory
+    # Workers share the host (and device) memory, so each takes its part of an "auto" budget
+    budget_bytes = resolve_budget(args.memory_budget_mb, next(inference.model.parameters()).device,
+                                  shares=args.workers)
+    memory_budget = None
+    if budget_bytes:
+        memory_budget = MemoryBudget(MemoryEstimator.from_model(inference.model), budget_bytes, metrics=metrics)
+        count_batch_tokens = token_counter()
+        print(f"Memory budget per batch: {budget_bytes / 2 ** 20:.1f} MB")
+
+    controller = None
+    if args.slo_ms:
+        controller = AIMDController(
+            args.slo_ms / 1000,
+            max_batch_size=args.controller_max_batch_size,
+            max_delay=args.controller_max_queue_delay_ms / 1000,
+            metrics=metrics,
+        )
+    # One batcher thread owns the model; connection threads only queue work.
+    # Token admission uses its own tokenizer instance, not the model thread's.
+    batcher = DynamicBatcher(
+        run_batch,
+        max_batch_size=args.max_batch_size,
+        max_queue_delay=args.max_queue_delay_ms / 1000,
+        controller=controller,
+        metrics=metrics,
+        max_queued_sentences=args.max_queued_sentences,
+        max_queued_tokens=args.max_queued_tokens,
+        count_tokens=token_counter() if args.max_queued_tokens else None,
+        split_batch=split_batch if memory_budget else None,
+    ).start()
+    # Sentences identical to one already queued or running share its result
+    submitter = batcher if args.no_coalescing else InflightCoalescer(batcher, metrics=metrics)
+    if args.record_traffic:
+        count_recorded = token_counter()
+        recorder = TrafficRecorder(args.record_traffic, hash_content=args.record_hash_content, source="standard")
+    # Profiles are captured on the live process; torch.profiler runs on the batcher thread
+    profiler = ProfileCapture(args.profile_dir, run_on_model_thread=batcher.call_soon)
+    if args.metrics_port:
+        serve_metrics(metrics, args.host, args.metrics_port)
+    # KServe v2 endpoints share the batcher (and so the model) with the JSON protocol
+    kserve = KServeFrontend(infer_ids)
+    if args.kserve_http_port:
+        serve_http(kserve, args.host, args.kserve_http_port)
+    if args.kserve_grpc_port:
+        # grpc.Server stops when it is garbage collected, so keep a reference
+        grpc_server = serve_grpc(kserve, args.host, args.kserve_grpc_port)
 
     # Create a TCP socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # Bind the socket to an IP address and port 8000
-    server_socket.bind(('127.0.0.1', 8003))
-    # Start listening for incoming connections
-    server_socket.listen(5)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Bind the socket to the configured address (default 127.0.0.1:8003)
+    server_socket.bind((args.host, args.port))
+    # Start listening for incoming connections; overload is handled by admission
+    # control with explicit responses, not by refusing connections
+    server_socket.listen(args.listen_backlog)
 
-    print("Server listening on port 8003")
+    print(f"Server listening on port {args.port}")
 
     while True:
         # Accept a new client connection
         client_socket, addr = server_socket.accept()
         print(f"Connection from {addr}")
-        # Handle the client connection
-        handle_client(client_socket)
-
+        # Serve each connection on its own thread so pooled clients can share the server
+        threading.Thread(target=handle_client, args=(client_socket,), daemon=True).start()
@@ -0,0 +1 @@
+"""Shared client and serving code for the NLLB Triton vs standard server comparison."""
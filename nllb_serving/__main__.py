@@ -0,0 +1,4 @@
+from nllb_serving.cli import main
+
+if __name__ == "__main__":
+    main()
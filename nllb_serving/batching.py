@@ -0,0 +1,90 @@
+"""Grouping of variable-length sentences into batches."""
+
+
+def pack_by_length(lengths, batch_size):
+    """
+    Group items of similar length so each batch pads as little as possible.
+
+    Args:
+        lengths: Token length of every item.
+        batch_size: Maximum number of items per batch.
+
+    Returns:
+        List of batches, each a list of indices into `lengths`, longest first.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def pack_by_token_budget(lengths, max_tokens, max_batch_size=None, bucket_width=8):
+    """
+    Form batches whose padded size (batch size x longest length) fits a token budget.
+
+    Items are grouped into length buckets of `bucket_width` tokens, longest
+    bucket first, keeping arrival order within a bucket, and then packed
+    greedily, so short sentences travel in large batches and long ones in
+    small batches of similar cost. Only the bucket keys are sorted, and a
+    batch pads to at most `bucket_width - 1` tokens over its shortest item
+    unless it spans buckets. An item longer than the budget is sent on its own.
+
+    Args:
+        lengths: Token length of every item.
+        max_tokens: Budget for batch size x padded length.
+        max_batch_size: Optional cap on the number of items per batch.
+        bucket_width: Width of the length buckets in tokens.
+
+    Returns:
+        List of batches, each a list of indices into `lengths`.
+    """
+    buckets = {}
+    for i, length in enumerate(lengths):
+        buckets.setdefault(length // bucket_width, []).append(i)
+    order = [i for key in sorted(buckets, reverse=True) for i in buckets[key]]
+    batches, batch, padded_length = [], [], 0
+    for i in order:
+        longest = max(padded_length, lengths[i])
+        full = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (full or (len(batch) + 1) * longest > max_tokens):
+            batches.append(batch)
+            batch, longest = [], lengths[i]
+        batch.append(i)
+        padded_length = longest
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_report(batches, lengths):
+    """
+    Describe each batch: size, padded length and padding efficiency.
+
+    Efficiency is real tokens / padded tokens; 1.0 means no padding at all.
+    """
+    report = []
+    for batch in batches:
+        batch_lengths = [lengths[i] for i in batch]
+        padded_length = max(batch_lengths)
+        tokens = sum(batch_lengths)
+        report.append({
+            "size": len(batch),
+            "padded_length": padded_length,
+            "tokens": tokens,
+            "padded_tokens": padded_length * len(batch),
+            "efficiency": tokens / (padded_length * len(batch)) if padded_length else 1.0,
+        })
+    return report
+
+
+def format_batch_report(report):
+    """Render a batch_report as a table, with the overall efficiency in the last line."""
+    lines = [f"{'Batch':<7}{'Size':<7}{'Padded len':<12}{'Tokens':<9}{'Padded':<9}{'Efficiency'}"]
+    for n, row in enumerate(report):
+        lines.append(
+            f"{n:<7}{row['size']:<7}{row['padded_length']:<12}{row['tokens']:<9}"
+            f"{row['padded_tokens']:<9}{row['efficiency']:.1%}"
+        )
+    tokens = sum(row["tokens"] for row in report)
+    padded = sum(row["padded_tokens"] for row in report)
+    lines.append(f"Overall padding efficiency: {tokens / padded if padded else 1.0:.1%} "
+                 f"({tokens} tokens in {padded} padded slots, {len(report)} batches)")
+    return "\n".join(lines)
@@ -0,0 +1,329 @@
+"""
+Command line entry point: `python -m nllb_serving <command> ...`.
+
+Example:
+    python -m nllb_serving translate ServerNormal/sentences.txt \
+        --source eng_Latn --target asm_Beng --backend triton --concurrency 4
+"""
+import argparse
+import asyncio
+import atexit
+import time
+
+from nllb_serving.batching import batch_report, format_batch_report
+from nllb_serving.client import BACKENDS, BulkTranslationJob, RetryPolicy, TranslationClient
+from nllb_serving.client.documents import DEFAULT_MAX_SEGMENT_TOKENS
+from nllb_serving.corpus import TokenCorpus, compile_corpus
+from nllb_serving.protocol import STANDARD_SERVER_HOST, STANDARD_SERVER_PORT, TRITON_SERVER_URL
+from nllb_serving.traffic import SentencePool, TrafficRecorder, read_trace, replay
+
+
+def read_sentences(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def add_backend_arguments(parser):
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="standard")
+    parser.add_argument("--host", default=STANDARD_SERVER_HOST, help="standard server host")
+    parser.add_argument("--port", type=int, default=STANDARD_SERVER_PORT, help="standard server port")
+    parser.add_argument("--binary", action="store_true",
+                        help="standard server: send token ids in binary tensor mode (tokenize client-side)")
+    parser.add_argument("--url", default=TRITON_SERVER_URL, help="Triton gRPC endpoint")
+    parser.add_argument("--transport", choices=("stream", "unary"), default="stream",
+                        help="triton: one bidirectional gRPC stream carrying every request, "
+                             "or a unary call per request on pooled channels")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--batch-size", type=int, default=8, help="sentences per request")
+    parser.add_argument("--max-batch-tokens", type=int,
+                        help="form batches by token budget (batch size x padded length)")
+    parser.add_argument("--priority", type=int,
+                        help="server priority class, lower is more urgent (default 0, use 1 for bulk jobs)")
+    parser.add_argument("--deadline-ms", type=float,
+                        help="drop requests still queued on the server after this many milliseconds")
+    parser.add_argument("--max-attempts", type=int, default=8,
+                        help="attempts per request when the server answers 'overloaded'")
+    parser.add_argument("--corpus", action="append", default=[],
+                        help="compiled corpus (see compile-corpus) to take token ids from instead of "
+                             "tokenizing; may be given once per source language")
+    parser.add_argument("--record-traffic",
+                        help="triton: record every request sent to this trace file (.gz compresses it)")
+    parser.add_argument("--record-hash-content", action="store_true",
+                        help="add a content hash per sentence to the traffic trace")
+
+
+def make_client(args):
+    if args.backend == "triton":
+        options = {"url": args.url, "streaming": args.transport == "stream"}
+        if args.record_traffic:
+            recorder = TrafficRecorder(args.record_traffic, hash_content=args.record_hash_content, source="triton")
+            atexit.register(recorder.close)
+            options["recorder"] = recorder
+    else:
+        options = {"host": args.host, "port": args.port, "binary": args.binary}
+    if args.corpus:
+        # Only token id transports use it: Triton, and the standard server in binary mode
+        options["corpora"] = [TokenCorpus(path) for path in args.corpus]
+    options.update(
+        priority=args.priority, deadline_ms=args.deadline_ms, retry=RetryPolicy(max_attempts=args.max_attempts)
+    )
+    return TranslationClient(
+        args.backend, batch_size=args.batch_size, concurrency=args.concurrency,
+        max_batch_tokens=args.max_batch_tokens, **options
+    )
+
+
+def cmd_translate(args):
+    sentences = read_sentences(args.file)
+    print(f"Read {len(sentences)} sentences from {args.file}.")
+    client = make_client(args)
+    if args.max_batch_tokens:
+        lengths = [client.token_counter(sentence) for sentence in sentences]
+        print(format_batch_report(batch_report(client.plan_batches(sentences), lengths)))
+    start_time = time.time()
+    try:
+        if args.use_async:
+            async def run():
+                try:
+                    return await client.atranslate_batch(sentences, args.source, args.target)
+                finally:
+                    await client.aclose()
+
+            translations = asyncio.run(run())
+        else:
+            translations = client.translate_batch(sentences, args.source, args.target)
+    finally:
+        client.close()
+    total_time = time.time() - start_time
+
+    for original, translated in zip(sentences, translations):
+        print(f"Original: {original}")
+        print(f"Translated: {translated}")
+        print("---")
+    if sentences:
+        print(f"\nProcessed {len(sentences)} sentences in {total_time:.2f} seconds.")
+        print(f"Throughput: {len(sentences) / total_time:.2f} sentences/second")
+
+
+def cmd_bulk(args):
+    job = BulkTranslationJob(
+        make_client(args), args.input, args.output, args.source, args.target,
+        checkpoint_path=args.checkpoint, window=args.window, cache_size=args.cache_size,
+    )
+    stats = job.run()
+    if stats["resumed_from_line"]:
+        print(f"Resumed from line {stats['resumed_from_line']}.")
+    print(f"Translated {stats['lines']} lines ({stats['sent']} sent, "
+          f"{stats['deduplicated']} deduplicated) in {stats['seconds']:.2f} seconds.")
+
+
+def cmd_document(args):
+    documents = []
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as file:
+            documents.append(file.read())
+    with make_client(args) as client:
+        translations = client.translate_documents(
+            documents, args.source, args.target, max_tokens=args.max_tokens
+        )
+    for path, translation in zip(args.files, translations):
+        if args.suffix:
+            with open(path + args.suffix, "w", encoding="utf-8") as file:
+                file.write(translation)
+            print(f"Wrote {path + args.suffix}")
+        else:
+            print(translation)
+
+
+def cmd_compile_corpus(args):
+    if args.output and len(args.source) > 1:
+        raise SystemExit("--output can only be used with a single --source")
+    for source_lang in args.source:
+        start_time = time.time()
+        path = compile_corpus(args.file, source_lang, args.output)
+        corpus = TokenCorpus(path)
+        print(f"Wrote {path}: {len(corpus)} sentences, {corpus.metadata['tokens']} tokens "
+              f"in {time.time() - start_time:.2f} seconds.")
+
+
+def cmd_export_onnx(args):
+    from nllb_serving.onnx_engine import export_onnx
+
+    start_time = time.time()
+    export_onnx(args.model, args.output, opset=args.opset)
+    print(f"Exported {args.model} to {args.output} in {time.time() - start_time:.2f} seconds.")
+
+
+def cmd_build_shortlist(args):
+    from nllb_serving.shortlist import build_shortlists
+
+    texts = {}
+    for spec in args.text:
+        lang, sep, path = spec.partition("=")
+        if not sep:
+            raise SystemExit(f"--text expects LANG=FILE, got {spec!r}")
+        texts[lang] = path
+    report = build_shortlists(texts, args.output, coverage=args.coverage, min_coverage=args.min_coverage,
+                              holdout=args.holdout)
+    for lang, result in report.items():
+        status = "kept" if result["passed"] else "rejected, full vocabulary"
+        print(f"{lang}: {result['size']} tokens, held-out coverage {result['held_out_coverage']:.4f} ({status})")
+    print(f"Wrote {args.output}")
+
+
+def cmd_replay(args):
+    header, records = read_trace(args.trace)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit(f"{args.trace} has no requests")
+    client = make_client(args)
+    pool = SentencePool(read_sentences(args.sentences), client.token_counter)
+    recorded = records[-1]["t"] - records[0]["t"]
+    print(f"Replaying {len(records)} requests recorded over {recorded:.2f} seconds "
+          f"({header.get('source') or 'unknown'} server) at {args.speed:g}x speed.")
+
+    async def run():
+        try:
+            return await replay(records, client.backend, pool, speed=args.speed)
+        finally:
+            await client.aclose()
+
+    try:
+        stats = asyncio.run(run())
+    finally:
+        client.close()
+    print(f"Sent {stats['requests']} requests ({stats['sentences']} sentences) in {stats['seconds']:.2f} seconds, "
+          f"{stats['errors']} errors.")
+    if stats["first_error"]:
+        print(f"First error: {stats['first_error']}")
+    if stats["latency_p50"] is not None:
+        print(f"Latency p50 {stats['latency_p50'] * 1000:.1f} ms, p95 {stats['latency_p95'] * 1000:.1f} ms, "
+              f"p99 {stats['latency_p99'] * 1000:.1f} ms")
+    print(f"Largest send lag behind the recorded schedule: {stats['max_lag'] * 1000:.1f} ms")
+
+
+def cmd_route(args):
+    from nllb_serving.metrics import MetricsRegistry, serve_metrics
+    from nllb_serving.router import GrpcRouter, ReplicaSet, StandardRouter
+
+    metrics = MetricsRegistry()
+    replica_set = ReplicaSet(args.replica, affinity=args.affinity, affinity_slack=args.affinity_slack,
+                             failure_threshold=args.failure_threshold, metrics=metrics)
+    if args.metrics_port:
+        serve_metrics(metrics, args.host, args.metrics_port)
+    if args.backend == "triton":
+        router = GrpcRouter(replica_set)
+        replica_set.start_health_checks(router.check, args.health_interval)
+        router.serve(args.host, args.port or 9001).wait_for_termination()
+    else:
+        router = StandardRouter(replica_set)
+        replica_set.start_health_checks(router.check, args.health_interval)
+        router.serve_forever(args.host, args.port or 9003)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m nllb_serving")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    translate = commands.add_parser("translate", help="translate every line of a text file")
+    translate.add_argument("file", help="text file with one sentence per line")
+    translate.add_argument("-s", "--source", default="eng_Latn", help="source language code")
+    translate.add_argument("-t", "--target", default="asm_Beng", help="target language code")
+    translate.add_argument("--async", dest="use_async", action="store_true",
+                           help="use the asyncio client instead of a thread pool")
+    add_backend_arguments(translate)
+    translate.set_defaults(func=cmd_translate)
+
+    bulk = commands.add_parser("bulk", help="stream a large corpus to an output file, resumably")
+    bulk.add_argument("input", help="text file with one sentence per line")
+    bulk.add_argument("output", help="file receiving one translation per input line")
+    bulk.add_argument("-s", "--source", default="eng_Latn", help="source language code")
+    bulk.add_argument("-t", "--target", default="asm_Beng", help="target language code")
+    bulk.add_argument("--checkpoint", help="resume state file (default: OUTPUT.ckpt)")
+    bulk.add_argument("--window", type=int, default=1024, help="lines read and written per step")
+    bulk.add_argument("--cache-size", type=int, default=100000, help="distinct translations kept for dedup")
+    add_backend_arguments(bulk)
+    bulk.set_defaults(func=cmd_bulk)
+
+    document = commands.add_parser("document", help="translate whole documents, keeping their layout")
+    document.add_argument("files", nargs="+", help="documents to translate")
+    document.add_argument("-s", "--source", default="eng_Latn", help="source language code")
+    document.add_argument("-t", "--target", default="asm_Beng", help="target language code")
+    document.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_SEGMENT_TOKENS,
+                          help="longest segment sent to the model; longer sentences are chunked")
+    document.add_argument("--suffix", help="write each translation next to its input with this suffix")
+    add_backend_arguments(document)
+    document.set_defaults(func=cmd_document)
+
+    compile_parser = commands.add_parser(
+        "compile-corpus", help="tokenize a text file once into a memory-mapped corpus per source language"
+    )
+    compile_parser.add_argument("file", help="text file with one sentence per line")
+    compile_parser.add_argument("-s", "--source", action="append", required=True,
+                                help="source language code; repeat for several languages")
+    compile_parser.add_argument("-o", "--output", help="output path (one source language only; "
+                                                       "default: FILE stem + .SOURCE.nlbc)")
+    compile_parser.set_defaults(func=cmd_compile_corpus)
+
+    export_parser = commands.add_parser(
+        "export-onnx", help="export the model's encoder and decoder step for the ONNX Runtime engine"
+    )
+    export_parser.add_argument("output", help="directory receiving the ONNX graphs")
+    export_parser.add_argument("--model", default="facebook/nllb-200-distilled-600M",
+                               help="Hugging Face model name or path")
+    export_parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    export_parser.set_defaults(func=cmd_export_onnx)
+
+    shortlist_parser = commands.add_parser(
+        "build-shortlist", help="build per-target-language LM head vocabulary shortlists from reference text"
+    )
+    shortlist_parser.add_argument("output", help=".npz file receiving the shortlists")
+    shortlist_parser.add_argument("--text", action="append", required=True, metavar="LANG=FILE",
+                                  help="reference text in a target language, one sentence per line; repeat "
+                                       "for several languages")
+    shortlist_parser.add_argument("--coverage", type=float, default=0.999,
+                                  help="share of reference tokens the most frequent kept tokens must cover")
+    shortlist_parser.add_argument("--min-coverage", type=float, default=0.995,
+                                  help="held-out coverage below which a language keeps the full vocabulary")
+    shortlist_parser.add_argument("--holdout", type=float, default=0.1,
+                                  help="share of the sentences held out for the coverage check")
+    shortlist_parser.set_defaults(func=cmd_build_shortlist)
+
+    replay_parser = commands.add_parser(
+        "replay", help="send a recorded traffic trace with its original (or scaled) arrival times"
+    )
+    replay_parser.add_argument("trace", help="trace written by --record-traffic")
+    replay_parser.add_argument("--sentences", default="ServerNormal/sentences.txt",
+                               help="sentences picked by token length to stand in for the recorded ones")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="time scale; 2 replays twice as fast, 0.5 at half speed")
+    replay_parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    add_backend_arguments(replay_parser)
+    replay_parser.set_defaults(func=cmd_replay, concurrency=64)
+
+    route_parser = commands.add_parser(
+        "route", help="proxy requests to several replicas of a backend, least loaded first"
+    )
+    route_parser.add_argument("--backend", choices=sorted(BACKENDS), default="standard",
+                              help="protocol of the replicas: standard (JSON/binary) or triton (KServe gRPC)")
+    route_parser.add_argument("--replica", action="append", required=True, metavar="HOST:PORT",
+                              help="replica address; repeat for every replica")
+    route_parser.add_argument("--host", default="127.0.0.1", help="address the router listens on")
+    route_parser.add_argument("--port", type=int, help="router port (default: 9003 standard, 9001 triton)")
+    route_parser.add_argument("--affinity", action="store_true",
+                              help="send each language pair to the same replica while it is not overloaded")
+    route_parser.add_argument("--affinity-slack", type=int, default=4,
+                              help="outstanding requests a pair's replica may have beyond the least loaded one")
+    route_parser.add_argument("--health-interval", type=float, default=2.0, help="seconds between health checks")
+    route_parser.add_argument("--failure-threshold", type=int, default=3,
+                              help="consecutive failed checks or requests that eject a replica")
+    route_parser.add_argument("--metrics-port", type=int, default=0,
+                              help="port serving the router's Prometheus metrics (0 disables it)")
+    route_parser.set_defaults(func=cmd_route)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
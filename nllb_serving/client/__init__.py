@@ -0,0 +1,20 @@
+"""Client library for both serving backends."""
+from nllb_serving.client.bulk import BulkTranslationJob
+from nllb_serving.client.pool import AsyncConnectionPool, ConnectionPool
+from nllb_serving.client.retry import RetryPolicy
+from nllb_serving.client.standard import StandardBackend
+from nllb_serving.client.translation import BACKENDS, TranslationClient
+from nllb_serving.client.triton import TritonBackend
+from nllb_serving.protocol import TranslationError
+
+__all__ = [
+    "AsyncConnectionPool",
+    "BACKENDS",
+    "BulkTranslationJob",
+    "ConnectionPool",
+    "RetryPolicy",
+    "StandardBackend",
+    "TranslationClient",
+    "TranslationError",
+    "TritonBackend",
+]
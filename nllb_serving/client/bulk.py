@@ -0,0 +1,238 @@
+"""
+Streaming corpus translation with bounded memory and resumable checkpoints.
+
+The input is read lazily in windows of lines. Identical lines are sent once
+(within the in-flight set and through a bounded LRU of recent translations),
+at most `client.concurrency` requests are outstanding, and translated windows
+are appended to the output in input order. After every window the output is
+flushed and a checkpoint records the input byte offset and output size, so a
+restarted job truncates any partial write and continues from there. A
+checkpoint is only resumed for the same input and language pair, and only if
+the output still holds everything it records.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+
+
+def default_checkpoint_path(output_path):
+    return output_path + ".ckpt"
+
+
+def is_retryable(error):
+    """True for failures that a new attempt can get past: lost connections, timeouts, unavailable servers."""
+    if isinstance(error, (ConnectionError, asyncio.TimeoutError)):
+        return True
+    # tritonclient's InferenceServerException from a restarted server or a broken stream
+    status = getattr(error, "status", None)
+    return callable(status) and "UNAVAILABLE" in str(status() or "")
+
+
+class BulkTranslationJob:
+    """
+    Translate a (possibly multi-GB) text file line by line into `output_path`.
+
+    Args:
+        client: TranslationClient used for requests; its batch_size and
+            concurrency set the request size and the number in flight.
+        input_path: Text file with one sentence per line.
+        output_path: File receiving one translated line per input line.
+        source_lang: Source language code.
+        target_lang: Target language code.
+        checkpoint_path: Resume state file (default: `<output_path>.ckpt`).
+        window: Number of input lines read and written per step.
+        max_windows: Windows buffered ahead of the writer; bounds memory to
+            about `window * max_windows` lines.
+        cache_size: Number of recent distinct translations kept for dedup.
+        retries: Attempts per failed request before the job stops.
+    """
+
+    def __init__(self, client, input_path, output_path, source_lang, target_lang,
+                 checkpoint_path=None, window=1024, max_windows=4, cache_size=100000, retries=3):
+        self.client = client
+        self.input_path = input_path
+        self.output_path = output_path
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.checkpoint_path = checkpoint_path or default_checkpoint_path(output_path)
+        self.window = window
+        self.max_windows = max_windows
+        self.cache_size = cache_size
+        self.retries = retries
+        self.stats = {"lines": 0, "sent": 0, "deduplicated": 0, "resumed_from_line": 0, "seconds": 0.0}
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._semaphore = None
+
+    def load_checkpoint(self):
+        """
+        Saved state of an earlier run, or None if there is none.
+
+        Raises:
+            ValueError: The checkpoint belongs to another input file or
+                language pair, or the output it records is missing or shorter.
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+        if (state["source_lang"], state["target_lang"]) != (self.source_lang, self.target_lang):
+            raise ValueError(
+                f"Checkpoint {self.checkpoint_path} belongs to {state['source_lang']}->{state['target_lang']}"
+            )
+        input_path = os.path.abspath(self.input_path)
+        if state.get("input_path", input_path) != input_path:
+            raise ValueError(f"Checkpoint {self.checkpoint_path} belongs to input {state['input_path']}")
+        output_size = os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+        if output_size < state["output_size"]:
+            # Resuming would pad the missing translations with NUL bytes
+            raise ValueError(
+                f"{self.output_path} holds {output_size} of the {state['output_size']} bytes recorded in "
+                f"checkpoint {self.checkpoint_path}; delete the checkpoint to start over"
+            )
+        return state
+
+    def _save_checkpoint(self, state):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _windows(self, offset):
+        """Yield (lines, end_offset) windows starting at byte `offset` of the input."""
+        with open(self.input_path, "rb") as file:
+            file.seek(offset)
+            lines = []
+            for raw in file:
+                offset += len(raw)
+                lines.append(raw.decode("utf-8").rstrip("\r\n"))
+                if len(lines) == self.window:
+                    yield lines, offset
+                    lines = []
+            if lines:
+                yield lines, offset
+
+    def _remember(self, text, translation):
+        self._cache[text] = translation
+        self._cache.move_to_end(text)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _run_chunk(self, texts):
+        try:
+            for attempt in range(self.retries):
+                try:
+                    async with self._semaphore:
+                        translations = await self.client.backend.atranslate_chunk(
+                            texts, self.source_lang, self.target_lang
+                        )
+                    break
+                except Exception as e:
+                    if not is_retryable(e) or attempt == self.retries - 1:
+                        raise
+                    await asyncio.sleep(2 ** attempt)
+        except BaseException:
+            # The job stops at the first failed request; waiters are cancelled
+            for text in texts:
+                self._inflight.pop(text).cancel()
+            raise
+        self.stats["sent"] += len(texts)
+        for text, translation in zip(texts, translations):
+            self._remember(text, translation)
+            self._inflight.pop(text).set_result(translation)
+
+    def _submit_window(self, lines):
+        """Start requests for the lines that are neither cached nor already in flight."""
+        loop = asyncio.get_running_loop()
+        texts = [text for text in (line.strip() for line in lines) if text]
+        new_texts = []
+        for text in dict.fromkeys(texts):
+            if text not in self._cache and text not in self._inflight:
+                self._inflight[text] = loop.create_future()
+                new_texts.append(text)
+        self.stats["deduplicated"] += len(texts) - len(new_texts)
+
+        # Pin every result now: cached entries may be evicted before the window is written
+        pending = {}
+        for text in texts:
+            if text in self._inflight:
+                pending[text] = self._inflight[text]
+            elif text not in pending:
+                pending[text] = loop.create_future()
+                pending[text].set_result(self._cache[text])
+        batch_size = self.client.batch_size
+        tasks = [asyncio.ensure_future(self._run_chunk(new_texts[i:i + batch_size]))
+                 for i in range(0, len(new_texts), batch_size)]
+        return pending, tasks
+
+    async def _collect_window(self, lines, pending, tasks):
+        await asyncio.gather(*tasks)
+        return [pending[text].result() if text else "" for text in (line.strip() for line in lines)]
+
+    async def arun(self):
+        """Run (or resume) the job and return its statistics."""
+        start_time = time.time()
+        state = self.load_checkpoint() or {
+            "input_path": os.path.abspath(self.input_path),
+            "source_lang": self.source_lang,
+            "target_lang": self.target_lang,
+            "input_offset": 0,
+            "lines_done": 0,
+            "output_size": 0,
+            "complete": False,
+        }
+        self.stats["resumed_from_line"] = state["lines_done"]
+        if state["complete"]:
+            return self.stats
+
+        self._semaphore = asyncio.Semaphore(self.client.concurrency)
+        mode = "r+b" if state["output_size"] else "wb"
+        with open(self.output_path, mode) as output:
+            # Drop anything written after the last checkpoint
+            output.truncate(state["output_size"])
+            output.seek(state["output_size"])
+
+            buffered = deque()
+
+            async def flush_oldest():
+                lines, end_offset, pending, tasks = buffered.popleft()
+                translations = await self._collect_window(lines, pending, tasks)
+                output.write("".join(t.replace("\n", " ") + "\n" for t in translations).encode("utf-8"))
+                output.flush()
+                os.fsync(output.fileno())
+                state["input_offset"] = end_offset
+                state["lines_done"] += len(lines)
+                state["output_size"] = output.tell()
+                self._save_checkpoint(state)
+                self.stats["lines"] += len(lines)
+
+            try:
+                for lines, end_offset in self._windows(state["input_offset"]):
+                    buffered.append((lines, end_offset, *self._submit_window(lines)))
+                    if len(buffered) >= self.max_windows:
+                        await flush_oldest()
+                while buffered:
+                    await flush_oldest()
+            finally:
+                for _, _, _, tasks in buffered:
+                    for task in tasks:
+                        task.cancel()
+                await asyncio.gather(*(t for _, _, _, ts in buffered for t in ts), return_exceptions=True)
+
+        state["complete"] = True
+        self._save_checkpoint(state)
+        self.stats["seconds"] = time.time() - start_time
+        return self.stats
+
+    def run(self):
+        async def run():
+            try:
+                return await self.arun()
+            finally:
+                await self.client.aclose()
+
+        return asyncio.run(run())
@@ -0,0 +1,125 @@
+"""
+Document translation: sentence segmentation, chunking and reassembly.
+
+A document is split into a template of literal whitespace and segment slots.
+Sentences end at sentence punctuation followed by whitespace, or at any line
+break; a sentence longer than the token limit is cut into chunks, preferably
+after clause punctuation. Only the segments are translated, so the original
+whitespace and paragraph breaks survive reassembly unchanged.
+"""
+import functools
+import re
+
+from nllb_serving.protocol import TOKENIZER_NAME
+
+# Source sentences are kept below the 128-token limit of the Triton model so
+# that neither the input nor the (usually longer) output gets truncated.
+DEFAULT_MAX_SEGMENT_TOKENS = 96
+# Language tag and </s> added by the tokenizer to every segment
+SPECIAL_TOKENS_PER_SEGMENT = 2
+
+_SENTENCE_END = re.compile(r"[.!?…।॥。！？]+[\"'”’»)\]]*$")
+_CLAUSE_END = re.compile(r"[,;:—]+[\"'”’»)\]]*$")
+_ABBREVIATION = re.compile(r"^(?:[A-Z]|Mr|Mrs|Ms|Dr|Prof|St|Jr|Sr|vs|etc|e\.g|i\.e|No|Inc|Co|Corp|Ltd)\.$")
+_WHITESPACE = re.compile(r"(\s+)")
+
+
+class TokenCounter:
+    """
+    Count tokenizer tokens per word, caching the result for repeated words.
+
+    Args:
+        tokenizer: Hugging Face tokenizer; loaded from `TOKENIZER_NAME` if omitted.
+    """
+
+    def __init__(self, tokenizer=None):
+        if tokenizer is None:
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+        self.tokenizer = tokenizer
+        self.count_word = functools.lru_cache(maxsize=65536)(self._count_word)
+
+    def _count_word(self, word):
+        return len(self.tokenizer(word, add_special_tokens=False)["input_ids"])
+
+    def __call__(self, text):
+        return SPECIAL_TOKENS_PER_SEGMENT + sum(self.count_word(w) for w in text.split())
+
+
+def _ends_sentence(word):
+    return bool(_SENTENCE_END.search(word)) and not _ABBREVIATION.match(word)
+
+
+def _split_long(words, count_word, max_tokens):
+    """Cut a sentence into chunks of at most `max_tokens`; yields (start, end) word ranges."""
+    start, total, last_clause = 0, SPECIAL_TOKENS_PER_SEGMENT, None
+    j = 0
+    while j < len(words):
+        cost = count_word(words[j])
+        if total + cost > max_tokens and j > start:
+            end = last_clause + 1 if last_clause is not None else j
+            yield start, end
+            start, total, last_clause = end, SPECIAL_TOKENS_PER_SEGMENT, None
+            j = start
+            continue
+        total += cost
+        if _CLAUSE_END.search(words[j]):
+            last_clause = j
+        j += 1
+    yield start, len(words)
+
+
+def segment_document(text, count_word, max_tokens=DEFAULT_MAX_SEGMENT_TOKENS):
+    """
+    Split a document into translatable segments.
+
+    Args:
+        text: The document.
+        count_word: Callable returning the token count of one word.
+        max_tokens: Maximum tokens per segment, special tokens included.
+
+    Returns:
+        (template, segments): `template` is a list of literal strings and
+        integer indices into `segments`; see `assemble_document`.
+    """
+    template, segments = [], []
+    tokens = []  # alternating words and the whitespace between them
+
+    def emit_sentence():
+        trailing = tokens.pop() if len(tokens) % 2 == 0 else None
+        words, separators = tokens[0::2], tokens[1::2]
+        total = SPECIAL_TOKENS_PER_SEGMENT + sum(count_word(w) for w in words)
+        ranges = [(0, len(words))] if total <= max_tokens else _split_long(words, count_word, max_tokens)
+        for n, (start, end) in enumerate(ranges):
+            if n:
+                template.append(separators[start - 1])
+            pieces = [words[start]]
+            for k in range(start + 1, end):
+                pieces += [separators[k - 1], words[k]]
+            template.append(len(segments))
+            segments.append("".join(pieces))
+        if trailing is not None:
+            template.append(trailing)
+        tokens.clear()
+
+    for i, piece in enumerate(_WHITESPACE.split(text)):
+        if not piece:
+            continue
+        if i % 2 == 0:
+            tokens.append(piece)
+        elif not tokens:
+            template.append(piece)
+        elif "\n" in piece or _ends_sentence(tokens[-1]):
+            emit_sentence()
+            template.append(piece)
+        else:
+            tokens.append(piece)
+    if tokens:
+        emit_sentence()
+    return template, segments
+
+
+def assemble_document(template, translations):
+    """Rebuild a document from its template and the translated segments."""
+    return "".join(translations[item] if isinstance(item, int) else item for item in template)
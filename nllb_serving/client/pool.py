@@ -0,0 +1,112 @@
+"""Bounded pools of reusable connections (keep-alive sockets or gRPC clients)."""
+import asyncio
+import contextlib
+import threading
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool that hands out at most `max_size` connections at a time.
+
+    Idle connections are reused most-recently-used first, so a burst of
+    traffic keeps hitting warm sockets/channels instead of opening new ones.
+
+    Args:
+        factory: Zero-argument callable that opens a new connection.
+        max_size: Maximum number of connections checked out concurrently.
+        close: Callable used to close a connection (default: `conn.close()`).
+    """
+
+    def __init__(self, factory, max_size=8, close=None):
+        self._factory = factory
+        self._close = close or (lambda conn: conn.close())
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._closed = False
+        self.max_size = max_size
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """Check out a connection; it is discarded if the block raises."""
+        with self._slots:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._factory()
+            try:
+                yield conn
+            except BaseException:
+                self._close_quietly(conn)
+                raise
+            with self._lock:
+                if not self._closed:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                self._close_quietly(conn)
+
+    def clear(self):
+        """Close every idle connection, e.g. after the server restarted."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self.clear()
+
+    def _close_quietly(self, conn):
+        try:
+            self._close(conn)
+        except Exception:
+            pass
+
+
+class AsyncConnectionPool:
+    """
+    asyncio counterpart of ConnectionPool. Must be used from a single event loop.
+
+    Args:
+        factory: Coroutine function that opens a new connection.
+        max_size: Maximum number of connections checked out concurrently.
+        close: Coroutine function used to close a connection.
+    """
+
+    def __init__(self, factory, max_size=8, close=None):
+        self._factory = factory
+        self._close = close
+        self._slots = asyncio.Semaphore(max_size)
+        self._idle = []
+        self.max_size = max_size
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await self._factory()
+            try:
+                yield conn
+            except BaseException:
+                await self._close_quietly(conn)
+                raise
+            self._idle.append(conn)
+
+    async def clear(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._close_quietly(conn)
+
+    async def close(self):
+        await self.clear()
+
+    async def _close_quietly(self, conn):
+        if self._close is None:
+            return
+        try:
+            await self._close(conn)
+        except Exception:
+            pass
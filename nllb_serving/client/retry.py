@@ -0,0 +1,34 @@
+"""
+Backoff for requests refused with an "overloaded" response.
+
+Waits grow exponentially with full jitter, and never undercut the server's
+retry-after hint (itself jittered upwards), so clients refused at the same
+moment spread out instead of returning together as a retry storm.
+"""
+import random
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    Args:
+        max_attempts: Total attempts including the first one.
+        base_delay: Backoff ceiling of the first retry, in seconds.
+        max_delay: Upper bound of the backoff ceiling, in seconds.
+    """
+
+    def __init__(self, max_attempts=8, base_delay=0.05, max_delay=5.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry number `attempt` (0-based)."""
+        wait = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after:
+            wait = max(wait, retry_after * random.uniform(1.0, 1.5))
+        return wait
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
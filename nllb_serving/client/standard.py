@@ -0,0 +1,240 @@
+"""Backend for the standard Python server (ServerNormal/python.py)."""
+import asyncio
+import socket
+import time
+
+from nllb_serving.client.pool import AsyncConnectionPool, ConnectionPool
+from nllb_serving.client.retry import RetryPolicy
+from nllb_serving.client.tokenization import ClientTokenizer, regroup_targets
+from nllb_serving.protocol import (
+    STANDARD_SERVER_HOST,
+    STANDARD_SERVER_PORT,
+    ConnectionClosed,
+    MessageReader,
+    TranslationError,
+    aread_frame,
+    decode_message,
+    encode_frame,
+    encode_message,
+    make_request,
+    read_frame,
+    translated_text,
+)
+
+
+class _Connection:
+    """Keep-alive socket that exchanges one message at a time."""
+
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = MessageReader(self.sock)
+
+    def request(self, message):
+        self.sock.sendall(encode_message(message))
+        response = self.reader.read()
+        if response is None:
+            raise ConnectionClosed("Server closed the connection")
+        return response
+
+    def close(self):
+        self.sock.close()
+
+
+class _BinaryConnection(_Connection):
+    """Keep-alive socket in binary tensor mode; messages are frame headers with "ids" rows."""
+
+    def request(self, message):
+        message = dict(message)
+        self.sock.sendall(encode_frame(message, message.pop("ids")))
+        response = read_frame(self.sock)
+        if response is None:
+            raise ConnectionClosed("Server closed the connection")
+        return response
+
+
+class _AsyncConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host, port, timeout):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, limit=2 ** 24), timeout
+        )
+        return cls(reader, writer)
+
+    async def request(self, message):
+        self.writer.write(encode_message(message))
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionClosed("Server closed the connection")
+        return decode_message(line)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class _AsyncBinaryConnection(_AsyncConnection):
+    async def request(self, message):
+        message = dict(message)
+        self.writer.write(encode_frame(message, message.pop("ids")))
+        await self.writer.drain()
+        try:
+            return await aread_frame(self.reader)
+        except asyncio.IncompleteReadError:
+            raise ConnectionClosed("Server closed the connection")
+
+
+def overloaded_response(responses):
+    """Return the first "overloaded" response of a message, or None."""
+    for response in responses if isinstance(responses, list) else [responses]:
+        if isinstance(response, dict) and response.get("code") == "overloaded":
+            return response
+    return None
+
+
+class StandardBackend:
+    """
+    Talks to the standard server over pooled keep-alive TCP connections.
+
+    A chunk of sentences is sent as one list-valued message, which the server
+    translates as a single batch.
+
+    Args:
+        host: Server address (default: 127.0.0.1).
+        port: Server port (default: 8003).
+        max_connections: Maximum number of sockets open at once.
+        timeout: Socket timeout in seconds.
+        priority: Priority class of the requests, lower is more urgent; bulk
+            jobs should use a value above the interactive default 0.
+        deadline_ms: Per-request time budget after which the server sheds the
+            request instead of translating it.
+        retry: RetryPolicy for "overloaded" responses.
+        binary: Use binary tensor mode: sentences are tokenized here and sent
+            as int32 id arrays, and the server returns output ids, so it spends
+            no time on tokenization, detokenization or JSON.
+        max_length: Truncation length of the tokenized input in binary mode.
+        tokenizer: Preloaded tokenizer for binary mode; loaded from
+            `TOKENIZER_NAME` if omitted.
+        corpora: Compiled corpora (nllb_serving.corpus) whose sentences binary
+            mode sends without tokenizing them.
+    """
+
+    name = "standard"
+
+    def __init__(self, host=STANDARD_SERVER_HOST, port=STANDARD_SERVER_PORT, max_connections=8, timeout=60.0,
+                 priority=None, deadline_ms=None, retry=None, binary=False, max_length=128, tokenizer=None,
+                 corpora=()):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.priority = priority
+        self.deadline_ms = deadline_ms
+        self.retry = retry or RetryPolicy()
+        self.retries = 0
+        self.max_connections = max_connections
+        self.binary = binary
+        self._tokenization = ClientTokenizer(max_length, tokenizer, corpora)
+        self._connection_class = _BinaryConnection if binary else _Connection
+        self._async_connection_class = _AsyncBinaryConnection if binary else _AsyncConnection
+        self._pool = ConnectionPool(
+            lambda: self._connection_class(host, port, timeout), max_size=max_connections
+        )
+        self._apool = None
+        self._apool_loop = None
+
+    def _send(self, message):
+        # A pooled socket may have been closed by the server while idle; the
+        # failed connection is dropped by the pool, so retry once on a new one.
+        for attempt in range(2):
+            try:
+                with self._pool.acquire() as conn:
+                    return conn.request(message)
+            except ConnectionError:
+                if attempt:
+                    raise
+
+    def _request(self, message):
+        for attempt in range(self.retry.max_attempts):
+            responses = self._send(message)
+            overloaded = overloaded_response(responses)
+            if overloaded is None or attempt == self.retry.max_attempts - 1:
+                return responses
+            self.retries += 1
+            time.sleep(self.retry.delay(attempt, overloaded.get("retry_after_ms", 0) / 1000))
+
+    @property
+    def tokenizer(self):
+        return self._tokenization.tokenizer
+
+    def _messages(self, texts, source_lang, target_lang):
+        if self.binary:
+            # One frame per chunk; the source language is already in the ids
+            message = {"ids": self._tokenization.encode_rows(texts, source_lang)}
+            if isinstance(target_lang, (list, tuple)):
+                message["target_langs"] = list(target_lang)
+            else:
+                message["target_lang"] = target_lang
+            if self.priority is not None:
+                message["priority"] = self.priority
+            if self.deadline_ms is not None:
+                message["deadline_ms"] = self.deadline_ms
+            return message
+        return [make_request(t, source_lang, target_lang, self.priority, self.deadline_ms) for t in texts]
+
+    def _translations(self, responses, target_lang):
+        if self.binary:
+            if "error" in responses:
+                raise TranslationError(responses["error"], responses.get("code"))
+            return regroup_targets(self._tokenization.decode(responses["ids"]), target_lang)
+        return [translated_text(r) for r in responses]
+
+    def translate_chunk(self, texts, source_lang, target_lang):
+        responses = self._request(self._messages(texts, source_lang, target_lang))
+        return self._translations(responses, target_lang)
+
+    def _async_pool(self):
+        loop = asyncio.get_running_loop()
+        if self._apool is None or self._apool_loop is not loop:
+            self._apool = AsyncConnectionPool(
+                lambda: self._async_connection_class.open(self.host, self.port, self.timeout),
+                max_size=self.max_connections,
+                close=lambda conn: conn.close(),
+            )
+            self._apool_loop = loop
+        return self._apool
+
+    async def _asend(self, message):
+        pool = self._async_pool()
+        for attempt in range(2):
+            try:
+                async with pool.acquire() as conn:
+                    return await asyncio.wait_for(conn.request(message), self.timeout)
+            except ConnectionError:
+                if attempt:
+                    raise
+
+    async def _arequest(self, message):
+        for attempt in range(self.retry.max_attempts):
+            responses = await self._asend(message)
+            overloaded = overloaded_response(responses)
+            if overloaded is None or attempt == self.retry.max_attempts - 1:
+                return responses
+            self.retries += 1
+            await asyncio.sleep(self.retry.delay(attempt, overloaded.get("retry_after_ms", 0) / 1000))
+
+    async def atranslate_chunk(self, texts, source_lang, target_lang):
+        responses = await self._arequest(self._messages(texts, source_lang, target_lang))
+        return self._translations(responses, target_lang)
+
+    def close(self):
+        self._pool.close()
+
+    async def aclose(self):
+        if self._apool is not None:
+            await self._apool.close()
+            self._apool = None
@@ -0,0 +1,249 @@
+"""
+Bidirectional gRPC streaming transport for KServe v2 servers.
+
+A unary ModelInfer call opens an HTTP/2 stream per request and pays the RPC
+setup each time. `InferStream` keeps one ModelStreamInfer call open instead
+and writes every request onto it; responses come back in completion order
+and are matched to their requests by the request id, so any number of
+requests can be in flight on one stream. Triton accepts streaming requests
+for non-decoupled models such as Modelrepo/nllb (one response per request),
+and the standard server's gRPC port implements the same call.
+
+The generated GRPCInferenceService stub from `tritonclient[grpc]` is used
+directly rather than `InferenceServerClient.start_stream`: that callback
+API allows one stream per client and reports errors without the id of the
+request that failed.
+
+When the stream breaks (server restart, channel error), every request still
+in flight fails with an UNAVAILABLE InferenceServerException, which callers
+retry on a new stream.
+"""
+import asyncio
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+CHANNEL_OPTIONS = [("grpc.max_receive_message_length", -1), ("grpc.max_send_message_length", -1)]
+
+
+def build_stream_request(model_name, inputs, outputs, parameters=None, priority=None, timeout=None):
+    """
+    Create a ModelInferRequest with raw tensor contents.
+
+    Args:
+        model_name: Name of the model in the repository.
+        inputs: Input name -> int32 numpy array.
+        outputs: Names of the requested outputs.
+        parameters: String request parameters (e.g. target_lang).
+        priority: Triton priority level (1 is the highest), or None.
+        timeout: Queue timeout in microseconds, or None.
+    """
+    from tritonclient.grpc import service_pb2
+
+    request = service_pb2.ModelInferRequest(model_name=model_name)
+    for name, array in inputs.items():
+        request.inputs.add(name=name, datatype="INT32", shape=list(array.shape))
+        request.raw_input_contents.append(array.tobytes())
+    for name in outputs:
+        request.outputs.add(name=name)
+    for key, value in (parameters or {}).items():
+        request.parameters[key].string_param = value
+    # Triton's reserved parameters, as InferenceServerClient.infer sets them
+    if priority is not None:
+        request.parameters["priority"].uint64_param = priority
+    if timeout is not None:
+        request.parameters["timeout"].int64_param = timeout
+    return request
+
+
+def _stream_broken(error=None):
+    # The requests themselves did not fail, so whatever broke the stream is
+    # reported as UNAVAILABLE and retried
+    from tritonclient.utils import InferenceServerException
+
+    if error is None:
+        details = "Inference stream closed"
+    else:
+        details = f"Inference stream failed: {error.code()}: {error.details()}"
+    return InferenceServerException(msg=details, status="StatusCode.UNAVAILABLE")
+
+
+class InferStream:
+    """
+    One long-lived ModelStreamInfer call shared by any number of threads.
+
+    Args:
+        url: gRPC endpoint, host:port.
+        on_request: Callable(ModelInferRequest) run before each request is
+            written, e.g. to record traffic.
+    """
+
+    def __init__(self, url, on_request=None):
+        import grpc
+        from tritonclient.grpc import service_pb2_grpc
+
+        self._grpc = grpc
+        self.on_request = on_request
+        self._channel = grpc.insecure_channel(url, options=CHANNEL_OPTIONS)
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._error = None
+        stub = service_pb2_grpc.GRPCInferenceServiceStub(self._channel)
+        # The request iterator ends at the None sentinel written by close()
+        self._call = stub.ModelStreamInfer(iter(self._requests.get, None))
+        threading.Thread(target=self._read, name="infer-stream", daemon=True).start()
+
+    @property
+    def broken(self):
+        """True once the stream has failed or been closed."""
+        return self._error is not None
+
+    def submit(self, request):
+        """
+        Write a request onto the stream; its id is replaced by a stream-unique one.
+
+        Returns:
+            concurrent.futures.Future of the tritonclient InferResult.
+
+        Raises:
+            InferenceServerException: The stream is broken (UNAVAILABLE).
+        """
+        future = Future()
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            request.id = str(next(self._ids))
+            self._pending[request.id] = future
+        if self.on_request is not None:
+            self.on_request(request)
+        self._requests.put(request)
+        return future
+
+    def infer(self, request):
+        """Send a request and wait for its InferResult."""
+        return self.submit(request).result()
+
+    def _read(self):
+        from tritonclient.grpc import InferResult
+        from tritonclient.utils import InferenceServerException
+
+        try:
+            for response in self._call:
+                with self._lock:
+                    future = self._pending.pop(response.infer_response.id, None)
+                if future is None:
+                    continue
+                if response.error_message:
+                    future.set_exception(InferenceServerException(msg=response.error_message))
+                else:
+                    future.set_result(InferResult(response.infer_response))
+            error = _stream_broken()
+        except self._grpc.RpcError as e:
+            error = _stream_broken(e)
+        self._fail(error)
+
+    def _fail(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def close(self):
+        self._fail(_stream_broken())
+        self._requests.put(None)
+        self._channel.close()
+
+
+class AsyncInferStream:
+    """
+    asyncio counterpart of InferStream. Create it inside the event loop that uses it.
+
+    Args:
+        url: gRPC endpoint, host:port.
+        on_request: Callable(ModelInferRequest) run before each request is written.
+    """
+
+    def __init__(self, url, on_request=None):
+        import grpc.aio
+        from tritonclient.grpc import service_pb2_grpc
+
+        self._grpc = grpc
+        self.on_request = on_request
+        self._channel = grpc.aio.insecure_channel(url, options=CHANNEL_OPTIONS)
+        self._call = service_pb2_grpc.GRPCInferenceServiceStub(self._channel).ModelStreamInfer()
+        self._write_lock = asyncio.Lock()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._error = None
+        self._reader = asyncio.get_running_loop().create_task(self._read())
+
+    @property
+    def broken(self):
+        """True once the stream has failed or been closed."""
+        return self._error is not None
+
+    async def infer(self, request):
+        """
+        Send a request and wait for its InferResult.
+
+        Raises:
+            InferenceServerException: The request failed, or the stream
+                broke (UNAVAILABLE).
+        """
+        if self._error is not None:
+            raise self._error
+        request.id = str(next(self._ids))
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request.id] = future
+        if self.on_request is not None:
+            self.on_request(request)
+        try:
+            # grpc.aio allows one write in progress per call
+            async with self._write_lock:
+                await self._call.write(request)
+        except self._grpc.RpcError as e:
+            self._fail(_stream_broken(e))
+        except asyncio.InvalidStateError:
+            self._fail(_stream_broken())
+        return await future
+
+    async def _read(self):
+        from tritonclient.grpc import InferResult
+        from tritonclient.utils import InferenceServerException
+
+        try:
+            while True:
+                response = await self._call.read()
+                if response is self._grpc.aio.EOF:
+                    break
+                future = self._pending.pop(response.infer_response.id, None)
+                if future is None or future.done():
+                    continue
+                if response.error_message:
+                    future.set_exception(InferenceServerException(msg=response.error_message))
+                else:
+                    future.set_result(InferResult(response.infer_response))
+            error = _stream_broken()
+        except self._grpc.RpcError as e:
+            error = _stream_broken(e)
+        except asyncio.CancelledError:
+            error = _stream_broken()
+        self._fail(error)
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def close(self):
+        self._fail(_stream_broken())
+        self._reader.cancel()
+        await self._channel.close()
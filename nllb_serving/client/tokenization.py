@@ -0,0 +1,93 @@
+"""Client-side tokenization for backends that exchange token ids."""
+import threading
+
+import numpy as np
+
+from nllb_serving.detokenize import Detokenizer
+from nllb_serving.protocol import TOKENIZER_NAME
+
+
+class ClientTokenizer:
+    """
+    Lazily loaded model tokenizer, safe to share between threads.
+
+    Args:
+        max_length: Truncation length for encoded inputs.
+        tokenizer: Preloaded tokenizer; loaded from `TOKENIZER_NAME` if omitted.
+        corpora: Compiled corpora (nllb_serving.corpus.TokenCorpus). Texts
+            found in the corpus of their source language are not tokenized
+            again, and the tokenizer is not loaded until a text is missing.
+    """
+
+    def __init__(self, max_length=128, tokenizer=None, corpora=()):
+        self.max_length = max_length
+        self._tokenizer = tokenizer
+        self._detokenizer = None
+        self._lock = threading.Lock()
+        self._corpora = {}
+        for corpus in corpora:
+            if corpus.max_length != max_length:
+                raise ValueError(
+                    f"{corpus.path} was compiled with max_length {corpus.max_length}, not {max_length}"
+                )
+            self._corpora[corpus.source_lang] = corpus
+
+    def _corpus_indices(self, texts, source_lang):
+        corpus = self._corpora.get(source_lang)
+        if corpus is None:
+            return None, None
+        return corpus, corpus.indices(texts)
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+
+            with self._lock:
+                if self._tokenizer is None:
+                    self._tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+        return self._tokenizer
+
+    def encode(self, texts, source_lang):
+        """Return int32 (input_ids, attention_mask) arrays of shape [batch, seq]."""
+        corpus, indices = self._corpus_indices(texts, source_lang)
+        if indices is not None:
+            return corpus.batch(indices)
+        tokenizer = self.tokenizer
+        # src_lang is tokenizer state, so it must not change mid-call
+        with self._lock:
+            tokenizer.src_lang = source_lang
+            encoded = tokenizer(
+                texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+            )
+        return encoded["input_ids"].astype(np.int32), encoded["attention_mask"].astype(np.int32)
+
+    def encode_rows(self, texts, source_lang):
+        """Return one unpadded int32 id array per text."""
+        corpus, indices = self._corpus_indices(texts, source_lang)
+        if indices is not None:
+            return corpus.rows(indices)
+        input_ids, attention_mask = self.encode(texts, source_lang)
+        return [ids[:length] for ids, length in zip(input_ids, attention_mask.sum(axis=1))]
+
+    def decode(self, output_ids):
+        """Text of padded OUTPUT_IDS rows (or unpadded rows), without special tokens."""
+        if self._detokenizer is None:
+            tokenizer = self.tokenizer
+            with self._lock:
+                if self._detokenizer is None:
+                    self._detokenizer = Detokenizer(tokenizer)
+        return self._detokenizer.decode(output_ids)
+
+
+def regroup_targets(translations, target_lang):
+    """
+    Group the decoded rows of a multi-target request per input text.
+
+    Servers return len(target_lang) rows per input, row-major; a single
+    target language leaves `translations` as is.
+    """
+    if not isinstance(target_lang, (list, tuple)):
+        return translations
+    n = len(target_lang)
+    return [dict(zip(target_lang, translations[i:i + n])) for i in range(0, len(translations), n)]
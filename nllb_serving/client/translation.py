@@ -0,0 +1,183 @@
+"""Backend-independent translation API."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from nllb_serving.batching import pack_by_length, pack_by_token_budget
+from nllb_serving.client.documents import (
+    DEFAULT_MAX_SEGMENT_TOKENS,
+    TokenCounter,
+    assemble_document,
+    segment_document,
+)
+from nllb_serving.client.standard import StandardBackend
+from nllb_serving.client.triton import TritonBackend
+
+BACKENDS = {
+    StandardBackend.name: StandardBackend,
+    TritonBackend.name: TritonBackend,
+}
+
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most `size` items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class TranslationClient:
+    """
+    Translate text through either serving backend.
+
+    Args:
+        backend: "standard", "triton", or an already constructed backend object.
+        batch_size: Number of sentences sent per request by the batch methods.
+        concurrency: Maximum number of requests in flight at once.
+        max_batch_tokens: If set, batches are formed by token budget
+            (batch size x padded length) and batch_size only caps their size.
+        **backend_options: Passed to the backend constructor (host, port, url, ...).
+
+    The translate methods also accept a list of target languages and then
+    return {target_lang: translation} dicts; the servers encode each source
+    sentence once for all targets.
+
+    Example:
+        with TranslationClient("triton", concurrency=4) as client:
+            client.translate_batch(sentences, "eng_Latn", "asm_Beng")
+            client.translate("Hello", "eng_Latn", ["asm_Beng", "hin_Deva", "ben_Beng"])
+    """
+
+    def __init__(self, backend="standard", batch_size=8, concurrency=4, max_batch_tokens=None,
+                 **backend_options):
+        if isinstance(backend, str):
+            if backend not in BACKENDS:
+                raise ValueError(f"Unknown backend '{backend}', expected one of {sorted(BACKENDS)}")
+            backend_options.setdefault("max_connections", concurrency)
+            backend = BACKENDS[backend](**backend_options)
+        self.backend = backend
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self._executor = None
+        self._token_counter = None
+
+    def translate(self, text, source_lang, target_lang):
+        """Translate a single sentence."""
+        return self.backend.translate_chunk([text], source_lang, target_lang)[0]
+
+    def plan_batches(self, texts):
+        """Return the batches (lists of indices into `texts`) the batch methods will send."""
+        if self.max_batch_tokens is None:
+            return chunked(list(range(len(texts))), self.batch_size)
+        lengths = [self.token_counter(text) for text in texts]
+        return pack_by_token_budget(lengths, self.max_batch_tokens, max_batch_size=self.batch_size)
+
+    def _split(self, texts):
+        texts = list(texts)
+        batches = self.plan_batches(texts)
+        return batches, [[texts[i] for i in batch] for batch in batches]
+
+    @staticmethod
+    def _merge(batches, results):
+        merged = [None] * sum(len(batch) for batch in batches)
+        for batch, result in zip(batches, results):
+            for i, text in zip(batch, result):
+                merged[i] = text
+        return merged
+
+    def translate_batch(self, texts, source_lang, target_lang):
+        """Translate a list of sentences, keeping up to `concurrency` requests in flight."""
+        batches, chunks = self._split(texts)
+        return self._merge(batches, self._run_chunks(chunks, source_lang, target_lang))
+
+    def _run_chunks(self, chunks, source_lang, target_lang):
+        if len(chunks) <= 1 or self.concurrency <= 1:
+            return [self.backend.translate_chunk(c, source_lang, target_lang) for c in chunks]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="translate")
+        return list(self._executor.map(
+            lambda chunk: self.backend.translate_chunk(chunk, source_lang, target_lang), chunks
+        ))
+
+    @property
+    def token_counter(self):
+        if self._token_counter is None:
+            self._token_counter = TokenCounter(getattr(self.backend, "tokenizer", None))
+        return self._token_counter
+
+    def _plan_documents(self, documents, max_tokens):
+        """Segment documents and pack their distinct segments into length-sorted chunks."""
+        counter = self.token_counter
+        plans = [segment_document(doc, counter.count_word, max_tokens) for doc in documents]
+        unique = list(dict.fromkeys(seg for _, segments in plans for seg in segments))
+        lengths = [counter(seg) for seg in unique]
+        if self.max_batch_tokens is None:
+            batches = pack_by_length(lengths, self.batch_size)
+        else:
+            batches = pack_by_token_budget(lengths, self.max_batch_tokens, max_batch_size=self.batch_size)
+        return plans, [[unique[i] for i in batch] for batch in batches]
+
+    @staticmethod
+    def _assemble_documents(plans, chunks, results):
+        translated = {}
+        for chunk, result in zip(chunks, results):
+            translated.update(zip(chunk, result))
+        return [
+            assemble_document(template, [translated[seg] for seg in segments])
+            for template, segments in plans
+        ]
+
+    def translate_documents(self, documents, source_lang, target_lang, max_tokens=DEFAULT_MAX_SEGMENT_TOKENS):
+        """
+        Translate whole documents, keeping their whitespace and paragraph layout.
+
+        Sentences from all documents are segmented, over-long sentences are
+        chunked to `max_tokens`, and the distinct segments are sent in batches
+        of similar length.
+        """
+        plans, chunks = self._plan_documents(documents, max_tokens)
+        return self._assemble_documents(plans, chunks, self._run_chunks(chunks, source_lang, target_lang))
+
+    async def atranslate(self, text, source_lang, target_lang):
+        return (await self.backend.atranslate_chunk([text], source_lang, target_lang))[0]
+
+    async def atranslate_batch(self, texts, source_lang, target_lang):
+        """asyncio version of translate_batch."""
+        batches, chunks = self._split(texts)
+        return self._merge(batches, await self._arun_chunks(chunks, source_lang, target_lang))
+
+    async def _arun_chunks(self, chunks, source_lang, target_lang):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(chunk):
+            async with semaphore:
+                return await self.backend.atranslate_chunk(chunk, source_lang, target_lang)
+
+        return await asyncio.gather(*(run(c) for c in chunks))
+
+    async def atranslate_documents(self, documents, source_lang, target_lang,
+                                   max_tokens=DEFAULT_MAX_SEGMENT_TOKENS):
+        """asyncio version of translate_documents."""
+        plans, chunks = self._plan_documents(documents, max_tokens)
+        results = await self._arun_chunks(chunks, source_lang, target_lang)
+        return self._assemble_documents(plans, chunks, results)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.backend.close()
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+        self.close()
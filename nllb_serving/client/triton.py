@@ -0,0 +1,230 @@
+"""Backend for the Triton Inference Server model in Modelrepo/nllb."""
+import asyncio
+import json
+import threading
+import time
+
+from nllb_serving.client.pool import AsyncConnectionPool, ConnectionPool
+from nllb_serving.client.retry import RetryPolicy
+from nllb_serving.client.streaming import AsyncInferStream, InferStream, build_stream_request
+from nllb_serving.client.tokenization import ClientTokenizer, regroup_targets
+from nllb_serving.protocol import MODEL_NAME, TRITON_SERVER_URL
+
+
+def build_infer_inputs(module, input_ids, attention_mask):
+    """
+    Create the INPUT_IDS/ATTENTION_MASK inputs and OUTPUT_IDS request.
+
+    Args:
+        module: `tritonclient.grpc` or `tritonclient.grpc.aio`.
+        input_ids: int32 array of shape [batch, seq].
+        attention_mask: int32 array of shape [batch, seq].
+    """
+    inputs = [
+        module.InferInput("INPUT_IDS", input_ids.shape, "INT32"),
+        module.InferInput("ATTENTION_MASK", attention_mask.shape, "INT32"),
+    ]
+    inputs[0].set_data_from_numpy(input_ids)
+    inputs[1].set_data_from_numpy(attention_mask)
+    outputs = [module.InferRequestedOutput("OUTPUT_IDS")]
+    return inputs, outputs
+
+
+def is_overloaded(error):
+    """True if Triton refused a request because its queue is full (or the stream to it broke)."""
+    status = str(error.status() or "")
+    message = str(error.message()).lower()
+    # Errors on an inference stream carry only the message
+    return "UNAVAILABLE" in status or "maximum queue size" in message or "overloaded" in message
+
+
+class TritonBackend:
+    """
+    Talks to Triton over pooled gRPC channels.
+
+    Each pooled InferenceServerClient owns one HTTP/2 channel, so concurrent
+    calls reuse a fixed set of channels instead of dialling per request.
+    Tokenization happens client-side with the model's tokenizer.
+
+    With `streaming`, requests are written onto one long-lived
+    bidirectional ModelStreamInfer call instead (nllb_serving.client.streaming),
+    with any number of them in flight; the stream is reopened if it breaks.
+
+    Args:
+        url: Triton gRPC endpoint (default: 127.0.0.1:8001).
+        model_name: Name of the model in the Triton repository.
+        max_connections: Maximum number of gRPC channels open at once.
+        max_length: Truncation length for the tokenized input.
+        tokenizer: Preloaded tokenizer; loaded from `TOKENIZER_NAME` if omitted.
+        priority: Priority class, lower is more urgent (0 maps to Triton's
+            priority level 1, see `priority_levels` in config.pbtxt).
+        deadline_ms: Queue timeout after which Triton rejects the request.
+        retry: RetryPolicy for requests refused because the queue is full
+            (`max_queue_size` in config.pbtxt).
+        corpora: Compiled corpora (nllb_serving.corpus) whose sentences are
+            sent without tokenizing them.
+        recorder: TrafficRecorder (nllb_serving.traffic) that every request
+            sent is recorded to.
+        streaming: Send requests over a bidirectional gRPC stream instead of
+            unary calls on pooled channels.
+    """
+
+    name = "triton"
+
+    def __init__(self, url=TRITON_SERVER_URL, model_name=MODEL_NAME, max_connections=4,
+                 max_length=128, tokenizer=None, priority=None, deadline_ms=None, retry=None, corpora=(),
+                 recorder=None, streaming=False):
+        import tritonclient.grpc as grpcclient
+
+        self._grpc = grpcclient
+        self.url = url
+        self.model_name = model_name
+        self.max_length = max_length
+        self.max_connections = max_connections
+        self._tokenization = ClientTokenizer(max_length, tokenizer, corpora)
+        self.priority = priority
+        self.deadline_ms = deadline_ms
+        self.retry = retry or RetryPolicy()
+        self.retries = 0
+        self.recorder = recorder
+        self.streaming = streaming
+        self._stream = None
+        self._stream_lock = threading.Lock()
+        self._astream = None
+        self._pool = ConnectionPool(
+            lambda: self._recorded(grpcclient.InferenceServerClient(url)), max_size=max_connections
+        )
+        self._apool = None
+        self._apool_loop = None
+
+    @property
+    def tokenizer(self):
+        return self._tokenization.tokenizer
+
+    def _recorded(self, client):
+        if self.recorder is None:
+            return client
+        from nllb_serving.traffic import record_infer_calls
+
+        return record_infer_calls(client, self.recorder, self.tokenizer)
+
+    def _record_request(self, request):
+        from nllb_serving.traffic import record_request
+
+        record_request(self.recorder, request, self.tokenizer)
+
+    def _stream_request(self, input_ids, attention_mask, target_lang):
+        return build_stream_request(
+            inputs={"INPUT_IDS": input_ids, "ATTENTION_MASK": attention_mask}, outputs=("OUTPUT_IDS",),
+            **self._infer_options(target_lang),
+        )
+
+    def _sync_stream(self):
+        on_request = self._record_request if self.recorder is not None else None
+        with self._stream_lock:
+            if self._stream is None or self._stream.broken:
+                if self._stream is not None:
+                    self._stream.close()
+                self._stream = InferStream(self.url, on_request=on_request)
+            return self._stream
+
+    def _async_stream(self):
+        # Streams belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._astream is None or self._astream[1] is not loop or self._astream[0].broken:
+            on_request = self._record_request if self.recorder is not None else None
+            self._astream = (AsyncInferStream(self.url, on_request=on_request), loop)
+        return self._astream[0]
+
+    def encode(self, texts, source_lang):
+        return self._tokenization.encode(texts, source_lang)
+
+    def decode(self, output_ids):
+        return self._tokenization.decode(output_ids)
+
+    def _infer_options(self, target_lang):
+        if isinstance(target_lang, (list, tuple)):
+            # Triton parameters are scalars, so the list travels as JSON
+            parameters = {"target_langs": json.dumps(list(target_lang))}
+        else:
+            parameters = {"target_lang": target_lang}
+        options = {"model_name": self.model_name, "parameters": parameters}
+        if self.priority is not None:
+            options["priority"] = self.priority + 1
+        if self.deadline_ms is not None:
+            options["timeout"] = int(self.deadline_ms * 1000)
+        return options
+
+    def translate_chunk(self, texts, source_lang, target_lang):
+        input_ids, attention_mask = self.encode(texts, source_lang)
+        if self.streaming:
+            def infer():
+                return self._sync_stream().infer(self._stream_request(input_ids, attention_mask, target_lang))
+        else:
+            inputs, outputs = build_infer_inputs(self._grpc, input_ids, attention_mask)
+
+            def infer():
+                with self._pool.acquire() as client:
+                    return client.infer(inputs=inputs, outputs=outputs, **self._infer_options(target_lang))
+        for attempt in range(self.retry.max_attempts):
+            try:
+                result = infer()
+                break
+            except self._grpc.InferenceServerException as e:
+                if not is_overloaded(e) or attempt == self.retry.max_attempts - 1:
+                    raise
+                self.retries += 1
+                time.sleep(self.retry.delay(attempt))
+        return regroup_targets(self.decode(result.as_numpy("OUTPUT_IDS")), target_lang)
+
+    def _async_pool(self):
+        import tritonclient.grpc.aio as aioclient
+
+        loop = asyncio.get_running_loop()
+        if self._apool is None or self._apool_loop is not loop:
+            async def connect():
+                return self._recorded(aioclient.InferenceServerClient(self.url))
+
+            self._apool = AsyncConnectionPool(
+                connect, max_size=self.max_connections, close=lambda client: client.close()
+            )
+            self._apool_loop = loop
+        return self._apool, aioclient
+
+    async def atranslate_chunk(self, texts, source_lang, target_lang):
+        input_ids, attention_mask = self.encode(texts, source_lang)
+        if self.streaming:
+            async def infer():
+                return await self._async_stream().infer(self._stream_request(input_ids, attention_mask, target_lang))
+        else:
+            pool, aioclient = self._async_pool()
+            inputs, outputs = build_infer_inputs(aioclient, input_ids, attention_mask)
+
+            async def infer():
+                async with pool.acquire() as client:
+                    return await client.infer(inputs=inputs, outputs=outputs, **self._infer_options(target_lang))
+        for attempt in range(self.retry.max_attempts):
+            try:
+                result = await infer()
+                break
+            except self._grpc.InferenceServerException as e:
+                if not is_overloaded(e) or attempt == self.retry.max_attempts - 1:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.retry.delay(attempt))
+        return regroup_targets(self.decode(result.as_numpy("OUTPUT_IDS")), target_lang)
+
+    def close(self):
+        self._pool.close()
+        with self._stream_lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+    async def aclose(self):
+        if self._apool is not None:
+            await self._apool.close()
+            self._apool = None
+        if self._astream is not None:
+            await self._astream[0].close()
+            self._astream = None
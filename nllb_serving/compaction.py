@@ -0,0 +1,125 @@
+"""
+Greedy decoding that drops finished rows from the batch.
+
+With `model.generate`, a row that emits EOS early is still decoded (and its
+output thrown away) until the longest row of the batch finishes. The
+CompactingDecoder removes a row as soon as it finishes: its slices of the
+self- and cross-attention KV caches, the encoder states and the attention
+mask are dropped, so every later decoder step, including the LM head, only
+runs on rows that are still generating. The output matches greedy
+`model.generate`.
+"""
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+
+def _select_cache(past, indices):
+    """Keep only the batch rows `indices` of a decoder KV cache."""
+    if hasattr(past, "batch_select_indices"):
+        past.batch_select_indices(indices)
+        return past
+    # Legacy tuples: tensors of [batch, heads, seq, dim] per layer
+    return tuple(tuple(tensor.index_select(0, indices) for tensor in layer) for layer in past)
+
+
+class CompactingDecoder:
+    """
+    Greedy decoding of a seq2seq model with finished-row compaction.
+
+    Args:
+        model: Seq2seq model, e.g. NLLB-200, in eval mode.
+        metrics: Optional MetricsRegistry for step and row counters.
+    """
+
+    def __init__(self, model, metrics=None):
+        self.model = model
+        self.eos_token_id = model.config.eos_token_id
+        self.pad_token_id = model.config.pad_token_id
+        if metrics is not None:
+            self._steps = metrics.counter("nllb_compaction_decode_steps_total", "Decoder steps run")
+            self._row_steps = metrics.counter(
+                "nllb_compaction_row_steps_total", "Rows decoded, summed over decoder steps"
+            )
+            self._padded_row_steps = metrics.counter(
+                "nllb_compaction_padded_row_steps_total",
+                "Rows a padded batch would have decoded, summed over decoder steps",
+            )
+        else:
+            self._steps = self._row_steps = self._padded_row_steps = None
+
+    def generate(self, input_ids=None, attention_mask=None, forced_bos_token_id=None, decoder_input_ids=None,
+                 encoder_outputs=None, max_length=None):
+        """
+        Decode greedily; the output matches `model.generate` with greedy search.
+
+        Args:
+            input_ids: Encoder input ids, [batch, seq]; not needed with encoder_outputs.
+            attention_mask: Encoder attention mask, [batch, seq].
+            forced_bos_token_id: Token forced after the decoder start token
+                (the NLLB target language code).
+            decoder_input_ids: Explicit decoder prefix, [batch, prefix]; overrides
+                forced_bos_token_id.
+            encoder_outputs: Precomputed encoder output (e.g. repeated for
+                several targets); the encoder is not run again.
+            max_length: Maximum output length including the prefix (default:
+                the model's generation_config.max_length).
+
+        Returns:
+            (output_ids, stats): output ids padded with pad_token_id after EOS,
+            and a dict with "steps", "row_steps" (rows actually decoded, summed
+            over steps) and "rows_per_step" (their average).
+        """
+        max_length = max_length or self.model.generation_config.max_length
+        with torch.no_grad():
+            if encoder_outputs is None:
+                encoder_outputs = self.model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask)
+            encoder_states = encoder_outputs.last_hidden_state
+            batch, device = encoder_states.shape[0], encoder_states.device
+            if decoder_input_ids is None:
+                prefix = [self.model.config.decoder_start_token_id]
+                if forced_bos_token_id is not None:
+                    prefix.append(forced_bos_token_id)
+                decoder_input_ids = torch.tensor([prefix] * batch, device=device)
+
+            sequences = torch.full((batch, max_length), self.pad_token_id, dtype=decoder_input_ids.dtype,
+                                   device=device)
+            length = decoder_input_ids.shape[1]
+            sequences[:, :length] = decoder_input_ids
+            # Original row of every row still in the batch
+            rows = torch.arange(batch, device=device)
+            tokens, past = decoder_input_ids, None
+            steps = row_steps = 0
+            while length < max_length:
+                out = self.model(
+                    encoder_outputs=BaseModelOutput(last_hidden_state=encoder_states),
+                    attention_mask=attention_mask,
+                    decoder_input_ids=tokens,
+                    past_key_values=past,
+                    use_cache=True,
+                )
+                past = out.past_key_values
+                next_tokens = out.logits[:, -1].argmax(dim=-1)
+                sequences[rows, length] = next_tokens
+                length += 1
+                steps += 1
+                row_steps += len(rows)
+
+                running = next_tokens != self.eos_token_id
+                if not running.all():
+                    if not running.any():
+                        break
+                    keep = running.nonzero().squeeze(1)
+                    rows = rows[keep]
+                    next_tokens = next_tokens[keep]
+                    encoder_states = encoder_states.index_select(0, keep)
+                    if attention_mask is not None:
+                        attention_mask = attention_mask.index_select(0, keep)
+                    past = _select_cache(past, keep)
+                tokens = next_tokens[:, None]
+
+        stats = {"steps": steps, "row_steps": row_steps, "rows_per_step": row_steps / steps if steps else 0.0}
+        if self._steps is not None:
+            self._steps.inc(steps)
+            self._row_steps.inc(row_steps)
+            self._padded_row_steps.inc(steps * batch)
+        return sequences[:, :length], stats
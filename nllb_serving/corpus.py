@@ -0,0 +1,179 @@
+"""
+Pre-tokenized, memory-mapped sentence corpora.
+
+`compile_corpus` tokenizes a text file (one sentence per line, as the clients
+read it) once per source language and writes a single binary file:
+
+    b"NLBC" | uint32 version | uint32 header length | JSON header (space-padded)
+    int64 text offsets [n + 1] | int64 token offsets [n + 1]
+    int32 tokens [total] | UTF-8 text
+
+`TokenCorpus` maps the file read-only, so loading it costs no tokenizer and
+no parsing. Rows are views into the mapping; a single sentence is a ready
+[1, seq] INPUT_IDS tensor without any copy, and only multi-row batches are
+copied to pad them.
+"""
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+CORPUS_MAGIC = b"NLBC"
+CORPUS_VERSION = 1
+CORPUS_SUFFIX = ".nlbc"
+_PREFIX = struct.Struct("<4sII")
+_CHUNK = 1024
+
+
+def corpus_path(text_path, source_lang):
+    """Default compiled corpus path: sentences.txt -> sentences.eng_Latn.nlbc."""
+    return os.path.splitext(text_path)[0] + f".{source_lang}{CORPUS_SUFFIX}"
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _padded(data, start=0, alignment=8):
+    # Pad `data`, written at offset `start`, so whatever follows it is aligned
+    return data + b" " * (-(start + len(data)) % alignment)
+
+
+def compile_corpus(text_path, source_lang, output_path=None, tokenizer=None):
+    """
+    Tokenize a text corpus for one source language and write it as a compiled corpus.
+
+    Args:
+        text_path: Text file with one sentence per line (blank lines skipped).
+        source_lang: NLLB source language code.
+        output_path: Where to write it (default: corpus_path(text_path, source_lang)).
+        tokenizer: ClientTokenizer to use; a default one is created if omitted.
+
+    Returns:
+        The output path.
+    """
+    from nllb_serving.client.tokenization import ClientTokenizer
+    from nllb_serving.protocol import TOKENIZER_NAME
+
+    tokenizer = tokenizer or ClientTokenizer()
+    output_path = output_path or corpus_path(text_path, source_lang)
+    with open(text_path, "r", encoding="utf-8") as file:
+        sentences = [line.strip() for line in file if line.strip()]
+
+    rows = []
+    for start in range(0, len(sentences), _CHUNK):
+        rows.extend(tokenizer.encode_rows(sentences[start:start + _CHUNK], source_lang))
+    texts = [sentence.encode("utf-8") for sentence in sentences]
+    token_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=token_offsets[1:])
+    text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in texts], out=text_offsets[1:])
+
+    header = _padded(json.dumps({
+        "source_lang": source_lang,
+        "tokenizer": getattr(tokenizer.tokenizer, "name_or_path", TOKENIZER_NAME),
+        "max_length": tokenizer.max_length,
+        "pad_token_id": tokenizer.tokenizer.pad_token_id,
+        "sentences": len(rows),
+        "tokens": int(token_offsets[-1]),
+        "text_bytes": int(text_offsets[-1]),
+        "source_file": os.path.basename(text_path),
+        "source_sha256": _file_sha256(text_path),
+    }).encode("utf-8"), _PREFIX.size)
+    # Written under a temporary name, so readers never map a partial file
+    with open(output_path + ".tmp", "wb") as file:
+        file.write(_PREFIX.pack(CORPUS_MAGIC, CORPUS_VERSION, len(header)))
+        file.write(header)
+        file.write(text_offsets.tobytes())
+        file.write(token_offsets.tobytes())
+        file.write(_padded(np.concatenate(rows or [np.zeros(0, np.int32)]).astype("<i4").tobytes()))
+        file.write(b"".join(texts))
+    os.replace(output_path + ".tmp", output_path)
+    return output_path
+
+
+class TokenCorpus:
+    """
+    A compiled corpus, memory-mapped read-only.
+
+    Args:
+        path: File written by compile_corpus.
+
+    Raises:
+        ValueError: The file is not a compiled corpus of a supported version.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, header_length = _PREFIX.unpack(bytes(self._map[:_PREFIX.size]))
+        if magic != CORPUS_MAGIC or version != CORPUS_VERSION:
+            raise ValueError(f"{path} is not a version {CORPUS_VERSION} compiled corpus")
+        offset = _PREFIX.size
+        self.metadata = json.loads(bytes(self._map[offset:offset + header_length]))
+        offset += header_length
+        n = self.metadata["sentences"] + 1
+        self.text_offsets = self._map[offset:offset + 8 * n].view("<i8")
+        offset += 8 * n
+        self.token_offsets = self._map[offset:offset + 8 * n].view("<i8")
+        offset += 8 * n
+        self.tokens = self._map[offset:offset + 4 * self.metadata["tokens"]].view("<i4")
+        offset += 4 * self.metadata["tokens"] + (-4 * self.metadata["tokens"] % 8)
+        self._text = self._map[offset:offset + self.metadata["text_bytes"]]
+        self._index = None
+
+    @property
+    def source_lang(self):
+        return self.metadata["source_lang"]
+
+    @property
+    def max_length(self):
+        return self.metadata["max_length"]
+
+    def __len__(self):
+        return self.metadata["sentences"]
+
+    def matches(self, text_path):
+        """True if the corpus was compiled from the current contents of `text_path`."""
+        return self.metadata["source_sha256"] == _file_sha256(text_path)
+
+    def text(self, index):
+        return bytes(self._text[self.text_offsets[index]:self.text_offsets[index + 1]]).decode("utf-8")
+
+    def row(self, index):
+        """Token ids of one sentence, a view into the mapping."""
+        return self.tokens[self.token_offsets[index]:self.token_offsets[index + 1]]
+
+    def rows(self, indices):
+        return [self.row(index) for index in indices]
+
+    def batch(self, indices):
+        """
+        Padded int32 (input_ids, attention_mask) of shape [batch, seq], like
+        ClientTokenizer.encode. A single row is returned without copying it.
+        """
+        rows = self.rows(indices)
+        if len(rows) == 1:
+            return rows[0][None], np.ones((1, len(rows[0])), dtype=np.int32)
+        width = max((len(row) for row in rows), default=0)
+        input_ids = np.full((len(rows), width), self.metadata["pad_token_id"], dtype=np.int32)
+        attention_mask = np.zeros((len(rows), width), dtype=np.int32)
+        for i, row in enumerate(rows):
+            input_ids[i, :len(row)] = row
+            attention_mask[i, :len(row)] = 1
+        return input_ids, attention_mask
+
+    def indices(self, texts):
+        """Corpus index of every text, or None if any of them is not in the corpus."""
+        if self._index is None:
+            self._index = {self.text(i): i for i in range(len(self))}
+        try:
+            return [self._index[text] for text in texts]
+        except KeyError:
+            return None
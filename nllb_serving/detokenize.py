@@ -0,0 +1,126 @@
+"""
+Vectorized post-processing of generated token ids.
+
+`tokenizer.batch_decode(ids, skip_special_tokens=True)` walks every row in
+Python, converting ids through the vocabulary and filtering special tokens
+one at a time. `Detokenizer` does the same work per batch instead:
+
+* padding and every special id (EOS, BOS, unknown, language codes) are
+  dropped from the whole batch at once with a NumPy mask, and
+* the remaining ids are mapped to text through an id -> piece table built
+  once from the vocabulary, with one str.join per row.
+
+NLLB's SentencePiece pieces mark word starts with "▁"; the table holds
+the pieces with that marker already turned into a space, and the leading
+space of each row is dropped, as the tokenizer's Metaspace decoder does.
+Tokenizers whose decoder has a ByteFallback step spell characters outside the
+vocabulary as byte pieces ("<0xE0>"); runs of them are joined into UTF-8
+text the same way, with one U+FFFD per byte of a run that is not valid UTF-8.
+`ServerNormal/Benchmarking Script/detokenize_benchmark.py` checks the output
+against batch_decode and compares their speed.
+"""
+import re
+
+import numpy as np
+
+WORD_START = "▁"
+BYTE_PIECE = re.compile(r"<0x([0-9A-Fa-f]{2})>")
+
+
+def _fuse_bytes(pieces, values):
+    """Replace each run of byte pieces (values >= 0) with the text its bytes encode."""
+    fused, run = [], []
+    for piece, value in zip(pieces, values):
+        if value >= 0:
+            run.append(value)
+            continue
+        if run:
+            fused.append(_decode_run(run))
+            run = []
+        fused.append(piece)
+    if run:
+        fused.append(_decode_run(run))
+    return fused
+
+
+def _decode_run(run):
+    try:
+        return bytes(run).decode("utf-8")
+    except UnicodeDecodeError:
+        return "\ufffd" * len(run)
+
+
+class Detokenizer:
+    """
+    Id -> text lookup tables of a tokenizer.
+
+    Args:
+        tokenizer: SentencePiece-based Hugging Face tokenizer (NLLB).
+    """
+
+    def __init__(self, tokenizer):
+        size = len(tokenizer)
+        pieces = tokenizer.convert_ids_to_tokens(list(range(size)))
+        self.pieces = np.array([(piece or "").replace(WORD_START, " ") for piece in pieces], dtype=object)
+        # One extra slot stands for ids outside the vocabulary, which are dropped too
+        self.special = np.zeros(size + 1, dtype=bool)
+        self.special[[i for i in tokenizer.all_special_ids if 0 <= i < size]] = True
+        self.special[size] = True
+        self._clean_up = None
+        if getattr(tokenizer, "clean_up_tokenization_spaces", False):
+            self._clean_up = tokenizer.clean_up_tokenization
+        # Byte value of every byte piece (-1 for other pieces), if the decoder joins them
+        self.byte_values = None
+        decoder = getattr(getattr(tokenizer, "backend_tokenizer", None), "decoder", None)
+        if "ByteFallback" in repr(decoder):
+            self.byte_values = np.full(size, -1, dtype=np.int16)
+            for i, piece in enumerate(pieces):
+                match = BYTE_PIECE.fullmatch(piece or "")
+                if match:
+                    self.byte_values[i] = int(match.group(1), 16)
+
+    def strip(self, output_ids):
+        """
+        Drop padding, special and out-of-vocabulary ids from every row.
+
+        Args:
+            output_ids: [batch, seq] array, or a list of rows of any length.
+
+        Returns:
+            (ids, lengths): the kept ids of all rows concatenated, and the
+            number kept per row.
+        """
+        if isinstance(output_ids, np.ndarray) and output_ids.ndim == 2:
+            flat = output_ids.ravel()
+            row_lengths = np.full(len(output_ids), output_ids.shape[1])
+        else:
+            rows = [np.asarray(row, dtype=np.int64).ravel() for row in output_ids]
+            flat = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+            row_lengths = np.array([len(row) for row in rows], dtype=np.int64)
+        size = len(self.pieces)
+        flat = np.where((flat >= 0) & (flat < size), flat, size)
+        keep = ~self.special[flat]
+        # Kept ids per row from the running count of kept ids at the row ends
+        kept = np.concatenate(([0], np.cumsum(keep)))
+        ends = np.cumsum(row_lengths)
+        return flat[keep], kept[ends] - kept[ends - row_lengths]
+
+    def decode(self, output_ids):
+        """Text of every row; the same as batch_decode with skip_special_tokens=True."""
+        ids, lengths = self.strip(output_ids)
+        pieces = self.pieces[ids].tolist()
+        values = None
+        if self.byte_values is not None:
+            values = self.byte_values[ids]
+            values = values.tolist() if (values >= 0).any() else None
+        texts, start = [], 0
+        for length in lengths.tolist():
+            row = pieces[start:start + length]
+            if values is not None:
+                row = _fuse_bytes(row, values[start:start + length])
+            text = "".join(row)
+            start += length
+            if text.startswith(" "):
+                text = text[1:]
+            texts.append(text if self._clean_up is None else self._clean_up(text))
+        return texts
@@ -0,0 +1,214 @@
+"""
+Peak memory estimates for generation batches, and splitting of batches that
+would not fit.
+
+A dynamic batch of `max_batch_size` long inputs decoded to `max_length`
+can need more activation and KV-cache memory than the device (or host) has
+left after loading the model, and an out-of-memory error fails every request
+in the batch. `MemoryEstimator` predicts the peak from the batch shape and
+the model configuration:
+
+* encoding: one encoder layer's working set (hidden states, feed-forward
+  activations and attention scores over the source length);
+* decoding: the encoder states repeated for every decoded row, the
+  cross-attention and self-attention KV caches at `max_length`, and one
+  decoder step's activations including the float32 logits over the
+  vocabulary.
+
+Decoded rows are batch x target languages x beams. The estimate covers
+activations and caches only, not the weights; allocator fragmentation and
+framework workspaces are not modelled, which is what the headroom of an
+"auto" budget is for. `MemoryBudget` splits a batch into consecutive
+sub-batches whose estimates fit the budget, to be run one after another.
+"""
+import os
+
+# Share of the memory available at startup that an "auto" budget allows
+AUTO_FRACTION = 0.8
+MIB = 1024 * 1024
+
+
+class MemoryEstimator:
+    """
+    Peak generation memory of an encoder-decoder model (NLLB / M2M100).
+
+    Args:
+        config: Model config with d_model, encoder/decoder layers, attention
+            heads and ffn_dim, and vocab_size.
+        element_bytes: Bytes per activation element (4 for float32, 2 for
+            half precision).
+        max_length: Maximum generated length, including the decoder prefix.
+        num_beams: Beams per decoded row.
+    """
+
+    def __init__(self, config, element_bytes=4, max_length=128, num_beams=1):
+        self.d_model = config.d_model
+        self.encoder_heads = config.encoder_attention_heads
+        self.encoder_ffn_dim = config.encoder_ffn_dim
+        self.decoder_layers = config.decoder_layers
+        self.decoder_heads = config.decoder_attention_heads
+        self.decoder_ffn_dim = config.decoder_ffn_dim
+        self.vocab_size = config.vocab_size
+        self.element_bytes = element_bytes
+        self.max_length = max_length
+        self.num_beams = num_beams
+
+    @classmethod
+    def from_model(cls, model, max_length=None):
+        """Estimator for a loaded model, with its dtype and generation_config beams and max_length."""
+        generation_config = model.generation_config
+        return cls(
+            model.config,
+            element_bytes=next(model.parameters()).element_size(),
+            max_length=max_length or generation_config.max_length,
+            num_beams=generation_config.num_beams or 1,
+        )
+
+    def estimate(self, batch_size, source_length, targets=1):
+        """
+        Estimated peak bytes of generating for a [batch_size, source_length] batch.
+
+        Args:
+            batch_size: Input rows.
+            source_length: Padded input length in tokens.
+            targets: Target languages per input row (multi-target requests
+                decode one row per target).
+        """
+        d, length = self.d_model, self.max_length
+        rows = batch_size * targets * self.num_beams
+        encoder = batch_size * source_length * (5 * d + self.encoder_ffn_dim) \
+            + 2 * batch_size * self.encoder_heads * source_length * source_length
+        # Everything held while decoding, at the last step
+        held = rows * source_length * d \
+            + 2 * self.decoder_layers * rows * source_length * d \
+            + 2 * self.decoder_layers * rows * length * d
+        step = rows * (4 * d + self.decoder_ffn_dim) \
+            + 2 * rows * self.decoder_heads * (source_length + length)
+        # Logits and the processed scores are float32 whatever the model dtype
+        logits = 2 * rows * self.vocab_size * 4
+        return max(encoder, held + step) * self.element_bytes + logits
+
+
+def available_memory():
+    """
+    Bytes of host memory available to new allocations without swapping.
+
+    MemAvailable counts reclaimable page cache, which MemFree (and
+    SC_AVPHYS_PAGES) leave out; on a host that has been reading files the
+    free figure is a fraction of what can actually be used.
+    """
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Kernels before 3.14 and non-Linux hosts
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def resolve_budget(value, device="cpu", shares=1):
+    """
+    Memory budget in bytes from a setting, or None when splitting is disabled.
+
+    Args:
+        value: Megabytes, "auto" (AUTO_FRACTION of the memory available now
+            on `device`, divided by `shares`), or "", "0" or None to disable.
+        device: "cuda" (or "cuda:N") or "cpu".
+        shares: Processes or model instances drawing on the same memory,
+            e.g. the --workers count; each gets an equal part of an "auto" budget.
+
+    Raises:
+        ValueError: `value` is neither a number of megabytes nor "auto", or
+            is negative.
+    """
+    value = str(value or "").strip().lower()
+    if value in ("", "0", "none", "off"):
+        return None
+    if value != "auto":
+        megabytes = float(value)
+        if megabytes < 0:
+            raise ValueError(f"Memory budget must not be negative: {value}")
+        return int(megabytes * MIB) or None
+    if str(device).startswith("cuda"):
+        import torch
+
+        available, _ = torch.cuda.mem_get_info(torch.device(device))
+    else:
+        available = available_memory()
+    return int(available * AUTO_FRACTION / max(1, shares))
+
+
+class MemoryBudget:
+    """
+    Splits batches whose estimated peak memory exceeds a budget.
+
+    Args:
+        estimator: MemoryEstimator of the served model.
+        budget_bytes: Largest estimated peak a (sub-)batch may have.
+        metrics: Optional MetricsRegistry for split counters and gauges.
+    """
+
+    def __init__(self, estimator, budget_bytes, metrics=None):
+        self.estimator = estimator
+        self.budget_bytes = budget_bytes
+        self._metrics = metrics is not None
+        if metrics is not None:
+            metrics.gauge("nllb_memory_budget_bytes", "Peak memory a batch may be estimated at").set(budget_bytes)
+            self._estimate = metrics.gauge(
+                "nllb_batch_memory_estimate_bytes", "Estimated peak memory of the last batch before splitting"
+            )
+            self._split = metrics.counter(
+                "nllb_memory_split_batches_total", "Batches split because they exceeded the memory budget"
+            )
+            self._sub_batches = metrics.counter(
+                "nllb_memory_sub_batches_total", "Sub-batches run for batches that were split"
+            )
+            self._oversized = metrics.counter(
+                "nllb_memory_oversized_rows_total", "Sentences over the memory budget on their own (run alone)"
+            )
+
+    def split(self, lengths, targets=1):
+        """
+        Plan consecutive sub-batches that each fit the budget.
+
+        A sub-batch grows while the estimate for its rows, padded to its
+        longest row, fits; a single row over the budget still runs, alone.
+
+        Args:
+            lengths: Token length of every input row, in batch order.
+            targets: Target languages per input row.
+
+        Returns:
+            (ranges, stats): (start, end) row ranges covering the batch, and
+            a dict with "estimate_bytes" (the whole batch), "sub_batches"
+            and "oversized_rows".
+        """
+        lengths = [int(length) for length in lengths]
+        estimate = self.estimator.estimate
+        whole = estimate(len(lengths), max(lengths, default=0), targets)
+        ranges, oversized = [], 0
+        if whole <= self.budget_bytes or len(lengths) <= 1:
+            ranges = [(0, len(lengths))]
+            oversized = int(whole > self.budget_bytes and len(lengths) == 1)
+        else:
+            start, width = 0, 0
+            for end, length in enumerate(lengths):
+                candidate = max(width, length)
+                if end > start and estimate(end + 1 - start, candidate, targets) > self.budget_bytes:
+                    ranges.append((start, end))
+                    start, candidate = end, length
+                if end == start and estimate(1, length, targets) > self.budget_bytes:
+                    oversized += 1
+                width = candidate
+            ranges.append((start, len(lengths)))
+        stats = {"estimate_bytes": whole, "sub_batches": len(ranges), "oversized_rows": oversized}
+        if self._metrics:
+            self._estimate.set(whole)
+            if len(ranges) > 1:
+                self._split.inc()
+                self._sub_batches.inc(len(ranges))
+            if oversized:
+                self._oversized.inc(oversized)
+        return ranges, stats
@@ -0,0 +1,328 @@
+"""
+ONNX Runtime execution of NLLB.
+
+`export_onnx` writes two graphs and a small JSON description to a directory:
+
+* encoder.onnx: (input_ids, attention_mask) -> the cross-attention keys and
+  values of every decoder layer, [layers, batch, heads, source, head_dim];
+* decoder.onnx: one decoder step, (tokens, past keys/values, cross
+  keys/values, attention_mask) -> (next-token logits, present keys/values
+  with this step appended).
+
+The graphs are built from the M2M100/NLLB module attributes, the same way
+StaticDecoder drives the decoder, so they do not depend on how a transformers
+release exports its cache classes. OnnxEngine runs greedy decoding over them
+with ONNX Runtime; its output matches greedy `model.generate` up to
+floating-point differences between the two runtimes (see onnx_benchmark.py
+for the parity check).
+
+onnxruntime (and onnx, for the export) are optional dependencies, imported
+only when this module is used.
+"""
+import json
+import os
+
+import numpy as np
+import torch
+
+ENCODER_FILE = "encoder.onnx"
+DECODER_FILE = "decoder.onnx"
+CONFIG_FILE = "nllb_onnx.json"
+DEFAULT_OPSET = 17
+
+OPTIMIZATION_LEVELS = ("disable", "basic", "extended", "all")
+
+
+class _EncoderGraph(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.get_encoder()
+        self.layers = model.get_decoder().layers
+        self.num_heads = model.config.decoder_attention_heads
+
+    def _heads(self, states):
+        batch, length, width = states.shape
+        return states.view(batch, length, self.num_heads, width // self.num_heads).transpose(1, 2)
+
+    def forward(self, input_ids, attention_mask):
+        states = self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        # The cross-attention projections only depend on the encoder output, so they run once here
+        keys = torch.stack([self._heads(layer.encoder_attn.k_proj(states)) for layer in self.layers])
+        values = torch.stack([self._heads(layer.encoder_attn.v_proj(states)) for layer in self.layers])
+        return keys, values
+
+
+class _DecoderStepGraph(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.lm_head = model.lm_head
+        self.num_heads = model.config.decoder_attention_heads
+        self.head_dim = model.config.d_model // self.num_heads
+        self.scaling = self.head_dim ** -0.5
+        # Newer transformers scale inside the embedding module, older ones in the decoder
+        self.embed_scale = 1.0 if hasattr(self.decoder.embed_tokens, "embed_scale") else self.decoder.embed_scale
+        self.padding_idx = self.decoder.embed_positions.padding_idx
+
+    def _heads(self, states):
+        batch, length, _ = states.shape
+        return states.view(batch, length, self.num_heads, self.head_dim).transpose(1, 2)
+
+    @staticmethod
+    def _attention(query, key, value, bias=None):
+        scores = torch.matmul(query, key.transpose(-1, -2))
+        if bias is not None:
+            scores = scores + bias
+        return torch.matmul(scores.softmax(dim=-1), value)
+
+    def forward(self, tokens, past_keys, past_values, cross_keys, cross_values, attention_mask):
+        # tokens [B]; past [L, B, H, P, D]; this step is position P of the output
+        position = past_keys.shape[3]
+        positions = torch.where(tokens == self.padding_idx, self.padding_idx, position + self.padding_idx + 1)
+        hidden = self.decoder.embed_tokens(tokens[:, None]) * self.embed_scale
+        hidden = hidden + self.decoder.embed_positions.weights.index_select(0, positions)[:, None]
+        dtype = hidden.dtype
+        cross_bias = (1 - attention_mask[:, None, None, :].to(dtype)) * torch.finfo(dtype).min
+
+        present_keys, present_values = [], []
+        for i, layer in enumerate(self.decoder.layers):
+            residual = hidden
+            hidden = layer.self_attn_layer_norm(hidden)
+            attention = layer.self_attn
+            query = self._heads(attention.q_proj(hidden) * self.scaling)
+            keys = torch.cat([past_keys[i], self._heads(attention.k_proj(hidden))], dim=2)
+            values = torch.cat([past_values[i], self._heads(attention.v_proj(hidden))], dim=2)
+            present_keys.append(keys)
+            present_values.append(values)
+            # A single new position sees every earlier one, so self-attention needs no mask
+            context = self._attention(query, keys, values)
+            hidden = residual + attention.out_proj(context.transpose(1, 2).reshape(hidden.shape))
+
+            residual = hidden
+            hidden = layer.encoder_attn_layer_norm(hidden)
+            attention = layer.encoder_attn
+            query = self._heads(attention.q_proj(hidden) * self.scaling)
+            context = self._attention(query, cross_keys[i], cross_values[i], cross_bias)
+            hidden = residual + attention.out_proj(context.transpose(1, 2).reshape(hidden.shape))
+
+            residual = hidden
+            hidden = layer.final_layer_norm(hidden)
+            hidden = residual + layer.fc2(layer.activation_fn(layer.fc1(hidden)))
+        hidden = self.decoder.layer_norm(hidden)
+        return self.lm_head(hidden)[:, 0], torch.stack(present_keys), torch.stack(present_values)
+
+
+def export_onnx(model, output_dir, opset=DEFAULT_OPSET):
+    """
+    Export the encoder and the decoder step of an NLLB model to ONNX.
+
+    Args:
+        model: Hugging Face model name or path, or a loaded
+            M2M100ForConditionalGeneration.
+        output_dir: Directory receiving encoder.onnx, decoder.onnx (with their
+            weights as external data) and nllb_onnx.json.
+        opset: ONNX opset version.
+
+    Returns:
+        The output directory.
+    """
+    if isinstance(model, str):
+        from transformers import AutoModelForSeq2SeqLM
+
+        model = AutoModelForSeq2SeqLM.from_pretrained(model)
+    model = model.eval().float().cpu()
+    config = model.config
+    os.makedirs(output_dir, exist_ok=True)
+
+    layers = config.decoder_layers
+    heads = config.decoder_attention_heads
+    head_dim = config.d_model // heads
+    batch, source, past = 2, 5, 3
+    input_ids = torch.full((batch, source), config.eos_token_id, dtype=torch.int64)
+    attention_mask = torch.ones((batch, source), dtype=torch.int64)
+    cache = torch.zeros((layers, batch, heads, past, head_dim))
+    cross = torch.zeros((layers, batch, heads, source, head_dim))
+    tokens = torch.full((batch,), config.decoder_start_token_id, dtype=torch.int64)
+
+    # The wrappers must be in eval mode too: the exporter restores their
+    # training flag onto every submodule, shared ones included
+    encoder_graph, decoder_graph = _EncoderGraph(model).eval(), _DecoderStepGraph(model).eval()
+    cache_axes = {1: "batch", 3: "past"}
+    cross_axes = {1: "batch", 3: "source"}
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder_graph, (input_ids, attention_mask), os.path.join(output_dir, ENCODER_FILE),
+            input_names=["input_ids", "attention_mask"], output_names=["cross_keys", "cross_values"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "source"}, "attention_mask": {0: "batch", 1: "source"},
+                "cross_keys": cross_axes, "cross_values": cross_axes,
+            },
+            opset_version=opset, dynamo=False,
+        )
+        torch.onnx.export(
+            decoder_graph, (tokens, cache, cache, cross, cross, attention_mask),
+            os.path.join(output_dir, DECODER_FILE),
+            input_names=["tokens", "past_keys", "past_values", "cross_keys", "cross_values", "attention_mask"],
+            output_names=["logits", "present_keys", "present_values"],
+            dynamic_axes={
+                "tokens": {0: "batch"}, "past_keys": cache_axes, "past_values": cache_axes,
+                "cross_keys": cross_axes, "cross_values": cross_axes, "attention_mask": {0: "batch", 1: "source"},
+                "logits": {0: "batch"}, "present_keys": {1: "batch", 3: "length"},
+                "present_values": {1: "batch", 3: "length"},
+            },
+            opset_version=opset, dynamo=False,
+        )
+    _externalize_weights(output_dir)
+
+    with open(os.path.join(output_dir, CONFIG_FILE), "w") as file:
+        json.dump({
+            "model": getattr(config, "name_or_path", ""),
+            "decoder_layers": layers,
+            "decoder_attention_heads": heads,
+            "head_dim": head_dim,
+            "decoder_start_token_id": config.decoder_start_token_id,
+            "eos_token_id": config.eos_token_id,
+            "pad_token_id": config.pad_token_id,
+            "max_length": model.generation_config.max_length,
+            "opset": opset,
+        }, file, indent=2)
+    return output_dir
+
+
+def _externalize_weights(output_dir):
+    # NLLB-600M's embedding alone is ~1 GB; keep every graph well below protobuf's 2 GB limit
+    import onnx
+
+    for name in (ENCODER_FILE, DECODER_FILE):
+        path = os.path.join(output_dir, name)
+        graph = onnx.load(path)
+        onnx.save_model(graph, path, save_as_external_data=True, all_tensors_to_one_file=True,
+                        location=name + ".data", size_threshold=1024)
+
+
+def session_options(intra_op_threads=0, inter_op_threads=0, optimization_level="all"):
+    """
+    ONNX Runtime session options.
+
+    Args:
+        intra_op_threads: Threads used inside one operator (0: ONNX Runtime's
+            default, one per physical core).
+        inter_op_threads: Threads running independent operators in parallel;
+            above 1 the graph is executed in parallel mode.
+        optimization_level: Graph optimization level, one of OPTIMIZATION_LEVELS.
+    """
+    import onnxruntime as ort
+
+    if optimization_level not in OPTIMIZATION_LEVELS:
+        raise ValueError(f"Optimization level must be one of {', '.join(OPTIMIZATION_LEVELS)}")
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    if inter_op_threads > 1:
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    options.graph_optimization_level = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[optimization_level]
+    return options
+
+
+class OnnxEngine:
+    """
+    Greedy NLLB decoding on ONNX Runtime, over graphs written by export_onnx.
+
+    `generate` takes and returns torch tensors like `model.generate`, so it is
+    a drop-in replacement on the servers' greedy paths.
+
+    Args:
+        model_dir: Directory written by export_onnx.
+        intra_op_threads: See session_options.
+        inter_op_threads: See session_options.
+        optimization_level: See session_options.
+        providers: ONNX Runtime execution providers (default: CUDA when
+            available, then CPU).
+    """
+
+    def __init__(self, model_dir, intra_op_threads=0, inter_op_threads=0, optimization_level="all",
+                 providers=None):
+        import onnxruntime as ort
+
+        with open(os.path.join(model_dir, CONFIG_FILE)) as file:
+            self.config = json.load(file)
+        if providers is None:
+            available = ort.get_available_providers()
+            providers = [p for p in ("CUDAExecutionProvider", "CPUExecutionProvider") if p in available]
+        options = session_options(intra_op_threads, inter_op_threads, optimization_level)
+        self.encoder = ort.InferenceSession(os.path.join(model_dir, ENCODER_FILE), options, providers=providers)
+        self.decoder = ort.InferenceSession(os.path.join(model_dir, DECODER_FILE), options, providers=providers)
+        self.eos_token_id = self.config["eos_token_id"]
+        self.pad_token_id = self.config["pad_token_id"]
+
+    def generate(self, input_ids, attention_mask, forced_bos_token_id=None, decoder_input_ids=None,
+                 max_length=None, repeats=1):
+        """
+        Decode greedily.
+
+        Args:
+            input_ids: Encoder input ids, [batch, seq].
+            attention_mask: Encoder attention mask, [batch, seq].
+            forced_bos_token_id: Token forced after the decoder start token
+                (the NLLB target language code).
+            decoder_input_ids: Explicit decoder prefix, [batch, prefix];
+                overrides forced_bos_token_id.
+            max_length: Maximum output length including the prefix (default:
+                the exported model's generation max_length).
+            repeats: Decode every input row this many times (as consecutive
+                output rows, e.g. one per target language with
+                decoder_input_ids), encoding it only once.
+
+        Returns:
+            Output ids [batch * repeats, length] on the device of input_ids,
+            padded with pad_token_id after EOS.
+        """
+        from nllb_serving.stages import stage
+
+        device = input_ids.device
+        max_length = max_length or self.config["max_length"]
+        ids = input_ids.cpu().numpy().astype(np.int64)
+        mask = attention_mask.cpu().numpy().astype(np.int64)
+        with stage("encode"):
+            cross_keys, cross_values = self.encoder.run(None, {"input_ids": ids, "attention_mask": mask})
+        if repeats > 1:
+            cross_keys = np.repeat(cross_keys, repeats, axis=1)
+            cross_values = np.repeat(cross_values, repeats, axis=1)
+            mask = np.repeat(mask, repeats, axis=0)
+        batch = mask.shape[0]
+
+        if decoder_input_ids is None:
+            prefix = [self.config["decoder_start_token_id"]]
+            if forced_bos_token_id is not None:
+                prefix.append(forced_bos_token_id)
+            prefix = np.tile(np.array(prefix, dtype=np.int64), (batch, 1))
+        else:
+            prefix = decoder_input_ids.cpu().numpy().astype(np.int64)
+        sequences = np.full((batch, max_length), self.pad_token_id, dtype=np.int64)
+        sequences[:, :prefix.shape[1]] = prefix
+
+        shape = (self.config["decoder_layers"], batch, self.config["decoder_attention_heads"], 0,
+                 self.config["head_dim"])
+        past_keys = past_values = np.zeros(shape, dtype=cross_keys.dtype)
+        finished = np.zeros(batch, dtype=bool)
+        length = prefix.shape[1]
+        # The prefix is fed one token at a time, so every step is a single position
+        for position in range(max_length - 1):
+            logits, past_keys, past_values = self.decoder.run(None, {
+                "tokens": sequences[:, position], "past_keys": past_keys, "past_values": past_values,
+                "cross_keys": cross_keys, "cross_values": cross_values, "attention_mask": mask,
+            })
+            if position + 1 < length:
+                continue  # the next token is part of the prefix
+            tokens = np.where(finished, self.pad_token_id, logits.argmax(axis=-1))
+            sequences[:, length] = tokens
+            length += 1
+            finished |= tokens == self.eos_token_id
+            if finished.all():
+                break
+        return torch.from_numpy(sequences[:, :length]).to(device)
@@ -0,0 +1,187 @@
+"""
+CPU placement of model workers: pinned core sets and matching thread counts.
+
+Several CPU model workers on one host, each with torch's default thread pool
+(one thread per core of the machine), oversubscribe the cores: threads of
+different workers preempt each other and tail latency suffers. A placement
+gives every worker its own set of physical cores, pins the process to them
+and sizes its intra-op thread pool to match.
+
+The cores are those this process may run on (`os.sched_getaffinity`), grouped
+by NUMA node and physical core from sysfs. Policies:
+
+* none: no pinning, only the thread count is split evenly.
+* compact: workers take consecutive physical cores, node after node.
+* numa: workers are spread over the NUMA nodes in proportion to their cores,
+  so no worker spans two nodes unless there are fewer workers than nodes.
+"""
+import glob
+import os
+
+POLICIES = ("none", "compact", "numa")
+SYSFS = "/sys/devices/system"
+
+
+def parse_cpu_list(text):
+    """Parse a sysfs CPU list such as "0-3,8,10-11" into a sorted list of ints."""
+    cpus = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def _read(path):
+    try:
+        with open(path, "r") as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def cpu_topology(sysfs=SYSFS):
+    """
+    CPUs this process may use, by NUMA node and physical core.
+
+    Returns:
+        List of nodes; each node is a list of physical cores, each a sorted
+        list of logical CPUs (SMT siblings). Without NUMA information all
+        CPUs form one node; without SMT information every CPU is a core.
+    """
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    for path in sorted(glob.glob(os.path.join(sysfs, "node", "node[0-9]*", "cpulist")),
+                       key=lambda path: int(os.path.basename(os.path.dirname(path))[4:])):
+        nodes.append(parse_cpu_list(_read(path) or ""))
+    if not nodes:
+        nodes = [sorted(allowed)]
+
+    topology = []
+    for node_cpus in nodes:
+        cores = {}
+        for cpu in node_cpus:
+            if cpu not in allowed:
+                continue
+            siblings = _read(os.path.join(sysfs, "cpu", f"cpu{cpu}", "topology", "thread_siblings_list"))
+            core = min(parse_cpu_list(siblings)) if siblings else cpu
+            cores.setdefault(core, []).append(cpu)
+        if cores:
+            topology.append([sorted(cores[core]) for core in sorted(cores)])
+    return topology
+
+
+class WorkerPlacement:
+    """
+    CPUs and thread count of one worker.
+
+    Attributes:
+        cpus: Logical CPUs the worker is pinned to, or None (not pinned).
+        threads: Intra-op threads for the worker's model.
+    """
+
+    def __init__(self, cpus, threads):
+        self.cpus = cpus
+        self.threads = threads
+
+    def __repr__(self):
+        cpus = "unpinned" if self.cpus is None else f"cpus={','.join(map(str, self.cpus))}"
+        return f"WorkerPlacement({cpus}, threads={self.threads})"
+
+
+def _split(items, parts):
+    # Contiguous chunks whose sizes differ by at most one
+    size, extra = divmod(len(items), parts)
+    chunks, start = [], 0
+    for i in range(parts):
+        end = start + size + (i < extra)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def _numa_shares(topology, num_workers):
+    # Workers per node in proportion to its cores (largest remainder)
+    total = sum(len(node) for node in topology)
+    exact = [num_workers * len(node) / total for node in topology]
+    shares = [int(share) for share in exact]
+    for i in sorted(range(len(topology)), key=lambda i: exact[i] - shares[i], reverse=True):
+        if sum(shares) == num_workers:
+            break
+        shares[i] += 1
+    # Every node gets a worker (there are at least as many workers as nodes), and
+    # a node with fewer cores than workers gives the surplus to the roomiest node
+    for i in range(len(topology)):
+        if not shares[i]:
+            shares[i] += 1
+            shares[max(range(len(topology)), key=lambda j: shares[j])] -= 1
+    for i, node in enumerate(topology):
+        while shares[i] > len(node):
+            shares[i] -= 1
+            shares[max(range(len(topology)), key=lambda j: len(topology[j]) - shares[j])] += 1
+    return shares
+
+
+def plan_placement(num_workers, policy="numa", threads=0, topology=None):
+    """
+    Place `num_workers` workers on this host.
+
+    Args:
+        num_workers: Number of model workers.
+        policy: "none", "compact" or "numa" (see the module docstring).
+        threads: Intra-op threads per worker; 0 uses the worker's physical
+            cores (or an even share of them with policy "none").
+        topology: cpu_topology() result (default: this host).
+
+    Returns:
+        One WorkerPlacement per worker.
+
+    Raises:
+        ValueError: Unknown policy, or fewer physical cores than workers.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown placement policy {policy!r}, expected one of {', '.join(POLICIES)}")
+    topology = cpu_topology() if topology is None else topology
+    cores = [core for node in topology for core in node]
+    if num_workers < 1:
+        raise ValueError("At least one worker is needed")
+    if policy == "none":
+        return [WorkerPlacement(None, threads or max(1, len(cores) // num_workers)) for _ in range(num_workers)]
+    if num_workers > len(cores):
+        raise ValueError(f"{num_workers} pinned workers need at least as many physical cores, "
+                         f"{len(cores)} are available")
+
+    if policy == "compact" or len(topology) == 1:
+        groups = _split(cores, num_workers)
+    elif num_workers <= len(topology):
+        # Fewer workers than nodes: each worker takes whole nodes
+        groups = [[core for node in nodes for core in node] for nodes in _split(topology, num_workers)]
+    else:
+        groups = []
+        for node, share in zip(topology, _numa_shares(topology, num_workers)):
+            if share:
+                groups.extend(_split(node, share))
+    return [
+        WorkerPlacement(sorted(cpu for core in group for cpu in core), threads or len(group))
+        for group in groups
+    ]
+
+
+def apply_placement(placement):
+    """
+    Pin this process to the placement's CPUs and size torch's thread pools.
+
+    Call it before the model runs anything: torch fixes the inter-op pool at
+    first use.
+    """
+    import torch
+
+    if placement.cpus is not None:
+        os.sched_setaffinity(0, placement.cpus)
+    torch.set_num_threads(placement.threads)
+    try:
+        # Generation runs one operator at a time; the intra-op pool does the work
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already started
@@ -0,0 +1,164 @@
+"""
+On-demand profiling of a running server.
+
+A ProfileCapture records for a bounded time, without restarting or pausing
+the server:
+
+* `torch.profiler` on the model thread, written as a Chrome trace
+  (chrome://tracing or https://ui.perfetto.dev);
+* a Python sampling profiler over every thread, written as folded stacks
+  ("thread;outer;...;inner count" lines) for flamegraph.pl or speedscope.
+
+torch.profiler only sees operators run on the thread that started it, so its
+start and stop are handed to the model thread: through `run_on_model_thread`
+(e.g. DynamicBatcher.call_soon), or queued until the model thread calls
+`poll()` when there is no such hook (the Triton model).
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+MAX_DURATION = 60.0
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+class CaptureInProgress(RuntimeError):
+    """A profile is already being captured."""
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _folded_stack(thread_name, frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    # Folded stacks are root first; semicolons separate frames
+    return ";".join([thread_name] + names[::-1]).replace("\n", " ")
+
+
+class ProfileCapture:
+    """
+    Bounded torch.profiler and stack-sampling captures, one at a time.
+
+    Args:
+        output_dir: Directory the traces and stack files are written to.
+        run_on_model_thread: Callable(fn) that runs `fn` on the model thread
+            soon; without it the model thread must call `poll()` regularly.
+        max_duration: Longest capture allowed, in seconds.
+        sample_interval: Seconds between Python stack samples.
+    """
+
+    def __init__(self, output_dir, run_on_model_thread=None, max_duration=MAX_DURATION,
+                 sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        self.output_dir = output_dir
+        self.max_duration = max_duration
+        self.sample_interval = sample_interval
+        self._run_on_model_thread = run_on_model_thread
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._active = None
+        self._profiler = None
+        self._captures = 0
+
+    def start(self, duration):
+        """
+        Start a capture of `duration` seconds and return immediately.
+
+        Returns:
+            Dict with the "trace" and "stacks" paths the capture will write
+            and its "duration_s".
+
+        Raises:
+            ValueError: `duration` is not in (0, max_duration].
+            CaptureInProgress: Another capture has not finished yet.
+        """
+        duration = float(duration)
+        if not 0 < duration <= self.max_duration:
+            raise ValueError(f"Profile duration must be in (0, {self.max_duration:g}] seconds")
+        with self._lock:
+            if self._active is not None:
+                raise CaptureInProgress("A profile capture is already running")
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._captures += 1
+            base = os.path.join(
+                os.path.abspath(self.output_dir),
+                time.strftime("profile-%Y%m%d-%H%M%S") + f"-{os.getpid()}-{self._captures}",
+            )
+            self._active = capture = {
+                "trace": base + ".trace.json", "stacks": base + ".stacks.folded", "duration_s": duration
+            }
+        self._on_model_thread(self._start_torch)
+        threading.Thread(target=self._sample, args=(capture,), name="profile-sampler", daemon=True).start()
+        return dict(capture)
+
+    @property
+    def running(self):
+        return self._active is not None
+
+    def poll(self):
+        """Run the profiler starts and stops queued for the model thread."""
+        while self._pending:
+            self._pending.popleft()()
+
+    def _on_model_thread(self, fn):
+        if self._run_on_model_thread is not None:
+            self._run_on_model_thread(fn)
+        else:
+            self._pending.append(fn)
+
+    def _start_torch(self):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        # Python stacks come from the sampler; with_stack would slow every operator down
+        self._profiler = profile(activities=activities, record_shapes=True)
+        self._profiler.start()
+
+    def _stop_torch(self, capture):
+        profiler, self._profiler = self._profiler, None
+        try:
+            if profiler is not None:
+                profiler.stop()
+        except Exception as e:
+            print(f"Profile capture failed: {e!r}")
+            profiler = None
+        # Writing the trace takes seconds for busy captures; keep it off the model thread
+        threading.Thread(
+            target=self._export, args=(profiler, capture), name="profile-export", daemon=True
+        ).start()
+
+    def _export(self, profiler, capture):
+        try:
+            if profiler is not None:
+                profiler.export_chrome_trace(capture["trace"])
+        except Exception as e:
+            print(f"Profile export failed: {e!r}")
+        finally:
+            with self._lock:
+                self._active = None
+
+    def _sample(self, capture):
+        # Sample every other thread's Python stack until the capture ends
+        counts = collections.Counter()
+        own = threading.get_ident()
+        end = time.monotonic() + capture["duration_s"]
+        while time.monotonic() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    counts[_folded_stack(names.get(ident, str(ident)), frame)] += 1
+            time.sleep(self.sample_interval)
+        with open(capture["stacks"], "w", encoding="utf-8") as file:
+            for stack, count in counts.most_common():
+                file.write(f"{stack} {count}\n")
+        # The model thread stops torch.profiler; the capture ends once its trace is written
+        self._on_model_thread(lambda: self._stop_torch(capture))
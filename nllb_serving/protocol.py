@@ -0,0 +1,259 @@
+"""
+Wire format of the standard server (port 8003).
+
+Every message is a JSON document followed by a newline, so one keep-alive
+connection can carry any number of requests. The reader also accepts a bare
+JSON document without the newline, which is what the original clients send.
+
+A connection whose first byte is the start of FRAME_MAGIC is in binary tensor
+mode instead. Each frame is a fixed prefix (magic, header length, payload
+length, little-endian uint32s), a small JSON header and a payload of
+little-endian int32 token ids: the rows of a ragged batch concatenated, with
+their lengths in the header. Requests carry pre-tokenized input ids and
+responses the generated ids, so the server does no text processing at all.
+"""
+import codecs
+import json
+import struct
+
+import numpy as np
+
+STANDARD_SERVER_HOST = "127.0.0.1"
+STANDARD_SERVER_PORT = 8003
+TRITON_SERVER_URL = "127.0.0.1:8001"
+MODEL_NAME = "nllb"
+TOKENIZER_NAME = "facebook/nllb-200-distilled-600M"
+
+FRAME_MAGIC = b"NLB1"
+_FRAME_PREFIX = struct.Struct("<4sII")
+_ID_DTYPE = np.dtype("<i4")
+
+_decoder = json.JSONDecoder()
+_INCOMPLETE = object()
+
+
+class ConnectionClosed(ConnectionError):
+    """The peer closed the connection before a full message arrived."""
+
+
+class TranslationError(RuntimeError):
+    """
+    The server answered a request with an error response.
+
+    Attributes:
+        code: Machine-readable error code, e.g. "deadline_exceeded", or None.
+    """
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+def encode_message(message):
+    """Serialize a message into its newline-terminated wire form."""
+    return json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def decode_message(data):
+    """Parse one message (bytes or str) as received from the wire."""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def make_request(text, source_lang, target_lang, priority=None, deadline_ms=None):
+    """
+    Build a translation request.
+
+    Args:
+        target_lang: Target language code, or a list of codes to get the text
+            in all of them (the server encodes it once).
+        priority: Priority class on the server, lower is more urgent (default 0).
+        deadline_ms: Time budget; the server drops the request if it is still
+            queued after this many milliseconds.
+    """
+    request = {"text": text, "source_lang": source_lang}
+    if isinstance(target_lang, (list, tuple)):
+        request["target_langs"] = list(target_lang)
+    else:
+        request["target_lang"] = target_lang
+    if priority is not None:
+        request["priority"] = priority
+    if deadline_ms is not None:
+        request["deadline_ms"] = deadline_ms
+    return request
+
+
+def translated_text(response):
+    """
+    Extract the translation from a response, raising TranslationError on error responses.
+
+    Multi-target responses give a {target_lang: translation} dict.
+    """
+    if "error" in response:
+        raise TranslationError(response["error"], response.get("code"))
+    if "translations" in response:
+        return response["translations"]
+    return response["translated_text"]
+
+
+class MessageReader:
+    """
+    Incrementally reads JSON messages from a blocking socket.
+
+    Args:
+        sock: Connected socket to read from.
+        bufsize: Maximum number of bytes requested per recv call.
+    """
+
+    def __init__(self, sock, bufsize=65536):
+        self.sock = sock
+        self.bufsize = bufsize
+        self._text = ""
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+
+    def _pop(self):
+        text = self._text.lstrip()
+        if not text:
+            self._text = ""
+            return _INCOMPLETE
+        try:
+            message, end = _decoder.raw_decode(text)
+        except json.JSONDecodeError:
+            # A complete line that still does not parse will never become valid
+            if "\n" in text:
+                self._text = text[text.index("\n") + 1:]
+                raise ValueError("Malformed JSON message")
+            self._text = text
+            return _INCOMPLETE
+        self._text = text[end:]
+        return message
+
+    def read(self):
+        """
+        Return the next message, or None if the peer closed the connection cleanly.
+
+        Raises:
+            ValueError: The peer sent a line that is not valid JSON.
+            ConnectionClosed: The connection closed in the middle of a message.
+        """
+        while True:
+            message = self._pop()
+            if message is not _INCOMPLETE:
+                return message
+            chunk = self.sock.recv(self.bufsize)
+            if not chunk:
+                if self._text.strip():
+                    raise ConnectionClosed("Connection closed mid-message")
+                return None
+            self._text += self._utf8.decode(chunk)
+
+
+def pack_rows(rows):
+    """Concatenate int id rows into (lengths, little-endian int32 payload)."""
+    lengths = [len(row) for row in rows]
+    if not rows:
+        return lengths, b""
+    return lengths, np.concatenate([np.asarray(row, dtype=_ID_DTYPE) for row in rows]).tobytes()
+
+
+def unpack_rows(payload, lengths):
+    """Split a frame payload into int32 rows; the rows are views of `payload`, not copies."""
+    ids = np.frombuffer(payload, dtype=_ID_DTYPE)
+    if len(ids) != sum(lengths):
+        raise ValueError(f"Payload holds {len(ids)} ids, header lengths add up to {sum(lengths)}")
+    return np.split(ids, np.cumsum(lengths)[:-1]) if lengths else []
+
+
+def encode_frame(header, rows=None):
+    """
+    Serialize a binary-mode frame.
+
+    Args:
+        header: JSON-serializable dict; "lengths" is filled in from `rows`.
+        rows: Token id rows to send as the payload, or None for a header-only frame.
+    """
+    payload = b""
+    if rows is not None:
+        lengths, payload = pack_rows(rows)
+        header = dict(header, lengths=lengths)
+    header = json.dumps(header).encode("utf-8")
+    return _FRAME_PREFIX.pack(FRAME_MAGIC, len(header), len(payload)) + header + payload
+
+
+def decode_frame_prefix(prefix):
+    """Return (header length, payload length) from the fixed-size frame prefix."""
+    magic, header_length, payload_length = _FRAME_PREFIX.unpack(prefix)
+    if magic != FRAME_MAGIC:
+        raise ValueError(f"Bad frame magic {magic!r}")
+    return header_length, payload_length
+
+
+def decode_frame(header, payload):
+    """Parse a frame's header and attach its payload rows as "ids" (if "lengths" is present)."""
+    message = json.loads(header)
+    if "lengths" in message:
+        message["ids"] = unpack_rows(payload, message["lengths"])
+    return message
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            if received:
+                raise ConnectionClosed("Connection closed mid-frame")
+            return None
+        received += count
+    return buffer
+
+
+def read_frame(sock):
+    """
+    Read one binary-mode frame from a blocking socket.
+
+    The payload is received straight into one buffer and the id rows are
+    numpy views of it.
+
+    Returns:
+        The decoded frame (see decode_frame), or None if the peer closed the
+        connection cleanly.
+    """
+    prefix = _recv_exact(sock, _FRAME_PREFIX.size)
+    if prefix is None:
+        return None
+    header_length, payload_length = decode_frame_prefix(prefix)
+    data = _recv_exact(sock, header_length + payload_length)
+    if data is None:
+        raise ConnectionClosed("Connection closed mid-frame")
+    return decode_frame(data[:header_length], memoryview(data)[header_length:])
+
+
+def read_raw_frame(sock):
+    """
+    Read one binary-mode frame without decoding its payload, e.g. to forward it.
+
+    Returns:
+        (header dict, payload offset, frame bytes), or None if the peer closed
+        the connection cleanly.
+    """
+    prefix = _recv_exact(sock, _FRAME_PREFIX.size)
+    if prefix is None:
+        return None
+    header_length, payload_length = decode_frame_prefix(prefix)
+    data = _recv_exact(sock, header_length + payload_length)
+    if data is None:
+        raise ConnectionClosed("Connection closed mid-frame")
+    return json.loads(data[:header_length]), _FRAME_PREFIX.size + header_length, bytes(prefix + data)
+
+
+async def aread_frame(reader):
+    """asyncio version of read_frame for a StreamReader."""
+    prefix = await reader.readexactly(_FRAME_PREFIX.size)
+    header_length, payload_length = decode_frame_prefix(prefix)
+    data = await reader.readexactly(header_length + payload_length)
+    return decode_frame(data[:header_length], memoryview(data)[header_length:])
+
@@ -0,0 +1,481 @@
+"""
+Routing proxy in front of several replicas of either backend.
+
+The proxy speaks the backend's own protocol, so clients only change the
+address they connect to:
+
+* standard: the JSON / binary frame protocol of ServerNormal/python.py. Each
+  message (or frame) is forwarded whole to one replica over pooled
+  keep-alive connections.
+* triton: the KServe v2 GRPCInferenceService (Triton's port 8001, or the
+  standard server's KServe gRPC port). Calls are forwarded as raw bytes;
+  ModelInfer requests are only parsed for their language pair.
+
+Requests go to the healthy replica with the fewest outstanding requests.
+With affinity, each language pair prefers one replica (rendezvous hashing),
+so same-pair requests batch together and share in-flight work there. The
+preference yields once that replica has `affinity_slack` more outstanding
+requests than the least loaded one.
+
+A background thread checks every replica. A replica is ejected after
+`failure_threshold` consecutive failed checks or forwarded requests, and it
+returns on its next successful check. Requests that fail to reach a replica
+are retried on another one, since a translation can safely run twice. If
+every replica is ejected, all of them are tried anyway.
+"""
+import hashlib
+import itertools
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from nllb_serving.client.pool import ConnectionPool
+from nllb_serving.metrics import MetricsRegistry
+from nllb_serving.protocol import (
+    FRAME_MAGIC,
+    ConnectionClosed,
+    MessageReader,
+    encode_frame,
+    encode_message,
+    read_raw_frame,
+)
+
+GRPC_SERVICE = "/inference.GRPCInferenceService/"
+GRPC_OPTIONS = [("grpc.max_receive_message_length", -1), ("grpc.max_send_message_length", -1)]
+
+
+class NoReplicaAvailable(ConnectionError):
+    """No replica could be reached for a request."""
+
+
+def parse_address(address):
+    """Split "host:port" into (host, int port)."""
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Replica address {address!r} is not host:port")
+    return host, int(port)
+
+
+class Replica:
+    """Routing state of one backend replica."""
+
+    def __init__(self, address):
+        self.address = address
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+
+
+class ReplicaSet:
+    """
+    Least-outstanding-requests routing with optional language-pair affinity.
+
+    Args:
+        addresses: "host:port" of every replica.
+        affinity: Prefer one replica per language pair.
+        affinity_slack: Outstanding requests the preferred replica may have
+            beyond the least loaded one before requests spill over.
+        failure_threshold: Consecutive failures that eject a replica.
+        metrics: MetricsRegistry receiving per-replica routing metrics.
+    """
+
+    def __init__(self, addresses, affinity=False, affinity_slack=4, failure_threshold=3, metrics=None):
+        if not addresses:
+            raise ValueError("At least one replica is needed")
+        self.replicas = [Replica(address) for address in addresses]
+        self.affinity = affinity
+        self.affinity_slack = affinity_slack
+        self.failure_threshold = failure_threshold
+        self.metrics = metrics or MetricsRegistry()
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._requests = self.metrics.counter("nllb_router_requests_total", "Requests forwarded per replica")
+        self._failures = self.metrics.counter(
+            "nllb_router_failures_total", "Requests and health checks that failed to reach a replica"
+        )
+        self._ejections = self.metrics.counter("nllb_router_ejections_total", "Times a replica was ejected")
+        self._outstanding = self.metrics.gauge("nllb_router_outstanding", "Requests in flight per replica")
+        self._healthy = self.metrics.gauge("nllb_router_replica_healthy", "1 while a replica receives traffic")
+        for replica in self.replicas:
+            self._publish(replica)
+
+    def _publish(self, replica):
+        self._outstanding.set(replica.outstanding, replica=replica.address)
+        self._healthy.set(int(replica.healthy), replica=replica.address)
+
+    def _preferred(self, candidates, key):
+        # Rendezvous hashing: a pair keeps its replica while the set of candidates allows
+        def score(replica):
+            return hashlib.blake2b(f"{key}|{replica.address}".encode("utf-8"), digest_size=8).digest()
+
+        return max(candidates, key=score)
+
+    def acquire(self, key=None, exclude=()):
+        """
+        Pick a replica for a request and count it as outstanding there.
+
+        Args:
+            key: Affinity key (the language pair), or None.
+            exclude: Replicas already tried for this request.
+
+        Raises:
+            NoReplicaAvailable: Every replica is excluded.
+        """
+        with self._lock:
+            candidates = [r for r in self.replicas if r.healthy and r not in exclude]
+            if not candidates:
+                candidates = [r for r in self.replicas if r not in exclude]
+            if not candidates:
+                raise NoReplicaAvailable("No replica left to try")
+            # Ties rotate, so an idle set still spreads requests
+            offset = next(self._turn)
+            ordered = candidates[offset % len(candidates):] + candidates[:offset % len(candidates)]
+            replica = min(ordered, key=lambda r: r.outstanding)
+            if self.affinity and key is not None:
+                preferred = self._preferred(candidates, key)
+                if preferred.outstanding <= replica.outstanding + self.affinity_slack:
+                    replica = preferred
+            replica.outstanding += 1
+            self._publish(replica)
+        self._requests.inc(replica=replica.address)
+        return replica
+
+    def release(self, replica, ok=True):
+        """Finish a request acquired on `replica`; `ok` is False if it failed to reach it."""
+        with self._lock:
+            replica.outstanding -= 1
+            self._record(replica, ok)
+
+    def record_check(self, replica, ok):
+        with self._lock:
+            self._record(replica, ok)
+
+    def _record(self, replica, ok):
+        # Caller holds the lock
+        if ok:
+            if not replica.healthy:
+                print(f"Replica {replica.address} is back")
+            replica.failures = 0
+            replica.healthy = True
+        else:
+            self._failures.inc(replica=replica.address)
+            replica.failures += 1
+            if replica.healthy and replica.failures >= self.failure_threshold:
+                replica.healthy = False
+                self._ejections.inc(replica=replica.address)
+                print(f"Replica {replica.address} ejected after {replica.failures} consecutive failures")
+        self._publish(replica)
+
+    def forward(self, key, send, is_unreachable):
+        """
+        Run `send(replica)` on a chosen replica, retrying others while it
+        cannot be reached.
+
+        Args:
+            key: Affinity key, or None.
+            send: Callable(replica) -> response.
+            is_unreachable: Callable(exception) -> True if the request did not
+                reach a working replica (and may be retried elsewhere).
+        """
+        tried = []
+        while True:
+            replica = self.acquire(key, exclude=tried)
+            try:
+                response = send(replica)
+            except Exception as e:
+                unreachable = is_unreachable(e)
+                self.release(replica, ok=not unreachable)
+                if not unreachable:
+                    raise
+                tried.append(replica)
+                if len(tried) == len(self.replicas):
+                    raise NoReplicaAvailable(f"No replica could be reached: {e!r}") from e
+                continue
+            self.release(replica)
+            return response
+
+    def start_health_checks(self, check, interval=2.0):
+        """
+        Call `check(replica) -> bool` on every replica every `interval`
+        seconds from a daemon thread.
+        """
+
+        def loop():
+            while True:
+                for replica in self.replicas:
+                    try:
+                        ok = bool(check(replica))
+                    except Exception:
+                        ok = False
+                    self.record_check(replica, ok)
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name="router-health", daemon=True).start()
+
+
+# Standard server protocol ---------------------------------------------------
+
+def _message_key(message):
+    # Language pair of a message; a client-side batch is keyed by its first request
+    if isinstance(message, list):
+        message = message[0] if message else None
+    if not isinstance(message, dict) or "command" in message:
+        return None
+    target = message.get("target_langs", message.get("target_lang"))
+    return f"{message.get('source_lang')}>{json.dumps(target)}"
+
+
+def _frame_key(header, offset, frame):
+    # Binary rows start with the source language token
+    lengths = header.get("lengths") or [0]
+    source = int(np.frombuffer(frame, dtype="<i4", count=1, offset=offset)[0]) if lengths[0] else None
+    target = header.get("target_langs", header.get("target_lang"))
+    return f"{source}>{json.dumps(target)}"
+
+
+class _Upstream:
+    """Keep-alive connection to a replica, in JSON or binary frame mode."""
+
+    def __init__(self, address, timeout):
+        self.sock = socket.create_connection(parse_address(address), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile("rb")
+
+    def exchange_message(self, data):
+        self.sock.sendall(data)
+        line = self.file.readline()
+        if not line:
+            raise ConnectionClosed("Replica closed the connection")
+        return line
+
+    def exchange_frame(self, frame):
+        self.sock.sendall(frame)
+        # A binary connection never reads through the buffered file
+        response = read_raw_frame(self.sock)
+        if response is None:
+            raise ConnectionClosed("Replica closed the connection")
+        return response[2]
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def _unreachable(error):
+    return isinstance(error, OSError)
+
+
+class StandardRouter:
+    """
+    Routes standard server connections message by message.
+
+    Args:
+        replica_set: ReplicaSet of standard server addresses.
+        timeout: Socket timeout towards the replicas, in seconds.
+        max_connections: Pooled connections per replica and mode.
+    """
+
+    def __init__(self, replica_set, timeout=300.0, max_connections=64):
+        self.replica_set = replica_set
+        self.timeout = timeout
+        self._pools = {
+            (replica.address, binary): ConnectionPool(
+                lambda address=replica.address: _Upstream(address, timeout), max_size=max_connections
+            )
+            for replica in replica_set.replicas
+            for binary in (False, True)
+        }
+        self._probes = {}
+
+    def _exchange(self, replica, binary, data):
+        pool = self._pools[(replica.address, binary)]
+        try:
+            return self._send(pool, binary, data)
+        except ConnectionError:
+            # After a replica restart every idle connection to it is dead; drop
+            # them and retry once on a fresh one before counting a failure
+            pool.clear()
+            return self._send(pool, binary, data)
+
+    @staticmethod
+    def _send(pool, binary, data):
+        with pool.acquire() as conn:
+            return conn.exchange_frame(data) if binary else conn.exchange_message(data)
+
+    def check(self, replica):
+        """Health check: the replica answers the metrics control command."""
+        # One kept-alive probe connection per replica, reopened after a failure
+        conn = self._probes.pop(replica.address, None) or _Upstream(replica.address, min(self.timeout, 5.0))
+        try:
+            healthy = isinstance(json.loads(conn.exchange_message(encode_message({"command": "metrics"}))), dict)
+        except BaseException:
+            conn.close()
+            raise
+        self._probes[replica.address] = conn
+        return healthy
+
+    def _route(self, key, binary, data):
+        try:
+            return self.replica_set.forward(key, lambda replica: self._exchange(replica, binary, data), _unreachable)
+        except NoReplicaAvailable as e:
+            error = {"error": str(e), "code": "unavailable"}
+            return encode_frame(error) if binary else encode_message(error)
+
+    def handle_client(self, client_socket):
+        try:
+            first = client_socket.recv(1, socket.MSG_PEEK)
+            if first == FRAME_MAGIC[:1]:
+                while True:
+                    try:
+                        frame = read_raw_frame(client_socket)
+                    except ValueError as e:
+                        client_socket.sendall(encode_frame({"error": str(e)}))
+                        break
+                    if frame is None:
+                        break
+                    client_socket.sendall(self._route(_frame_key(*frame), True, frame[2]))
+                return
+            reader = MessageReader(client_socket)
+            while True:
+                try:
+                    message = reader.read()
+                except ValueError as e:
+                    client_socket.sendall(encode_message({"error": str(e)}))
+                    continue
+                if message is None:
+                    break
+                client_socket.sendall(self._route(_message_key(message), False, encode_message(message)))
+        except OSError as e:
+            print(f"Connection error: {e}")
+        finally:
+            client_socket.close()
+
+    def serve_forever(self, host="127.0.0.1", port=9003, backlog=128):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((host, port))
+        server_socket.listen(backlog)
+        print(f"Routing port {port} to {', '.join(r.address for r in self.replica_set.replicas)}")
+        while True:
+            client_socket, _ = server_socket.accept()
+            threading.Thread(target=self.handle_client, args=(client_socket,), daemon=True).start()
+
+
+# KServe v2 gRPC (Triton) -----------------------------------------------------
+
+def _infer_key(request):
+    # Language pair of a ModelInferRequest: target parameter(s) and the source
+    # language token that starts the first INPUT_IDS row
+    parameters = request.parameters
+    if "target_langs" in parameters:
+        target = parameters["target_langs"].string_param
+    else:
+        target = parameters["target_lang"].string_param if "target_lang" in parameters else None
+    source = None
+    for index, tensor in enumerate(request.inputs):
+        if tensor.name == "INPUT_IDS" and index < len(request.raw_input_contents):
+            raw = request.raw_input_contents[index]
+            dtype = "<i8" if tensor.datatype == "INT64" else "<i4"
+            source = int(np.frombuffer(raw, dtype=dtype, count=1)[0]) if raw else None
+    return f"{source}>{target}"
+
+
+def _call_options(context):
+    # Forward the caller's deadline (gRPC reports "none" as a huge remainder) and metadata
+    remaining = context.time_remaining()
+    metadata = [(key, value) for key, value in context.invocation_metadata() if key != "user-agent"]
+    return {"timeout": remaining if remaining is not None and remaining < 86400 else None, "metadata": metadata}
+
+
+class GrpcRouter:
+    """
+    Routes KServe v2 gRPC calls (raw bytes) to the replicas.
+
+    Args:
+        replica_set: ReplicaSet of gRPC addresses.
+        timeout: Health check timeout in seconds.
+    """
+
+    def __init__(self, replica_set, timeout=5.0):
+        import grpc
+        from tritonclient.grpc import service_pb2
+
+        self._grpc = grpc
+        self._pb = service_pb2
+        self.replica_set = replica_set
+        self.timeout = timeout
+        self._channels = {
+            replica.address: grpc.insecure_channel(replica.address, options=GRPC_OPTIONS)
+            for replica in replica_set.replicas
+        }
+
+    def _unreachable(self, error):
+        return isinstance(error, self._grpc.RpcError) and error.code() == self._grpc.StatusCode.UNAVAILABLE
+
+    def check(self, replica):
+        """Health check: ServerReady."""
+        call = self._channels[replica.address].unary_unary(
+            GRPC_SERVICE + "ServerReady", response_deserializer=self._pb.ServerReadyResponse.FromString
+        )
+        return call(self._pb.ServerReadyRequest().SerializeToString(), timeout=self.timeout).ready
+
+    def _unary(self, method, request, context):
+        key = None
+        if method.endswith("/ModelInfer"):
+            try:
+                key = _infer_key(self._pb.ModelInferRequest.FromString(request))
+            except Exception:
+                key = None  # malformed requests are left to the replica to reject
+
+        def send(replica):
+            call = self._channels[replica.address].unary_unary(method)
+            return call(request, **_call_options(context))
+
+        try:
+            return self.replica_set.forward(key, send, self._unreachable)
+        except NoReplicaAvailable as e:
+            context.abort(self._grpc.StatusCode.UNAVAILABLE, str(e))
+        except self._grpc.RpcError as e:
+            context.abort(e.code(), e.details())
+
+    def _stream(self, method, requests, context):
+        # A stream stays on one replica; it is not retried once it has started
+        replica = self.replica_set.acquire()
+        ok = True
+        try:
+            call = self._channels[replica.address].stream_stream(method)
+            yield from call(requests, **_call_options(context))
+        except self._grpc.RpcError as e:
+            ok = not self._unreachable(e)
+            context.abort(e.code(), e.details())
+        finally:
+            self.replica_set.release(replica, ok)
+
+    def serve(self, host="127.0.0.1", port=9001, max_workers=64):
+        """Start serving from a thread pool; returns the started grpc.Server."""
+        grpc = self._grpc
+        router = self
+
+        class Handler(grpc.GenericRpcHandler):
+            def service(self, handler_call_details):
+                method = handler_call_details.method
+                if method.endswith("/ModelStreamInfer"):
+                    return grpc.stream_stream_rpc_method_handler(
+                        lambda requests, context: router._stream(method, requests, context)
+                    )
+                return grpc.unary_unary_rpc_method_handler(
+                    lambda request, context: router._unary(method, request, context)
+                )
+
+        server = grpc.server(
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="router-grpc"), options=GRPC_OPTIONS
+        )
+        server.add_generic_rpc_handlers((Handler(),))
+        server.add_insecure_port(f"{host}:{port}")
+        server.start()
+        print(f"Routing gRPC port {port} to {', '.join(r.address for r in self.replica_set.replicas)}")
+        return server
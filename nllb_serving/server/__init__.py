@@ -0,0 +1,15 @@
+"""Serving components for the standard server (ServerNormal/python.py)."""
+from nllb_serving.server.batcher import BatchItem, DynamicBatcher
+from nllb_serving.server.coalescing import InflightCoalescer
+from nllb_serving.server.controller import AIMDController
+from nllb_serving.server.scheduler import DeadlineExceeded, Overloaded, RequestQueue
+
+__all__ = [
+    "AIMDController",
+    "BatchItem",
+    "DeadlineExceeded",
+    "DynamicBatcher",
+    "InflightCoalescer",
+    "Overloaded",
+    "RequestQueue",
+]
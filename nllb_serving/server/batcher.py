@@ -0,0 +1,339 @@
+"""
+Server-side dynamic batching for the standard server.
+
+Connection threads submit sentences with `DynamicBatcher.submit`; a single
+worker thread owns the model and forms batches from the queue, the same way
+Triton's dynamic batcher does with `max_batch_size` and
+`max_queue_delay_microseconds`. Only requests with the same key (language
+pair) are batched together. The queue order (priority, then earliest
+deadline) and deadline shedding live in `scheduler.py`.
+
+The queue is bounded by the number of queued sentences and tokens. A
+submission that does not fit is rejected at once with `Overloaded`, carrying
+a retry-after hint derived from the backlog and the measured throughput, so
+clients back off instead of piling up in the accept queue.
+
+Every result carries a per-stage breakdown (see `nllb_serving.stages`): the
+batcher times queue wait and batch formation, `run_batch` the model stages.
+
+With `split_batch` (e.g. a nllb_serving.memory.MemoryBudget plan), a batch
+can be run as several consecutive sub-batches; a sub-batch that fails only
+fails the requests with sentences in it.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+from nllb_serving.metrics import SIZE_BUCKETS, STAGE_BUCKETS, MetricsRegistry
+from nllb_serving.server.scheduler import DeadlineExceeded, Overloaded, RequestQueue
+from nllb_serving.stages import collect_stages, stage
+
+MIN_RETRY_AFTER = 0.05
+MAX_RETRY_AFTER = 5.0
+
+
+class StageFuture(Future):
+    """Future of a BatchItem's results; `timings` maps stage -> seconds once it is done."""
+
+    timings = None
+
+
+class BatchItem:
+    """
+    One submitted request: a list of texts that share a batching key.
+
+    Args:
+        key: Batching key; only items with equal keys share a batch.
+        texts: Sentences to translate.
+        priority: Priority class, lower is more urgent.
+        deadline: Absolute `time.monotonic()` time after which the result is useless.
+        tokens: Token count of the texts, used for admission control.
+    """
+
+    __slots__ = ("key", "texts", "priority", "deadline", "tokens", "future", "enqueued_at")
+
+    def __init__(self, key, texts, priority=0, deadline=None, tokens=0):
+        self.key = key
+        self.texts = texts
+        self.priority = priority
+        self.deadline = deadline
+        self.tokens = tokens
+        self.future = StageFuture()
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def size(self):
+        return len(self.texts)
+
+
+class DynamicBatcher:
+    """
+    Collects submitted requests into batches for a single model thread.
+
+    The most urgent queued request heads the next batch, which is filled with
+    same-key requests in scheduling order. It is dispatched when it holds
+    `max_batch_size` sentences, when its head has waited `max_queue_delay`
+    seconds, or when waiting longer would pass the head's deadline. Both
+    limits can be changed while running, which is what the optional
+    controller does.
+
+    Args:
+        run_batch: Callable(key, texts) -> list of results, one per text.
+            Stages it records with `nllb_serving.stages.stage` are added to
+            each item's timings.
+        max_batch_size: Maximum number of sentences per batch.
+        max_queue_delay: Seconds the oldest request may wait for a fuller batch.
+        controller: Optional object with `record(latency)` and
+            `adjust(max_batch_size, max_queue_delay, backlog)` (see AIMDController).
+        metrics: MetricsRegistry receiving batch and latency metrics.
+        max_queued_sentences: Admission limit on sentences waiting in the queue.
+        max_queued_tokens: Admission limit on tokens waiting in the queue.
+        count_tokens: Callable(text) -> token count; required for max_queued_tokens.
+        split_batch: Callable(key, texts) -> (start, end) ranges of texts to
+            run as separate `run_batch` calls, in order; None runs each batch whole.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_queue_delay=0.005, controller=None, metrics=None,
+                 max_queued_sentences=None, max_queued_tokens=None, count_tokens=None, split_batch=None):
+        self.run_batch = run_batch
+        self.split_batch = split_batch
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay = max_queue_delay
+        self.controller = controller
+        self.metrics = metrics or MetricsRegistry()
+        self.max_queued_sentences = max_queued_sentences
+        self.max_queued_tokens = max_queued_tokens
+        self.count_tokens = count_tokens
+        if max_queued_tokens is not None and count_tokens is None:
+            raise ValueError("max_queued_tokens needs a count_tokens function")
+        self._throughput = None  # sentences per second, exponentially averaged
+        self._queue = RequestQueue()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._calls = []
+
+        self._batch_size = self.metrics.histogram(
+            "nllb_batch_size", "Sentences per executed batch", buckets=SIZE_BUCKETS
+        )
+        self._queue_wait = self.metrics.histogram("nllb_queue_wait_seconds", "Time from submit to batch start")
+        self._latency = self.metrics.histogram("nllb_request_latency_seconds", "Time from submit to result")
+        self._stages = self.metrics.histogram(
+            "nllb_stage_seconds", "Time requests spend in each serving stage", buckets=STAGE_BUCKETS
+        )
+        self._queue_depth = self.metrics.gauge("nllb_queue_depth", "Sentences waiting in the batcher queue")
+        self._queue_tokens = self.metrics.gauge("nllb_queue_tokens", "Tokens waiting in the batcher queue")
+        self._rejected = self.metrics.counter(
+            "nllb_requests_rejected_total", "Requests refused by admission control"
+        )
+        self._expired = self.metrics.counter(
+            "nllb_requests_expired_total", "Requests shed because their deadline passed in the queue"
+        )
+        self._max_batch_size = self.metrics.gauge("nllb_batcher_max_batch_size", "Current batch size limit")
+        self._max_queue_delay = self.metrics.gauge(
+            "nllb_batcher_max_queue_delay_seconds", "Current queue delay limit"
+        )
+        self._publish_limits()
+
+    def _publish_limits(self):
+        self._max_batch_size.set(self.max_batch_size)
+        self._max_queue_delay.set(self.max_queue_delay)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="batcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def call_soon(self, fn):
+        """Run `fn()` on the batcher thread, which owns the model, before its next batch."""
+        with self._cond:
+            self._calls.append(fn)
+            self._cond.notify()
+
+    def submit(self, key, texts, priority=0, deadline=None):
+        """
+        Queue `texts` for translation; returns a Future of the list of results.
+
+        The future fails with DeadlineExceeded if `deadline` (absolute
+        `time.monotonic()` time) passes before the batch starts.
+
+        Raises:
+            Overloaded: The queue limits do not allow the request.
+        """
+        return self.submit_all([(key, texts, priority, deadline)])[0]
+
+    def submit_all(self, submissions):
+        """
+        Admit several (key, texts, priority, deadline) submissions atomically.
+
+        Either all are queued or none is, so a multi-part message is never
+        half accepted. Returns one Future per submission.
+        """
+        items = []
+        for key, texts, priority, deadline in submissions:
+            texts = list(texts)
+            tokens = sum(map(self.count_tokens, texts)) if self.count_tokens else 0
+            items.append(BatchItem(key, texts, priority, deadline, tokens))
+        sentences = sum(item.size for item in items)
+        tokens = sum(item.tokens for item in items)
+        with self._cond:
+            # An empty queue admits anything, so oversized requests still run when idle
+            reason = None
+            if not self._queue:
+                pass
+            elif self.max_queued_sentences is not None and self._queue.size + sentences > self.max_queued_sentences:
+                reason = "sentences"
+            elif self.max_queued_tokens is not None and self._queue.tokens + tokens > self.max_queued_tokens:
+                reason = "tokens"
+            if reason is not None:
+                self._rejected.inc(reason=reason)
+                raise Overloaded(f"Server overloaded: queued {reason} limit reached", self._retry_after())
+            for item in items:
+                self._queue.push(item)
+            self._publish_depth()
+            self._cond.notify()
+        return [item.future for item in items]
+
+    def _publish_depth(self):
+        self._queue_depth.set(self._queue.size)
+        self._queue_tokens.set(self._queue.tokens)
+
+    def _retry_after(self):
+        """Estimate how long draining the current backlog takes."""
+        if not self._throughput:
+            return MIN_RETRY_AFTER
+        return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, self._queue.size / self._throughput))
+
+    def _shed_expired(self, now):
+        for item in self._queue.pop_expired(now):
+            self._expired.inc(priority=item.priority)
+            item.future.set_exception(DeadlineExceeded("Deadline exceeded before the request was scheduled"))
+
+    def _take_batch(self):
+        """
+        Wait for the next batch and remove it from the queue.
+
+        Returns (batch, time batch formation started), or None when stopped.
+        The batch is empty when `call_soon` calls are waiting to run.
+        """
+        with self._cond:
+            formation_started = None
+            while True:
+                while not self._queue and not self._stopped and not self._calls:
+                    self._cond.wait()
+                if self._stopped:
+                    return None
+                if self._calls:
+                    return [], formation_started
+                now = time.monotonic()
+                self._shed_expired(now)
+                if not self._queue:
+                    self._publish_depth()
+                    formation_started = None
+                    continue
+                if formation_started is None:
+                    formation_started = now
+                first = self._queue.head()
+                batch, size = [], 0
+                for item in self._queue:
+                    if item.key != first.key:
+                        continue
+                    if batch and size + item.size > self.max_batch_size:
+                        break
+                    batch.append(item)
+                    size += item.size
+                remaining = first.enqueued_at + self.max_queue_delay - now
+                if first.deadline is not None and first.deadline <= now + remaining:
+                    # Waiting for a fuller batch would run into the head's deadline
+                    remaining = 0
+                if size >= self.max_batch_size or remaining <= 0:
+                    self._queue.remove(batch)
+                    self._publish_depth()
+                    return batch, formation_started
+                # Wake up for a fuller batch, the end of the delay, or the next expiry
+                self._cond.wait(min(remaining, self._queue.next_deadline() - now))
+
+    def _loop(self):
+        while True:
+            taken = self._take_batch()
+            if taken is None:
+                return
+            self._run_calls()
+            if taken[0]:
+                self._execute(*taken)
+
+    def _run_calls(self):
+        with self._cond:
+            calls, self._calls = self._calls, []
+        for fn in calls:
+            try:
+                fn()
+            except Exception as e:
+                print(f"Batcher call failed: {e!r}")
+
+    def _execute(self, batch, formation_started):
+        started = time.monotonic()
+        key = batch[0].key
+        texts = [text for item in batch for text in item.texts]
+        self._batch_size.observe(len(texts))
+        results, failures = [None] * len(texts), []
+        with collect_stages() as model_stages:
+            ranges = [(0, len(texts))]
+            if self.split_batch is not None:
+                try:
+                    with stage("batch_formation"):
+                        ranges = self.split_batch(key, texts)
+                except Exception as e:
+                    # A failed plan fails this batch, not the batcher thread
+                    ranges, failures = [], [(0, len(texts), e)]
+            for start, end in ranges:
+                try:
+                    out = self.run_batch(key, texts[start:end])
+                    # A slice assignment of the wrong length would shift every later result
+                    if len(out) != end - start:
+                        raise RuntimeError(f"run_batch returned {len(out)} results for {end - start} texts")
+                    results[start:end] = out
+                except Exception as e:
+                    failures.append((start, end, e))
+        finished = time.monotonic()
+        if finished > started:
+            rate = len(texts) / (finished - started)
+            self._throughput = rate if self._throughput is None else 0.8 * self._throughput + 0.2 * rate
+
+        start = 0
+        for item in batch:
+            end = start + item.size
+            error = next((e for low, high, e in failures if low < end and start < high), None)
+            # Queue wait lasts until the batcher starts forming the item's batch;
+            # items that arrive during formation only wait for the batch to fill
+            forming = max(formation_started, item.enqueued_at)
+            timings = dict(model_stages)
+            timings["queue_wait"] = forming - item.enqueued_at
+            timings["batch_formation"] = timings.get("batch_formation", 0.0) + started - forming
+            for name, seconds in timings.items():
+                self._stages.observe(seconds, stage=name)
+            item.future.timings = timings
+            self._queue_wait.observe(started - item.enqueued_at)
+            self._latency.observe(finished - item.enqueued_at)
+            if self.controller is not None:
+                self.controller.record(finished - item.enqueued_at)
+            if error is not None:
+                item.future.set_exception(error)
+            else:
+                item.future.set_result(results[start:end])
+            start = end
+
+        if self.controller is not None:
+            with self._cond:
+                backlog = self._queue.size
+            self.max_batch_size, self.max_queue_delay = self.controller.adjust(
+                self.max_batch_size, self.max_queue_delay, backlog
+            )
+            self._publish_limits()
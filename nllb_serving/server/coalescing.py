@@ -0,0 +1,170 @@
+"""
+In-flight coalescing of identical sentences (singleflight).
+
+When the same sentence is requested by many clients at once, every copy
+would otherwise be queued and run through the model, since none has finished
+yet. `InflightCoalescer` sits in front of the DynamicBatcher: a sentence
+whose (batching key, text) is already queued or running attaches to that
+computation and receives its result instead of being queued again. The
+batching key holds the language pair, so the coalescing key is
+(text, source, target); decoding is greedy, so the results are identical.
+
+A sentence only attaches to a computation that will not be dropped before
+the sentence itself would be: one queued at the same or a more urgent
+priority, and without a deadline earlier than the new sentence's. Otherwise
+it is queued as usual.
+"""
+import threading
+
+from nllb_serving.metrics import MetricsRegistry
+from nllb_serving.server.batcher import StageFuture
+
+
+def _content_key(text):
+    # Token rows (lists or arrays of ids) are keyed by their ids
+    return text if isinstance(text, str) else tuple(int(token) for token in text)
+
+
+class _Inflight:
+    __slots__ = ("future", "index", "priority", "deadline")
+
+    def __init__(self, future, index, priority, deadline):
+        self.future = future
+        self.index = index
+        self.priority = priority
+        self.deadline = deadline
+
+    def covers(self, priority, deadline):
+        if self.priority > priority:
+            return False
+        return self.deadline is None or (deadline is not None and self.deadline >= deadline)
+
+
+def _gather(sources):
+    """
+    StageFuture of the list of results picked by `sources`, a list of
+    (future, index) pairs; it fails with the first failure among them.
+    """
+    combined = StageFuture()
+    futures = list({id(future): future for future, _ in sources}.values())
+    pending = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            pending[0] -= 1
+            if pending[0]:
+                return
+        failed = next((future for future in futures if future.exception() is not None), None)
+        # Timings are those of the computation that produced the first sentence
+        combined.timings = sources[0][0].timings
+        if failed is not None:
+            combined.set_exception(failed.exception())
+        else:
+            combined.set_result([future.result()[index] for future, index in sources])
+
+    for future in futures:
+        future.add_done_callback(done)
+    return combined
+
+
+class InflightCoalescer:
+    """
+    Deduplicates identical in-flight sentences in front of a DynamicBatcher.
+
+    Has the batcher's submit/submit_all interface and results.
+
+    Args:
+        batcher: DynamicBatcher the remaining sentences are queued on.
+        metrics: MetricsRegistry receiving the coalesced sentence counter.
+    """
+
+    def __init__(self, batcher, metrics=None):
+        self.batcher = batcher
+        self.metrics = metrics or MetricsRegistry()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._coalesced = self.metrics.counter(
+            "nllb_coalesced_sentences_total",
+            "Sentences answered by an identical translation already in flight instead of being queued",
+        )
+
+    def submit(self, key, texts, priority=0, deadline=None):
+        """See DynamicBatcher.submit."""
+        return self.submit_all([(key, texts, priority, deadline)])[0]
+
+    def submit_all(self, submissions):
+        """
+        Queue the sentences that are not already in flight; see DynamicBatcher.submit_all.
+
+        Raises:
+            Overloaded: The queue limits do not allow the new sentences.
+        """
+        plans, queued = [], []
+        coalesced = 0
+        with self._lock:
+            for key, texts, priority, deadline in submissions:
+                texts = list(texts)
+                placeholder = StageFuture()
+                new_texts, sources, registered = [], [], []
+                for text in texts:
+                    content = (key, _content_key(text))
+                    inflight = self._inflight.get(content)
+                    if inflight is not None and inflight.covers(priority, deadline):
+                        sources.append((inflight.future, inflight.index))
+                        coalesced += 1
+                        continue
+                    entry = _Inflight(placeholder, len(new_texts), priority, deadline)
+                    if inflight is None:
+                        self._inflight[content] = entry
+                        registered.append((content, entry))
+                    sources.append((placeholder, len(new_texts)))
+                    new_texts.append(text)
+                # Empty submissions are passed through, so they behave as on the batcher
+                if new_texts or not texts:
+                    queued.append((key, new_texts, priority, deadline))
+                else:
+                    placeholder = None
+                plans.append((placeholder, sources, registered, len(new_texts)))
+
+        # Queued outside the lock: the batcher fails futures while holding its own
+        try:
+            futures = iter(self.batcher.submit_all(queued)) if queued else iter(())
+        except Exception as e:
+            with self._lock:
+                for _, _, registered, _ in plans:
+                    self._retire(registered)
+            # Sentences that attached in the meantime share the failure
+            for placeholder, _, _, _ in plans:
+                if placeholder is not None:
+                    placeholder.set_exception(e)
+            raise
+        if coalesced:
+            self._coalesced.inc(coalesced)
+
+        results = []
+        for placeholder, sources, registered, count in plans:
+            if placeholder is not None:
+                self._link(next(futures), placeholder, registered)
+            # Nothing coalesced: the queued sentences are the whole submission
+            results.append(placeholder if count == len(sources) else _gather(sources))
+        return results
+
+    def _retire(self, registered):
+        # Caller holds the lock
+        for content, entry in registered:
+            if self._inflight.get(content) is entry:
+                del self._inflight[content]
+
+    def _link(self, future, placeholder, registered):
+        # Forward the batcher's result and retire the sentences once it is known
+        def done(_):
+            with self._lock:
+                self._retire(registered)
+            placeholder.timings = future.timings
+            if future.exception() is not None:
+                placeholder.set_exception(future.exception())
+            else:
+                placeholder.set_result(future.result())
+
+        future.add_done_callback(done)
@@ -0,0 +1,98 @@
+"""
+SLO-driven tuning of the dynamic batcher.
+
+Larger batches and longer queue delays raise throughput but also latency.
+AIMDController looks at the observed p95 request latency every `interval`
+requests: while it is comfortably below the SLO the batch size and delay grow
+additively, and as soon as it exceeds the SLO both are cut multiplicatively,
+like TCP congestion control. Quiet periods therefore run with small batches
+and peaks with the largest batches the SLO allows.
+
+When the SLO is missed because requests are queueing (a backlog of at least
+one full batch), smaller batches would only lower throughput and lengthen the
+queue, so the controller drains instead: the delay is cut and the batch size
+grows.
+"""
+from nllb_serving.metrics import MetricsRegistry, percentile
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease controller for batch size and queue delay.
+
+    Args:
+        slo: Latency objective in seconds for the chosen percentile.
+        quantile: Percentile of request latency compared with the SLO.
+        interval: Number of requests observed between two decisions.
+        headroom: Grow only while p95 < headroom * slo; hold in between.
+        min_batch_size, max_batch_size: Bounds for the batch size.
+        batch_step: Additive batch size increase.
+        min_delay, max_delay: Bounds for the queue delay in seconds.
+        delay_step: Additive queue delay increase in seconds.
+        decrease: Multiplicative factor applied when the SLO is exceeded.
+        metrics: MetricsRegistry receiving the controller's decisions.
+    """
+
+    def __init__(self, slo, quantile=95, interval=32, headroom=0.8,
+                 min_batch_size=1, max_batch_size=64, batch_step=2,
+                 min_delay=0.0, max_delay=0.05, delay_step=0.001, decrease=0.5, metrics=None):
+        self.slo = slo
+        self.quantile = quantile
+        self.interval = interval
+        self.headroom = headroom
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.batch_step = batch_step
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay_step = delay_step
+        self.decrease = decrease
+        self._window = []
+
+        metrics = metrics or MetricsRegistry()
+        self._decisions = metrics.counter("nllb_controller_decisions_total", "Controller decisions by action")
+        self._observed = metrics.gauge(
+            "nllb_controller_latency_quantile_seconds", "Latency percentile behind the last decision"
+        )
+        self._slo = metrics.gauge("nllb_controller_slo_seconds", "Latency objective")
+        self._slo.set(slo)
+
+    def record(self, latency):
+        self._window.append(latency)
+
+    def adjust(self, batch_size, delay, backlog=0):
+        """
+        Return the (batch_size, delay) to use next.
+
+        Args:
+            batch_size: Current batch size limit.
+            delay: Current queue delay limit in seconds.
+            backlog: Number of sentences still waiting in the queue.
+        """
+        if len(self._window) < self.interval:
+            return batch_size, delay
+        observed = percentile(self._window, self.quantile)
+        self._window = []
+        self._observed.set(observed)
+
+        if observed > self.slo and backlog >= batch_size:
+            action = "drain"
+            batch_size = min(self.max_batch_size, batch_size + self.batch_step)
+            delay = self._cut(delay)
+        elif observed > self.slo:
+            action = "decrease"
+            batch_size = max(self.min_batch_size, int(batch_size * self.decrease))
+            delay = self._cut(delay)
+        elif observed < self.headroom * self.slo:
+            action = "increase"
+            batch_size = min(self.max_batch_size, batch_size + self.batch_step)
+            delay = min(self.max_delay, delay + self.delay_step)
+        else:
+            action = "hold"
+        self._decisions.inc(action=action)
+        return batch_size, delay
+
+    def _cut(self, delay):
+        delay *= self.decrease
+        # Below 0.1 ms a queue delay only adds a wakeup, so drop to the minimum
+        return delay if delay >= max(self.min_delay, 1e-4) else self.min_delay
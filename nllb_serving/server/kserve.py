@@ -0,0 +1,368 @@
+"""
+KServe v2 inference protocol front end for the standard server.
+
+Serves the same tensor contract as Modelrepo/nllb/config.pbtxt: INT32
+INPUT_IDS and ATTENTION_MASK of shape [batch, seq] in, INT32 OUTPUT_IDS out,
+with the target language in the "target_lang" request parameter (or several,
+as a JSON list in "target_langs", for len(target_langs) output rows per input
+row). The optional FP32 STAGE_TIMES_MS output holds each row's per-stage
+breakdown in `nllb_serving.stages.STAGES` order. Both transports are offered
+so `tritonclient` can drive either backend:
+
+* HTTP/1.1 with keep-alive, including Triton's binary tensor extension
+  (`Inference-Header-Content-Length`) that `tritonclient.http` uses by default.
+* gRPC, implemented on the `GRPCInferenceService` stubs shipped with
+  `tritonclient[grpc]` (optional; only needed when the gRPC port is enabled),
+  including the bidirectional ModelStreamInfer call: requests on a stream run
+  concurrently and each response carries its request's id.
+
+Triton's reserved "priority" (1 = highest) and "timeout" (microseconds)
+parameters map onto the server's priority classes and deadlines. Only the
+requested outputs are returned (all of them if none are named).
+"""
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from nllb_serving.server.scheduler import DeadlineExceeded, Overloaded
+from nllb_serving.stages import STAGES
+
+MODEL_NAME = "nllb"
+MODEL_VERSION = "1"
+DEFAULT_TARGET_LANG = "asm_Beng"
+INPUTS = (("INPUT_IDS", "INT32"), ("ATTENTION_MASK", "INT32"))
+OUTPUTS = (("OUTPUT_IDS", "INT32"), ("STAGE_TIMES_MS", "FP32"))
+DATATYPES = {"INT32": np.int32, "INT64": np.int64}
+
+
+class InvalidRequest(ValueError):
+    """The inference request does not match the model's tensor contract."""
+
+
+class KServeFrontend:
+    """
+    Transport-independent part of the KServe v2 protocol.
+
+    Args:
+        infer: Callable(input_ids, attention_mask, target_lang, priority,
+            deadline) -> (int32 OUTPUT_IDS array, stage -> seconds dict),
+            where `target_lang` is a code or a tuple of codes and `deadline`
+            is an absolute `time.monotonic()` time or None.
+        model_name: Name the model is served under.
+    """
+
+    def __init__(self, infer, model_name=MODEL_NAME):
+        self._infer = infer
+        self.model_name = model_name
+
+    def server_metadata(self):
+        return {"name": "nllb-standard-server", "version": "1", "extensions": ["binary_tensor_data", "parameters"]}
+
+    def model_metadata(self):
+        return {
+            "name": self.model_name,
+            "versions": [MODEL_VERSION],
+            "platform": "python",
+            "inputs": [{"name": n, "datatype": t, "shape": [-1, -1]} for n, t in INPUTS],
+            "outputs": [{"name": n, "datatype": t, "shape": [-1, -1]} for n, t in OUTPUTS],
+        }
+
+    def infer(self, tensors, parameters, arrival):
+        """
+        Run one inference request.
+
+        Args:
+            tensors: Input name -> numpy array.
+            parameters: Request parameters as plain Python values.
+            arrival: `time.monotonic()` time the request arrived.
+
+        Returns:
+            Output name -> numpy array.
+        """
+        if "INPUT_IDS" not in tensors:
+            raise InvalidRequest("Missing input 'INPUT_IDS'")
+        input_ids = tensors["INPUT_IDS"]
+        attention_mask = tensors.get("ATTENTION_MASK")
+        if input_ids.ndim != 2:
+            raise InvalidRequest(f"INPUT_IDS must have shape [batch, seq], got {list(input_ids.shape)}")
+        if attention_mask is None:
+            attention_mask = np.ones_like(input_ids)
+        elif attention_mask.shape != input_ids.shape:
+            raise InvalidRequest("ATTENTION_MASK must have the same shape as INPUT_IDS")
+
+        # Triton: priority 1 is the highest level, 0 means "default"
+        priority = max(0, int(parameters.get("priority", 0)) - 1)
+        timeout_us = parameters.get("timeout")
+        deadline = None if not timeout_us else arrival + int(timeout_us) / 1e6
+        if "target_langs" in parameters:
+            try:
+                target_lang = tuple(json.loads(parameters["target_langs"]))
+            except (TypeError, ValueError) as e:
+                raise InvalidRequest(f"target_langs must be a JSON list: {e}")
+        else:
+            target_lang = parameters.get("target_lang", DEFAULT_TARGET_LANG)
+        output_ids, timings = self._infer(
+            input_ids.astype(np.int32, copy=False), attention_mask.astype(np.int32, copy=False),
+            target_lang, priority, deadline,
+        )
+        # Stages a path does not have (e.g. tokenization) are 0
+        stage_times = np.array([timings.get(name, 0.0) * 1000 for name in STAGES], dtype=np.float32)
+        return {
+            "OUTPUT_IDS": np.ascontiguousarray(output_ids, dtype=np.int32),
+            "STAGE_TIMES_MS": np.tile(stage_times, (len(output_ids), 1)),
+        }
+
+
+def _requested(outputs, names):
+    """The (name, datatype) outputs a request asked for; all of them if it named none."""
+    return [output for output in outputs if not names or output[0] in names]
+
+
+def error_status(error):
+    """Map an inference error to (HTTP status, gRPC status name)."""
+    if isinstance(error, Overloaded):
+        return 503, "UNAVAILABLE"
+    if isinstance(error, DeadlineExceeded):
+        return 504, "DEADLINE_EXCEEDED"
+    if isinstance(error, (InvalidRequest, ValueError, KeyError)):
+        return 400, "INVALID_ARGUMENT"
+    return 500, "INTERNAL"
+
+
+# HTTP/REST -----------------------------------------------------------------
+
+def _decode_http_inputs(header, binary):
+    tensors, offset = {}, 0
+    for spec in header.get("inputs", []):
+        dtype = DATATYPES.get(spec.get("datatype"))
+        if dtype is None:
+            raise InvalidRequest(f"Unsupported datatype {spec.get('datatype')!r} for {spec.get('name')!r}")
+        size = spec.get("parameters", {}).get("binary_data_size")
+        if size is not None:
+            array = np.frombuffer(binary, dtype=dtype, count=size // np.dtype(dtype).itemsize, offset=offset)
+            offset += size
+        else:
+            array = np.asarray(spec["data"], dtype=dtype)
+        tensors[spec["name"]] = array.reshape(spec["shape"])
+    return tensors
+
+
+def _binary_outputs_requested(header):
+    if header.get("parameters", {}).get("binary_data_output"):
+        return {name for name, _ in OUTPUTS}
+    return {
+        spec["name"] for spec in header.get("outputs", [])
+        if spec.get("parameters", {}).get("binary_data")
+    }
+
+
+def make_http_handler(frontend):
+    model_path = f"/v2/models/{frontend.model_name}"
+
+    class KServeHTTPHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def _send(self, status, body, content_type="application/json", headers=()):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status, document, headers=()):
+            self._send(status, json.dumps(document).encode("utf-8"), headers=headers)
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if path in ("/v2/health/live", "/v2/health/ready", f"{model_path}/ready",
+                        f"{model_path}/versions/{MODEL_VERSION}/ready"):
+                self._send(200, b"", content_type="text/plain")
+            elif path == "/v2":
+                self._send_json(200, frontend.server_metadata())
+            elif path in (model_path, f"{model_path}/versions/{MODEL_VERSION}"):
+                self._send_json(200, frontend.model_metadata())
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            arrival = time.monotonic()
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.rstrip("/") not in (f"{model_path}/infer", f"{model_path}/versions/{MODEL_VERSION}/infer"):
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                header_length = self.headers.get("Inference-Header-Content-Length")
+                header_length = len(body) if header_length is None else int(header_length)
+                header = json.loads(body[:header_length])
+                tensors = _decode_http_inputs(header, body[header_length:])
+                outputs = frontend.infer(tensors, header.get("parameters", {}), arrival)
+            except Exception as e:
+                status, _ = error_status(e)
+                headers = [("Retry-After", f"{e.retry_after:.3f}")] if isinstance(e, Overloaded) else []
+                self._send_json(status, {"error": str(e)}, headers=headers)
+                return
+
+            binary_names = _binary_outputs_requested(header)
+            response = {"model_name": frontend.model_name, "model_version": MODEL_VERSION, "outputs": []}
+            if "id" in header:
+                response["id"] = header["id"]
+            chunks = []
+            for name, datatype in _requested(OUTPUTS, [spec["name"] for spec in header.get("outputs", [])]):
+                array = outputs[name]
+                spec = {"name": name, "datatype": datatype, "shape": list(array.shape)}
+                if name in binary_names:
+                    data = array.tobytes()
+                    spec["parameters"] = {"binary_data_size": len(data)}
+                    chunks.append(data)
+                else:
+                    spec["data"] = array.ravel().tolist()
+                response["outputs"].append(spec)
+            json_part = json.dumps(response).encode("utf-8")
+            if chunks:
+                self._send(200, json_part + b"".join(chunks), content_type="application/octet-stream",
+                           headers=[("Inference-Header-Content-Length", str(len(json_part)))])
+            else:
+                self._send(200, json_part)
+
+        def log_message(self, *args):
+            pass
+
+    return KServeHTTPHandler
+
+
+def serve_http(frontend, host="127.0.0.1", port=8005):
+    """Serve the KServe v2 REST API from a daemon thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), make_http_handler(frontend))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="kserve-http", daemon=True).start()
+    return server
+
+
+# gRPC ----------------------------------------------------------------------
+
+def _parameter_value(parameter):
+    return getattr(parameter, parameter.WhichOneof("parameter_choice"))
+
+
+def serve_grpc(frontend, host="127.0.0.1", port=8006, max_workers=16, stream_workers=64):
+    """
+    Serve the KServe v2 GRPCInferenceService; returns the started grpc.Server.
+
+    Args:
+        frontend: KServeFrontend.
+        host: Address to bind.
+        port: gRPC port.
+        max_workers: Threads serving calls (each open stream holds one).
+        stream_workers: Threads running the requests of all streams, i.e.
+            how many streamed requests can wait on the batcher at once.
+    """
+    import grpc
+    from tritonclient.grpc import service_pb2, service_pb2_grpc
+
+    stream_executor = ThreadPoolExecutor(max_workers=stream_workers, thread_name_prefix="kserve-stream")
+
+    class Servicer(service_pb2_grpc.GRPCInferenceServiceServicer):
+        def ServerLive(self, request, context):
+            return service_pb2.ServerLiveResponse(live=True)
+
+        def ServerReady(self, request, context):
+            return service_pb2.ServerReadyResponse(ready=True)
+
+        def ModelReady(self, request, context):
+            return service_pb2.ModelReadyResponse(ready=request.name == frontend.model_name)
+
+        def ServerMetadata(self, request, context):
+            return service_pb2.ServerMetadataResponse(**frontend.server_metadata())
+
+        def ModelMetadata(self, request, context):
+            metadata = frontend.model_metadata()
+            tensor = service_pb2.ModelMetadataResponse.TensorMetadata
+            return service_pb2.ModelMetadataResponse(
+                name=metadata["name"], versions=metadata["versions"], platform=metadata["platform"],
+                inputs=[tensor(**spec) for spec in metadata["inputs"]],
+                outputs=[tensor(**spec) for spec in metadata["outputs"]],
+            )
+
+        def _infer(self, request):
+            arrival = time.monotonic()
+            tensors = {}
+            for index, spec in enumerate(request.inputs):
+                dtype = DATATYPES.get(spec.datatype)
+                if dtype is None:
+                    raise InvalidRequest(f"Unsupported datatype {spec.datatype!r} for {spec.name!r}")
+                if request.raw_input_contents:
+                    array = np.frombuffer(request.raw_input_contents[index], dtype=dtype)
+                elif dtype is np.int32:
+                    array = np.asarray(spec.contents.int_contents, dtype=dtype)
+                else:
+                    array = np.asarray(spec.contents.int64_contents, dtype=dtype)
+                tensors[spec.name] = array.reshape(tuple(spec.shape))
+            parameters = {key: _parameter_value(value) for key, value in request.parameters.items()}
+            outputs = frontend.infer(tensors, parameters, arrival)
+
+            response = service_pb2.ModelInferResponse(
+                model_name=frontend.model_name, model_version=MODEL_VERSION, id=request.id
+            )
+            for name, datatype in _requested(OUTPUTS, [output.name for output in request.outputs]):
+                array = outputs[name]
+                response.outputs.add(name=name, datatype=datatype, shape=list(array.shape))
+                response.raw_output_contents.append(array.tobytes())
+            return response
+
+        def ModelInfer(self, request, context):
+            try:
+                return self._infer(request)
+            except Exception as e:
+                _, status = error_status(e)
+                context.abort(getattr(grpc.StatusCode, status), str(e))
+
+        def ModelStreamInfer(self, request_iterator, context):
+            # Requests run concurrently so they can share batches; responses
+            # go out in completion order, matched to requests by id
+            responses = queue.Queue()
+            submitted = [0]
+
+            def run(request):
+                try:
+                    response = service_pb2.ModelStreamInferResponse(infer_response=self._infer(request))
+                except Exception as e:
+                    # Triton also reports stream errors in-band, with the request id
+                    response = service_pb2.ModelStreamInferResponse(
+                        error_message=str(e), infer_response=service_pb2.ModelInferResponse(id=request.id)
+                    )
+                responses.put(response)
+
+            def read():
+                try:
+                    for request in request_iterator:
+                        submitted[0] += 1
+                        stream_executor.submit(run, request)
+                except Exception:
+                    pass  # the client cancelled the stream
+                responses.put(None)
+
+            threading.Thread(target=read, name="kserve-stream-reader", daemon=True).start()
+            sent, reading = 0, True
+            while reading or sent < submitted[0]:
+                response = responses.get()
+                if response is None:
+                    reading = False
+                    continue
+                sent += 1
+                yield response
+
+    server = grpc.server(
+        ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kserve-grpc"),
+        options=[("grpc.max_receive_message_length", -1), ("grpc.max_send_message_length", -1)],
+    )
+    service_pb2_grpc.add_GRPCInferenceServiceServicer_to_server(Servicer(), server)
+    server.add_insecure_port(f"{host}:{port}")
+    server.start()
+    return server
@@ -0,0 +1,74 @@
+"""
+Scheduling order of the batcher queue.
+
+Requests are served by priority class first (lower value = more urgent, 0 is
+the default interactive class), then earliest deadline first within a class,
+then in arrival order. Requests whose deadline has passed are shed before
+they reach the model, so abandoned work does not delay live requests.
+"""
+import bisect
+import itertools
+import math
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before the model got to it."""
+
+
+class Overloaded(RuntimeError):
+    """
+    The queue is full; the request was not admitted.
+
+    Attributes:
+        retry_after: Suggested wait in seconds before retrying.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RequestQueue:
+    """
+    Queue of BatchItems kept sorted by (priority, deadline, arrival).
+
+    Not thread-safe; the batcher guards it with its condition variable.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._seq = itertools.count()
+        self.size = 0
+        self.tokens = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return (entry[-1] for entry in self._entries)
+
+    def push(self, item):
+        deadline = math.inf if item.deadline is None else item.deadline
+        bisect.insort(self._entries, (item.priority, deadline, next(self._seq), item))
+        self.size += item.size
+        self.tokens += item.tokens
+
+    def head(self):
+        return self._entries[0][-1]
+
+    def remove(self, items):
+        ids = {id(item) for item in items}
+        self._entries = [entry for entry in self._entries if id(entry[-1]) not in ids]
+        self.size -= sum(item.size for item in items)
+        self.tokens -= sum(item.tokens for item in items)
+
+    def pop_expired(self, now):
+        """Remove and return every item whose deadline is at or before `now`."""
+        expired = [entry[-1] for entry in self._entries if entry[1] <= now]
+        if expired:
+            self.remove(expired)
+        return expired
+
+    def next_deadline(self):
+        deadlines = [entry[1] for entry in self._entries]
+        return min(deadlines, default=math.inf)
@@ -0,0 +1,336 @@
+"""
+Target-language vocabulary shortlists for the output projection.
+
+NLLB's LM head projects every decoder step onto the full ~256k-token
+vocabulary, reading the whole [vocab, d_model] weight each time, although a
+translation into one language only ever uses a small part of it.
+
+`build_shortlists` counts the tokens of reference text in each target
+language and keeps the most frequent ones up to a coverage target, plus the
+special tokens and the language's own code (the forced BOS token). A
+held-out part of the text checks the result; languages whose held-out
+coverage is too low get no shortlist and keep the full vocabulary.
+
+At runtime `VocabularyShortlist.restrict(target_langs)` swaps the model's
+LM head, for the duration of a batch, for one that projects onto the
+shortlist only and fills the other logits with the lowest float, so
+`generate`, speculative and compacting decoding work unchanged. The
+full-vocabulary logits live in one buffer that is filled once per batch and
+reused by every step, which only writes the shortlisted columns; every
+decoding loop copies the logits or takes their argmax before the next step.
+Every `audit_interval`-th step also computes the full projection; when the
+full argmax falls outside the shortlist, that step uses the full logits, and a
+language whose miss rate exceeds `max_miss_rate` falls back to the full
+vocabulary for good. Only live decoder positions are audited: rows that have
+finished (fed EOS or padding) and steps whose token is forced anyway (the
+language code after the decoder start token, EOS at `max_length`) do not
+count, and the miss rate is per audited position, not per step.
+"""
+import collections
+import contextlib
+import json
+
+import numpy as np
+import torch
+
+METADATA_KEY = "__metadata__"
+DEFAULT_COVERAGE = 0.999
+DEFAULT_MIN_COVERAGE = 0.995
+
+
+def _token_counts(tokenizer, sentences):
+    counts = collections.Counter()
+    for start in range(0, len(sentences), 1024):
+        for ids in tokenizer(sentences[start:start + 1024], add_special_tokens=False)["input_ids"]:
+            counts.update(ids)
+    return counts
+
+
+def build_shortlists(texts, output_path, tokenizer=None, coverage=DEFAULT_COVERAGE,
+                     min_coverage=DEFAULT_MIN_COVERAGE, holdout=0.1):
+    """
+    Build per-target-language shortlists from reference text and save them.
+
+    Args:
+        texts: Dict mapping a target language code to a text file in that
+            language, one sentence per line.
+        output_path: .npz file receiving one int32 id array per language.
+        tokenizer: NLLB tokenizer (default: the serving tokenizer).
+        coverage: Keep the most frequent tokens until they cover this share
+            of the reference tokens.
+        min_coverage: Smallest share of held-out tokens the shortlist must
+            cover; languages below it are left out (full vocabulary).
+        holdout: Share of each file's sentences held out for that check.
+
+    Returns:
+        Dict with the shortlist size and held-out coverage of every language,
+        and whether it passed.
+    """
+    if tokenizer is None:
+        from transformers import AutoTokenizer
+
+        from nllb_serving.protocol import TOKENIZER_NAME
+
+        tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+    shortlists, report = {}, {}
+    for lang, path in texts.items():
+        with open(path, "r", encoding="utf-8") as file:
+            sentences = [line.strip() for line in file if line.strip()]
+        # Every n-th sentence is held out, so both parts span the whole file
+        step = max(2, round(1 / holdout)) if holdout else 0
+        held_out = sentences[::step] if step else []
+        reference = [s for i, s in enumerate(sentences) if not step or i % step]
+        counts = _token_counts(tokenizer, reference)
+
+        total, kept, covered = sum(counts.values()), [], 0
+        for token, count in counts.most_common():
+            if covered >= coverage * total:
+                break
+            kept.append(token)
+            covered += count
+        special = set(tokenizer.all_special_ids) | {tokenizer.convert_tokens_to_ids(lang)}
+        ids = np.array(sorted(set(kept) | special), dtype=np.int32)
+
+        held_out_counts = _token_counts(tokenizer, held_out)
+        held_out_total = sum(held_out_counts.values())
+        keep = set(ids.tolist())
+        held_out_coverage = (
+            sum(count for token, count in held_out_counts.items() if token in keep) / held_out_total
+            if held_out_total else 1.0
+        )
+        passed = held_out_coverage >= min_coverage
+        report[lang] = {"size": len(ids), "held_out_coverage": held_out_coverage, "passed": passed}
+        if passed:
+            shortlists[lang] = ids
+
+    metadata = {"vocab_size": len(tokenizer), "coverage": coverage, "min_coverage": min_coverage,
+                "languages": report}
+    np.savez_compressed(output_path, **shortlists, **{METADATA_KEY: np.array(json.dumps(metadata))})
+    return report
+
+
+class _ShortlistHead(torch.nn.Module):
+    """
+    LM head projecting onto the active shortlist only.
+
+    The returned full-vocabulary logits are a view of a reused buffer and are
+    only valid until the next call.
+    """
+
+    def __init__(self, lm_head, shortlist):
+        super().__init__()
+        self.full = lm_head
+        self.shortlist = shortlist
+        self.ids = None
+        self.weight = None
+        self.bias = None
+        self._buffer = None
+        self._buffer_ids = None
+
+    def _full_logits(self, rows, logits):
+        """[rows, vocab] view of the buffer, lowest float outside the active shortlist."""
+        buffer, lowest = self._buffer, torch.finfo(logits.dtype).min
+        if (buffer is None or buffer.shape[0] < rows or buffer.dtype != logits.dtype
+                or buffer.device != logits.device):
+            rows_needed = max(rows, buffer.shape[0] if buffer is not None else 0)
+            buffer = torch.full((rows_needed, self.full.weight.shape[0]), lowest,
+                                dtype=logits.dtype, device=logits.device)
+            self._buffer, self._buffer_ids = buffer, None
+        if self._buffer_ids is not self.ids:
+            # Columns of the previous shortlist hold stale logits
+            if self._buffer_ids is not None:
+                buffer.index_fill_(-1, self._buffer_ids, lowest)
+            self._buffer_ids = self.ids
+        return buffer[:rows]
+
+    def forward(self, hidden):
+        logits = torch.nn.functional.linear(hidden, self.weight, self.bias)
+        rows = logits.shape[:-1].numel()
+        full_logits = self._full_logits(rows, logits)
+        full_logits.index_copy_(-1, self.ids, logits.reshape(rows, -1))
+        full_logits = full_logits.view(hidden.shape[:-1] + (full_logits.shape[-1],))
+        if self.shortlist.audit_due():
+            reference = self.full(hidden)
+            predicted = reference.argmax(dim=-1)
+            live = self.shortlist.live_positions(predicted)
+            missed = (full_logits.argmax(dim=-1) != predicted) & live
+            missed = int(missed.sum())
+            self.shortlist.record_audit(int(live.sum()), missed)
+            if missed:
+                return reference
+        return full_logits
+
+
+class VocabularyShortlist:
+    """
+    Per-target-language LM head shortlists with audited fallback.
+
+    Args:
+        model: Seq2seq model whose `lm_head` is restricted.
+        path: .npz file written by build_shortlists.
+        special_ids: Token ids always kept (e.g. EOS, pad, decoder start),
+            in addition to those stored in the file.
+        audit_interval: Compute the full projection every this many steps
+            to check the shortlist (0 disables audits).
+        max_miss_rate: Share of audited decoder positions a language may
+            miss before it falls back to the full vocabulary.
+        min_audits: Audited positions needed before a language can fall back.
+        cache_size: Gathered weight matrices kept for reuse, one per
+            language (set).
+        metrics: Optional MetricsRegistry for step, audit and miss counters.
+        log: Callable(message) reporting a language that falls back.
+    """
+
+    def __init__(self, model, path, special_ids=(), audit_interval=64, max_miss_rate=0.01, min_audits=20,
+                 cache_size=4, metrics=None, log=print):
+        self.model = model
+        with np.load(path) as data:
+            self.metadata = json.loads(str(data[METADATA_KEY]))
+            self.shortlists = {lang: data[lang] for lang in data.files if lang != METADATA_KEY}
+        self.special_ids = set(special_ids) | {
+            model.config.eos_token_id, model.config.pad_token_id, model.config.decoder_start_token_id
+        }
+        self.audit_interval = audit_interval
+        self.max_miss_rate = max_miss_rate
+        self.min_audits = min_audits
+        self.cache_size = cache_size
+        self.log = log
+        self.disabled = set()
+        self._audits = collections.Counter()
+        self._misses = collections.Counter()
+        self._weights = collections.OrderedDict()
+        self._active = ()
+        self._max_length = None
+        self._decoder_inputs = None
+        self._steps = 0
+        self._head = _ShortlistHead(model.lm_head, self)
+        if metrics is not None:
+            self._step_counter = metrics.counter(
+                "nllb_shortlist_steps_total", "LM head projections restricted to a shortlist"
+            )
+            self._audit_counter = metrics.counter(
+                "nllb_shortlist_audits_total", "Live decoder positions checked against the full vocabulary"
+            )
+            self._miss_counter = metrics.counter(
+                "nllb_shortlist_misses_total", "Audited positions whose full-vocabulary argmax was not shortlisted"
+            )
+        else:
+            self._step_counter = self._audit_counter = self._miss_counter = None
+
+    def available(self, target_langs):
+        """True if every target language has a shortlist that has not fallen back."""
+        return all(lang in self.shortlists and lang not in self.disabled for lang in target_langs)
+
+    def _gathered(self, target_langs):
+        key = tuple(sorted(set(target_langs)))
+        if key in self._weights:
+            self._weights.move_to_end(key)
+            return self._weights[key]
+        lm_head = self._head.full
+        ids = set(self.special_ids)
+        for lang in key:
+            ids.update(self.shortlists[lang].tolist())
+        ids = torch.tensor(sorted(ids), device=lm_head.weight.device)
+        bias = lm_head.bias.index_select(0, ids) if lm_head.bias is not None else None
+        self._weights[key] = entry = (ids, lm_head.weight.index_select(0, ids), bias)
+        while len(self._weights) > self.cache_size:
+            self._weights.popitem(last=False)
+        return entry
+
+    @contextlib.contextmanager
+    def restrict(self, target_langs, max_length=None):
+        """
+        Project onto the shortlists of `target_langs` inside the block.
+
+        Without a usable shortlist for every language the full head is kept.
+        Yields whether the head was restricted.
+
+        Args:
+            target_langs: Target language code, or several.
+            max_length: max_length the block generates with (default: the
+                model's generation_config), to skip the forced EOS step.
+        """
+        if isinstance(target_langs, str):
+            target_langs = (target_langs,)
+        if not self.available(target_langs):
+            yield False
+            return
+        self._head.ids, self._head.weight, self._head.bias = self._gathered(target_langs)
+        self._active = tuple(target_langs)
+        self._max_length = max_length or self.model.generation_config.max_length
+        # The decoder's input tokens tell the audit which rows are still live
+        hook = self.model.get_decoder().register_forward_pre_hook(self._record_decoder_inputs, with_kwargs=True)
+        lm_head, self.model.lm_head = self.model.lm_head, self._head
+        try:
+            yield True
+        finally:
+            self.model.lm_head = lm_head
+            hook.remove()
+            self._active = ()
+            self._decoder_inputs = None
+
+    def _record_decoder_inputs(self, module, args, kwargs):
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        past = kwargs.get("past_key_values")
+        if past is None:
+            cached = 0
+        elif hasattr(past, "get_seq_length"):
+            cached = past.get_seq_length()
+        else:
+            # Legacy tuples: [batch, heads, seq, dim] per layer
+            cached = past[0][0].shape[2]
+        self._decoder_inputs = (input_ids, cached)
+
+    def live_positions(self, predicted):
+        """
+        Mask of the decoder positions whose next token is really chosen by the LM head.
+
+        A position is live unless its input token is EOS or padding (the row
+        has finished, or it is the decoder start token), or the next token is
+        forced: the language code at position 0 and, when the model forces
+        EOS, the last token before `max_length`. When several tokens are fed
+        at once (speculative verification), positions after a token the full
+        head would not have chosen are off the greedy path and not live.
+
+        Args:
+            predicted: Full-vocabulary argmax at every position, [batch, seq].
+        """
+        config = self.model.generation_config
+        input_ids, cached = self._decoder_inputs or (None, 0)
+        if input_ids is None or input_ids.shape != predicted.shape:
+            return torch.ones_like(predicted, dtype=torch.bool)
+        input_ids = input_ids.to(predicted.device)
+        positions = torch.arange(cached, cached + predicted.shape[-1], device=predicted.device)
+        live = (input_ids != self.model.config.eos_token_id) & (input_ids != self.model.config.pad_token_id)
+        live &= positions > 0
+        if getattr(config, "forced_eos_token_id", None) is not None and self._max_length:
+            live &= positions != self._max_length - 2
+        if predicted.shape[-1] > 1:
+            # The decoder prefix (start token, language code) is given, later tokens must be greedy's
+            agrees = (input_ids[..., 1:] == predicted[..., :-1]) | (positions[1:] < 2)
+            on_path = torch.cat([torch.ones_like(agrees[..., :1]), agrees.int().cumprod(dim=-1).bool()], dim=-1)
+            live &= on_path
+        return live
+
+    def audit_due(self):
+        self._steps += 1
+        if self._step_counter is not None:
+            self._step_counter.inc()
+        return bool(self.audit_interval) and self._steps % self.audit_interval == 0
+
+    def record_audit(self, audited, missed):
+        """Count `audited` live positions of an audited step, `missed` of them outside the shortlist."""
+        if not audited:
+            return
+        if self._audit_counter is not None:
+            self._audit_counter.inc(audited)
+            if missed:
+                self._miss_counter.inc(missed)
+        for lang in self._active:
+            self._audits[lang] += audited
+            self._misses[lang] += missed
+            if (lang not in self.disabled and self._audits[lang] >= self.min_audits
+                    and self._misses[lang] > self.max_miss_rate * self._audits[lang]):
+                self.disabled.add(lang)
+                self.log(f"Vocabulary shortlist for {lang} disabled: {self._misses[lang]} of "
+                         f"{self._audits[lang]} audited positions missed the full-vocabulary argmax")
@@ -0,0 +1,172 @@
+"""
+Speculative (draft-and-verify) greedy decoding for seq2seq models.
+
+A small draft model that shares the target model's vocabulary proposes
+`draft_length` tokens one at a time; the target model then scores all of them
+in a single decoder forward pass. The longest prefix the target agrees with is
+kept, followed by the target's own next token, so every pass emits at least
+one token and the result is exactly the target model's greedy output.
+Rows of a batch advance in lockstep by the smallest accepted prefix, which
+keeps the KV caches rectangular without changing any row's output.
+"""
+import torch
+
+
+def _crop_cache(past, length):
+    """Drop decoder self-attention cache entries beyond `length` tokens."""
+    if hasattr(past, "crop"):
+        # Negative values remove tokens in every transformers version with Cache.crop
+        excess = past.get_seq_length() - length
+        if excess > 0:
+            past.crop(-excess)
+        return past
+    # Legacy tuples: (self_k, self_v, cross_k, cross_v) per layer, [batch, heads, seq, dim]
+    return tuple((layer[0][:, :, :length], layer[1][:, :, :length]) + tuple(layer[2:]) for layer in past)
+
+
+class _Decoder:
+    """One model's encoder output and decoder KV cache for a batch."""
+
+    def __init__(self, model, input_ids, attention_mask):
+        self.model = model
+        self.attention_mask = attention_mask
+        with torch.no_grad():
+            self.encoder_outputs = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask)
+        self.past = None
+        self.cached = 0
+
+    def step(self, tokens):
+        """Feed `tokens` after the cached prefix and return their next-token logits."""
+        with torch.no_grad():
+            out = self.model(
+                encoder_outputs=self.encoder_outputs,
+                attention_mask=self.attention_mask,
+                decoder_input_ids=tokens,
+                past_key_values=self.past,
+                use_cache=True,
+            )
+        self.past = out.past_key_values
+        self.cached += tokens.shape[1]
+        return out.logits
+
+    def rewind(self, length):
+        if self.cached > length:
+            self.past = _crop_cache(self.past, length)
+            self.cached = length
+
+
+class SpeculativeDecoder:
+    """
+    Greedy decoding of `model`, sped up with proposals from `draft_model`.
+
+    Args:
+        model: Target seq2seq model, e.g. NLLB-200 600M.
+        draft_model: Smaller seq2seq model with the same vocabulary and
+            special tokens (e.g. a layer-pruned distillation of the target).
+        draft_length: Tokens proposed by the draft model per verification pass.
+        metrics: Optional MetricsRegistry for acceptance counters.
+    """
+
+    def __init__(self, model, draft_model, draft_length=4, metrics=None):
+        if draft_length < 1:
+            raise ValueError("draft_length must be at least 1")
+        self.model = model
+        self.draft_model = draft_model
+        self.draft_length = draft_length
+        self.eos_token_id = model.config.eos_token_id
+        self.pad_token_id = model.config.pad_token_id
+        if metrics is not None:
+            self._proposed = metrics.counter(
+                "nllb_speculative_draft_tokens_total", "Tokens proposed by the draft model"
+            )
+            self._accepted = metrics.counter(
+                "nllb_speculative_accepted_tokens_total", "Draft tokens accepted by the target model"
+            )
+            self._passes = metrics.counter(
+                "nllb_speculative_verify_passes_total", "Target model decoder passes"
+            )
+        else:
+            self._proposed = self._accepted = self._passes = None
+
+    def generate(self, input_ids, attention_mask, forced_bos_token_id=None, decoder_input_ids=None,
+                 max_length=None):
+        """
+        Decode greedily; the output matches `model.generate` with greedy search.
+
+        Args:
+            input_ids: Encoder input ids, [batch, seq].
+            attention_mask: Encoder attention mask, [batch, seq].
+            forced_bos_token_id: Token forced after the decoder start token
+                (the NLLB target language code).
+            decoder_input_ids: Explicit decoder prefix, [batch, prefix]; overrides
+                forced_bos_token_id.
+            max_length: Maximum output length including the prefix (default:
+                the target model's generation_config.max_length).
+
+        Returns:
+            (output_ids, stats): output ids padded with pad_token_id after EOS,
+            and a dict with "proposed", "accepted" and "passes" counts; "accepted"
+            sums, over rows, the proposals the target agreed with, even where
+            the lockstep batch committed fewer.
+        """
+        batch = input_ids.shape[0]
+        max_length = max_length or self.model.generation_config.max_length
+        if decoder_input_ids is None:
+            prefix = [self.model.config.decoder_start_token_id]
+            if forced_bos_token_id is not None:
+                prefix.append(forced_bos_token_id)
+            decoder_input_ids = torch.tensor([prefix] * batch, device=input_ids.device)
+        sequences = decoder_input_ids
+        finished = torch.zeros(batch, dtype=torch.bool, device=input_ids.device)
+        target = _Decoder(self.model, input_ids, attention_mask)
+        draft = _Decoder(self.draft_model, input_ids, attention_mask)
+        stats = {"proposed": 0, "accepted": 0, "passes": 0}
+
+        while sequences.shape[1] < max_length and not finished.all():
+            length = sequences.shape[1]
+            # Leave room for the target's own token after the accepted proposals
+            k = min(self.draft_length, max_length - length - 1)
+
+            # Draft: k greedy tokens, one decoder step each
+            proposals = sequences[:, :0]
+            for _ in range(k):
+                tokens = torch.cat([sequences, proposals], dim=1)[:, draft.cached:]
+                proposals = torch.cat([proposals, draft.step(tokens)[:, -1].argmax(-1, keepdim=True)], dim=1)
+
+            # Verify: one target pass scores the last token and every proposal
+            logits = target.step(torch.cat([sequences[:, target.cached:], proposals], dim=1))
+            greedy = logits[:, -(k + 1):].argmax(-1)
+            matches = (proposals == greedy[:, :k]).int().cumprod(dim=1).sum(dim=1)
+            active = ~finished
+            accepted = int(matches[active].min()) if k else 0
+
+            new_tokens = torch.cat([proposals[:, :accepted], greedy[:, accepted:accepted + 1]], dim=1)
+            # Rows finish at their first EOS; everything after it is padding
+            is_eos = (new_tokens == self.eos_token_id).int()
+            after_eos = (is_eos.cumsum(dim=1) - is_eos) > 0
+            new_tokens = new_tokens.masked_fill(after_eos | finished[:, None], self.pad_token_id)
+            finished |= is_eos.bool().any(dim=1)
+            sequences = torch.cat([sequences, new_tokens], dim=1)
+
+            # Only the committed tokens stay cached; the last one is fed next pass
+            target.rewind(sequences.shape[1] - 1)
+            draft.rewind(sequences.shape[1] - 1)
+
+            # Acceptance counts what each row's draft got right, not the batch's minimum
+            stats["proposed"] += k * int(active.sum())
+            stats["accepted"] += int(matches[active].sum())
+            stats["passes"] += 1
+
+        # generate() stops as soon as every row is done; drop columns a block added after that
+        generated = sequences[:, decoder_input_ids.shape[1]:] == self.eos_token_id
+        ends = torch.where(
+            generated.any(dim=1), generated.int().argmax(dim=1) + decoder_input_ids.shape[1] + 1,
+            sequences.shape[1],
+        )
+        sequences = sequences[:, :int(ends.max())]
+
+        if self._proposed is not None:
+            self._proposed.inc(stats["proposed"])
+            self._accepted.inc(stats["accepted"])
+            self._passes.inc(stats["passes"])
+        return sequences, stats
@@ -0,0 +1,73 @@
+"""
+Per-stage request timing.
+
+A request's time on the server is split into STAGES. Code on the model thread
+wraps each stage in `stage(name)`; the durations are added to the dict of the
+enclosing `collect_stages()` on the same thread, so the model code needs no
+extra arguments and records nothing when no one is collecting.
+
+Stages nest, and a stage's time excludes the stages nested in it. That is how
+`encode` is carved out of `decode`: generation runs inside `stage("decode")`
+and `time_module` times every encoder forward pass, wherever generate() or a
+custom decoder calls it from.
+"""
+import contextlib
+import threading
+import time
+
+# Order of the STAGE_TIMES_MS output columns (KServe and Triton)
+STAGES = ("queue_wait", "batch_formation", "tokenize", "encode", "decode", "detokenize", "serialize")
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def collect_stages():
+    """Collect the stages recorded on this thread; yields a stage -> seconds dict."""
+    stages = {}
+    saved = getattr(_local, "state", None)
+    _local.state = (stages, [])
+    try:
+        yield stages
+    finally:
+        _local.state = saved
+
+
+def _enter(name):
+    state = getattr(_local, "state", None)
+    if state is not None:
+        # [name, start, time spent in nested stages]
+        state[1].append([name, time.perf_counter(), 0.0])
+
+
+def _exit():
+    state = getattr(_local, "state", None)
+    if state is None or not state[1]:
+        return
+    stages, stack = state
+    name, start, nested = stack.pop()
+    elapsed = time.perf_counter() - start
+    stages[name] = stages.get(name, 0.0) + elapsed - nested
+    if stack:
+        stack[-1][2] += elapsed
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the enclosed block as stage `name`."""
+    _enter(name)
+    try:
+        yield
+    finally:
+        _exit()
+
+
+def time_module(module, name):
+    """Time every forward pass of a torch module as stage `name`."""
+    module.register_forward_pre_hook(lambda *_: _enter(name))
+    module.register_forward_hook(lambda *_: _exit())
+
+
+def to_milliseconds(stages):
+    """Stage durations in milliseconds, in STAGES order, for responses."""
+    return {name: round(stages[name] * 1000, 3) for name in STAGES if name in stages}
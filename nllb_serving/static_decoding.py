@@ -0,0 +1,198 @@
+"""
+Greedy decoding with preallocated KV caches and a compiled decoder step.
+
+`model.generate` grows its KV cache by concatenation on every token and runs
+the decoder eagerly, so on CPU much of each step is allocation and Python
+overhead. StaticDecoder instead
+
+* pads the batch, the source length and the output length up to fixed
+  buckets, so each bucket combination has one set of tensor shapes;
+* preallocates the self-attention KV cache for the output-length bucket and
+  computes the cross-attention keys/values once per batch;
+* runs one decoder step (embedding, all layers, LM head) as a single function
+  that writes the new key/value at the current position in place, compiled
+  with `torch.compile` once per bucket combination.
+
+Inductor's on-disk caches make the compiled steps survive restarts when
+`cache_dir` is set. The decoder layers are driven through the M2M100/NLLB
+module attributes, and the output matches greedy `model.generate`.
+"""
+import os
+
+import torch
+
+DEFAULT_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+DEFAULT_LENGTH_BUCKETS = (16, 32, 64, 128, 256)
+
+
+def bucket(value, buckets):
+    """Smallest bucket that fits `value` (the value itself if none does)."""
+    for size in buckets:
+        if size >= value:
+            return size
+    return value
+
+
+def enable_compile_cache(cache_dir):
+    """
+    Persist Inductor's compiled kernels and FX graphs under `cache_dir`.
+
+    Must run before the first compilation in the process.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # Inductor resolves the directory from the environment on every lookup
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.abspath(cache_dir)
+    os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
+    os.environ["TORCHINDUCTOR_AUTOGRAD_CACHE"] = "1"
+    import torch._inductor.config
+
+    torch._inductor.config.fx_graph_cache = True
+
+
+def _attention(query, key, value, bias):
+    # query [B, H, 1, D]; key/value [B, H, T, D]; bias broadcastable to [B, H, 1, T]
+    scores = torch.matmul(query, key.transpose(-1, -2)) + bias
+    return torch.matmul(scores.softmax(dim=-1), value)
+
+
+class StaticDecoder:
+    """
+    Greedy decoding of an M2M100/NLLB model with static shapes.
+
+    Args:
+        model: M2M100ForConditionalGeneration (e.g. NLLB-200), in eval mode.
+        compile: Compile the decoder step with `torch.compile`.
+        cache_dir: Directory for Inductor's compilation caches, reused across
+            restarts (see enable_compile_cache).
+        batch_buckets: Batch sizes batches are padded up to.
+        length_buckets: Source and output lengths are padded up to these.
+    """
+
+    def __init__(self, model, compile=True, cache_dir=None, batch_buckets=DEFAULT_BATCH_BUCKETS,
+                 length_buckets=DEFAULT_LENGTH_BUCKETS):
+        if cache_dir:
+            enable_compile_cache(cache_dir)
+        self.model = model
+        self.batch_buckets = batch_buckets
+        self.length_buckets = length_buckets
+        self.decoder = model.get_decoder()
+        self.layers = list(self.decoder.layers)
+        self.num_heads = model.config.decoder_attention_heads
+        self.head_dim = model.config.d_model // self.num_heads
+        self.scaling = self.head_dim ** -0.5
+        # Newer transformers scale inside the embedding module, older ones in the decoder
+        self.embed_scale = 1.0 if hasattr(self.decoder.embed_tokens, "embed_scale") else self.decoder.embed_scale
+        self.padding_idx = self.decoder.embed_positions.padding_idx
+        self.pad_token_id = model.config.pad_token_id
+        self.eos_token_id = model.config.eos_token_id
+        self._step_fn = torch.compile(self._step, dynamic=False, fullgraph=True) if compile else self._step
+
+    def _heads(self, states):
+        batch, length, _ = states.shape
+        return states.view(batch, length, self.num_heads, self.head_dim).transpose(1, 2)
+
+    def _step(self, tokens, position, self_keys, self_values, cross_keys, cross_values, self_bias, cross_bias):
+        """
+        One decoder step for the whole batch.
+
+        Writes this step's self-attention key/value at `position` into the
+        preallocated caches and returns next-token logits [B, vocab].
+        """
+        positions = torch.where(tokens == self.padding_idx, self.padding_idx, position + self.padding_idx + 1)
+        hidden = self.decoder.embed_tokens(tokens[:, None]) * self.embed_scale
+        hidden = hidden + self.decoder.embed_positions.weights.index_select(0, positions)[:, None]
+        for i, layer in enumerate(self.layers):
+            residual = hidden
+            hidden = layer.self_attn_layer_norm(hidden)
+            attention = layer.self_attn
+            query = self._heads(attention.q_proj(hidden) * self.scaling)
+            self_keys[i].index_copy_(2, position.view(1), self._heads(attention.k_proj(hidden)))
+            self_values[i].index_copy_(2, position.view(1), self._heads(attention.v_proj(hidden)))
+            context = _attention(query, self_keys[i], self_values[i], self_bias)
+            hidden = residual + attention.out_proj(context.transpose(1, 2).reshape(hidden.shape))
+
+            residual = hidden
+            hidden = layer.encoder_attn_layer_norm(hidden)
+            attention = layer.encoder_attn
+            query = self._heads(attention.q_proj(hidden) * self.scaling)
+            context = _attention(query, cross_keys[i], cross_values[i], cross_bias)
+            hidden = residual + attention.out_proj(context.transpose(1, 2).reshape(hidden.shape))
+
+            residual = hidden
+            hidden = layer.final_layer_norm(hidden)
+            hidden = residual + layer.fc2(layer.activation_fn(layer.fc1(hidden)))
+        hidden = self.decoder.layer_norm(hidden)
+        return self.model.lm_head(hidden)[:, 0]
+
+    def _pad_inputs(self, input_ids, attention_mask):
+        batch, length = input_ids.shape
+        padded_batch = bucket(batch, self.batch_buckets)
+        padded_length = bucket(length, self.length_buckets)
+        ids = input_ids.new_full((padded_batch, padded_length), self.pad_token_id)
+        mask = attention_mask.new_zeros((padded_batch, padded_length))
+        ids[:batch, :length] = input_ids
+        mask[:batch, :length] = attention_mask
+        # Filler rows repeat the first row, so no row is fully masked
+        ids[batch:, :length] = input_ids[:1]
+        mask[batch:, :length] = attention_mask[:1]
+        return ids, mask
+
+    def generate(self, input_ids, attention_mask, forced_bos_token_id=None, max_length=None):
+        """
+        Decode greedily; the output matches greedy `model.generate`.
+
+        Args:
+            input_ids: Encoder input ids, [batch, seq].
+            attention_mask: Encoder attention mask, [batch, seq].
+            forced_bos_token_id: Token forced after the decoder start token.
+            max_length: Maximum output length (default: the model's
+                generation_config.max_length).
+
+        Returns:
+            Output ids [batch, length], padded with pad_token_id after EOS.
+        """
+        batch = input_ids.shape[0]
+        max_length = max_length or self.model.generation_config.max_length
+        cache_length = bucket(max_length, self.length_buckets)
+        if self.decoder.embed_positions.weights.shape[0] < max_length + self.padding_idx + 1:
+            raise ValueError(f"max_length {max_length} exceeds the model's positional embeddings")
+        ids, mask = self._pad_inputs(input_ids, attention_mask)
+        padded_batch = ids.shape[0]
+        dtype = self.model.dtype
+        device = ids.device
+
+        with torch.no_grad():
+            encoder_states = self.model.get_encoder()(input_ids=ids, attention_mask=mask).last_hidden_state
+            cross_keys = [self._heads(layer.encoder_attn.k_proj(encoder_states)) for layer in self.layers]
+            cross_values = [self._heads(layer.encoder_attn.v_proj(encoder_states)) for layer in self.layers]
+            cross_bias = ((1 - mask[:, None, None, :].to(dtype)) * torch.finfo(dtype).min)
+            shape = (padded_batch, self.num_heads, cache_length, self.head_dim)
+            self_keys = [torch.zeros(shape, dtype=dtype, device=device) for _ in self.layers]
+            self_values = [torch.zeros(shape, dtype=dtype, device=device) for _ in self.layers]
+            steps = torch.arange(cache_length, device=device)
+
+            prefix = [self.model.config.decoder_start_token_id]
+            if forced_bos_token_id is not None:
+                prefix.append(forced_bos_token_id)
+            # Output buffer in time-major layout, so each step's tokens are contiguous
+            sequences = torch.full((max_length, padded_batch), self.pad_token_id, device=device)
+            sequences[:len(prefix)] = torch.tensor(prefix, device=device)[:, None]
+            length = len(prefix)
+            finished = torch.zeros(padded_batch, dtype=torch.bool, device=device)
+            finished[batch:] = True
+            for position in range(max_length - 1):
+                # Keys beyond the current position are masked out
+                self_bias = torch.where(steps <= position, 0.0, torch.finfo(dtype).min).to(dtype)
+                logits = self._step_fn(
+                    sequences[position], torch.tensor(position, device=device), self_keys, self_values,
+                    cross_keys, cross_values, self_bias, cross_bias,
+                )
+                if position + 1 < length:
+                    continue  # the next token is part of the forced prefix
+                tokens = logits.argmax(dim=-1).masked_fill(finished, self.pad_token_id)
+                sequences[length] = tokens
+                length += 1
+                finished |= tokens == self.eos_token_id
+                if finished.all():
+                    break
+        return sequences[:length, :batch].T.contiguous()
@@ -0,0 +1,289 @@
+"""
+Recording production traffic and replaying it with its original timing.
+
+A trace is JSON lines (gzip-compressed when the path ends in .gz): a header,
+then one compact record per request,
+
+    {"format": "nllb-traffic", "version": 1, "started_unix": ..., "source": "standard"}
+    {"t": 0.0132, "src": "eng_Latn", "tgt": "asm_Beng", "lengths": [14, 9]}
+
+with the arrival time in seconds since the recording started, the token
+length of every sentence and the language pair (a list of targets for
+multi-target requests). Text is never written; with `hash_content` each
+sentence adds a short SHA-256 prefix, so repeats stay visible.
+
+The standard server records the requests it receives (`--record-traffic`).
+For Triton, `record_infer_calls` hooks the ModelInfer call of a tritonclient
+gRPC client and reads the same fields from the outgoing request;
+`record_request` does the same for requests written to an inference stream.
+
+`replay` sends a trace to either backend with the original inter-arrival
+times, optionally scaled, using sentences from a text file picked to match
+the recorded token lengths.
+"""
+import asyncio
+import bisect
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+import numpy as np
+
+from nllb_serving.metrics import percentile
+
+TRACE_FORMAT = "nllb-traffic"
+TRACE_VERSION = 1
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def content_hash(content):
+    """Short SHA-256 prefix of a sentence (str) or token row (array)."""
+    data = content.encode("utf-8") if isinstance(content, str) else np.asarray(content, dtype=np.int32).tobytes()
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class TrafficRecorder:
+    """
+    Append-only, thread-safe request trace.
+
+    Args:
+        path: Trace file; gzip-compressed if it ends in .gz.
+        hash_content: Add a content hash per sentence to each record.
+        source: Name of what is recorded, stored in the header.
+    """
+
+    def __init__(self, path, hash_content=False, source=""):
+        self.path = path
+        self.hash_content = hash_content
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._file = _open(path, "w")
+        self._write({"format": TRACE_FORMAT, "version": TRACE_VERSION, "started_unix": time.time(),
+                     "source": source, "hash_content": hash_content})
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def record(self, source_lang, target_lang, lengths, contents=None, arrival=None):
+        """
+        Record one request.
+
+        Args:
+            source_lang: Source language code.
+            target_lang: Target language code, or a list of them.
+            lengths: Token length of every sentence.
+            contents: The sentences (text or token rows), only used for
+                hashes when hash_content is set.
+            arrival: time.monotonic() of the arrival (default: now).
+        """
+        arrival = time.monotonic() if arrival is None else arrival
+        entry = {
+            "t": round(arrival - self._started, 6),
+            "src": source_lang,
+            "tgt": list(target_lang) if isinstance(target_lang, (list, tuple)) else target_lang,
+            "lengths": [int(length) for length in lengths],
+        }
+        if self.hash_content and contents is not None:
+            entry["hashes"] = [content_hash(content) for content in contents]
+        with self._lock:
+            if not self._file.closed:
+                self._write(entry)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path):
+    """
+    Load a trace.
+
+    Returns:
+        (header, records), records sorted by arrival time.
+
+    Raises:
+        ValueError: The file is not a traffic trace of a supported version.
+    """
+    with _open(path, "r") as file:
+        header = json.loads(file.readline() or "{}")
+        if header.get("format") != TRACE_FORMAT or header.get("version") != TRACE_VERSION:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} traffic trace")
+        records = []
+        try:
+            for line in file:
+                records.append(json.loads(line))
+        except (EOFError, json.JSONDecodeError):
+            pass  # a recorder that was killed leaves a truncated last line or gzip stream
+    records.sort(key=lambda record: record["t"])
+    return header, records
+
+
+def _request_fields(request, tokenizer):
+    # Language pair, token lengths and rows of a ModelInferRequest for Modelrepo/nllb
+    parameters = request.parameters
+    if "target_langs" in parameters:
+        target_lang = json.loads(parameters["target_langs"].string_param)
+    else:
+        target_lang = parameters["target_lang"].string_param if "target_lang" in parameters else None
+    tensors = {}
+    for tensor, raw in zip(request.inputs, request.raw_input_contents):
+        tensors[tensor.name] = np.frombuffer(raw, dtype=np.int32).reshape(tuple(tensor.shape))
+    input_ids, attention_mask = tensors["INPUT_IDS"], tensors["ATTENTION_MASK"]
+    rows = [ids[mask.astype(bool)] for ids, mask in zip(input_ids, attention_mask)]
+    # NLLB inputs start with the source language code
+    source_lang = tokenizer.convert_ids_to_tokens(int(rows[0][0])) if rows and len(rows[0]) else None
+    return source_lang, target_lang, rows
+
+
+def record_request(recorder, request, tokenizer):
+    """
+    Record one outgoing ModelInferRequest for Modelrepo/nllb.
+
+    Args:
+        recorder: TrafficRecorder.
+        request: tritonclient.grpc.service_pb2.ModelInferRequest.
+        tokenizer: NLLB tokenizer, to name the source language code.
+    """
+    try:
+        source_lang, target_lang, rows = _request_fields(request, tokenizer)
+        recorder.record(source_lang, target_lang, [len(row) for row in rows], rows)
+    except (KeyError, ValueError) as e:
+        print(f"Traffic recording skipped a request: {e!r}")
+
+
+def record_infer_calls(client, recorder, tokenizer):
+    """
+    Record every inference request a tritonclient gRPC client sends.
+
+    tritonclient creates its gRPC channel internally and takes no
+    interceptors, so the ModelInfer call of the client's stub is wrapped
+    instead; this works for both the sync and the asyncio client.
+
+    Args:
+        client: tritonclient.grpc or tritonclient.grpc.aio InferenceServerClient.
+        recorder: TrafficRecorder.
+        tokenizer: NLLB tokenizer, to name the source language code.
+
+    Returns:
+        The client.
+    """
+    stub = client._client_stub
+    call = stub.ModelInfer
+
+    def record(request):
+        record_request(recorder, request, tokenizer)
+
+    def model_infer(request, *args, **kwargs):
+        record(request)
+        return call(request, *args, **kwargs)
+
+    if hasattr(call, "future"):
+        # The sync client's async_infer goes through ModelInfer.future
+        def future(request, *args, **kwargs):
+            record(request)
+            return call.future(request, *args, **kwargs)
+
+        model_infer.future = future
+    stub.ModelInfer = model_infer
+    return client
+
+
+class SentencePool:
+    """
+    Sentences indexed by token length, to stand in for recorded requests.
+
+    Args:
+        sentences: Replacement sentences.
+        count_tokens: Callable(text) -> token count, as the servers count.
+    """
+
+    def __init__(self, sentences, count_tokens):
+        if not sentences:
+            raise ValueError("The sentence pool is empty")
+        pairs = sorted((count_tokens(sentence), sentence) for sentence in sentences)
+        self.lengths = [length for length, _ in pairs]
+        self.sentences = [sentence for _, sentence in pairs]
+        self._next = 0
+
+    def pick(self, length):
+        """A sentence of about `length` tokens; longer ones are joined from several."""
+        if length > self.lengths[-1]:
+            parts, total = [], 0
+            while total < length:
+                j = -1 - len(parts) % len(self.sentences)
+                parts.append(self.sentences[j])
+                total += self.lengths[j]
+            return " ".join(parts)
+        index = bisect.bisect_left(self.lengths, length)
+        if index and length - self.lengths[index - 1] < self.lengths[index] - length:
+            index -= 1
+        # Rotate among equally long sentences, so repeats are not all cache hits
+        low = bisect.bisect_left(self.lengths, self.lengths[index])
+        high = bisect.bisect_right(self.lengths, self.lengths[index])
+        self._next += 1
+        return self.sentences[low + self._next % (high - low)]
+
+
+async def replay(records, backend, pool, speed=1.0):
+    """
+    Send recorded requests at their recorded times (divided by `speed`).
+
+    Times count from the first record, not from the start of the recording,
+    so replay begins at once. Every request is sent on schedule whether or not earlier ones have been
+    answered, as the original clients did.
+
+    Args:
+        records: Trace records (see read_trace).
+        backend: Client backend with atranslate_chunk (standard or Triton).
+        pool: SentencePool supplying the sentences.
+        speed: Time scale; 2.0 replays twice as fast.
+
+    Returns:
+        Dict with request, sentence and error counts, the replay duration,
+        latency percentiles and the largest send lag behind schedule.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    # Recorded times count from the recorder's creation (server start)
+    origin = records[0]["t"] if records else 0.0
+
+    async def send(record, scheduled):
+        texts = [pool.pick(length) for length in record["lengths"]]
+        sent = loop.time()
+        try:
+            await backend.atranslate_chunk(texts, record["src"], record["tgt"])
+            error = None
+        except Exception as e:
+            error = repr(e)
+        return {"latency": loop.time() - sent, "lag": sent - scheduled, "sentences": len(texts), "error": error}
+
+    tasks = []
+    for record in records:
+        scheduled = start + (record["t"] - origin) / speed
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(record, scheduled)))
+    results = await asyncio.gather(*tasks)
+
+    latencies = [result["latency"] for result in results if result["error"] is None]
+    errors = [result["error"] for result in results if result["error"] is not None]
+    return {
+        "requests": len(results),
+        "sentences": sum(result["sentences"] for result in results),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "seconds": loop.time() - start,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "max_lag": max((result["lag"] for result in results), default=0.0),
+    }
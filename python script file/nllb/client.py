@@ -1,4 +1,5 @@
 import asyncio
+import sys
 import time
 import tritonclient.grpc.aio
 from tritonclient.utils import np_to_triton_dtype
@@ -7,6 +8,14 @@ import numpy as np
 import psutil
 import os
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from nllb_serving.batching import batch_report, format_batch_report, pack_by_token_budget
+from nllb_serving.detokenize import Detokenizer
+
+MAX_BATCH_TOKENS = 2048  # Budget for batch size x padded token length
+MAX_BATCH_SIZE = 64
+
 async def main(filename="sentences.txt", model_name="nllb", server_address="localhost:8001"):
     start_time = time.time()
     sentence_count = 0
@@ -15,19 +24,24 @@ async def main(filename="sentences.txt", model_name="nllb", server_address="loca
 
     client = tritonclient.grpc.aio.InferenceServerClient(server_address)
     tokenizer = AutoTokenizer.from_pretrained("facebook/nllb-200-distilled-600M")
+    detokenizer = Detokenizer(tokenizer)
 
     try:
         with open(filename, "r") as file:
             sentences = [line.strip() for line in file if line.strip()]
         print(f"Read {len(sentences)} sentences from the file.")
 
-        batch_size = 8
+        # Form batches by token budget instead of a fixed number of sentences
+        lengths = [len(ids) for ids in tokenizer(sentences, truncation=True)["input_ids"]]
+        batches = pack_by_token_budget(lengths, MAX_BATCH_TOKENS, max_batch_size=MAX_BATCH_SIZE)
+        print(format_batch_report(batch_report(batches, lengths)))
         padded_sentences = []
 
-        for i in range(0, len(sentences), batch_size):
-            batch = sentences[i:i + batch_size]
+        for batch_indices in batches:
+            batch = [sentences[i] for i in batch_indices]
             inputs = tokenizer(batch, padding=True, truncation=True, return_tensors="np")
-            padded_sentences.append(inputs)
+            # Keep the source sentences, so they are printed without decoding the inputs again
+            padded_sentences.append((batch, inputs))
 
         async def translate_batch(input_ids, attention_mask):
             inputs = [
@@ -45,7 +59,7 @@ async def main(filename="sentences.txt", model_name="nllb", server_address="loca
                 print(f"Inference error: {e}")
                 return None
 
-        for batch in padded_sentences:
+        for originals, batch in padded_sentences:
             input_ids = batch["input_ids"].astype(np.int32)
             attention_mask = batch["attention_mask"].astype(np.int32)
 
@@ -58,12 +72,12 @@ async def main(filename="sentences.txt", model_name="nllb", server_address="loca
             end_translate = time.time()
             latency = (end_translate - start_translate) * 1000  # milliseconds
             total_latency += latency
-            sentences_translated = tokenizer.batch_decode(out_tokens, skip_special_tokens=True)
+            sentences_translated = detokenizer.decode(out_tokens)
 
             print(f"Batch size: {len(input_ids)}")  # Print the batch size being processed
-            for original, translated in zip(input_ids, sentences_translated):
+            for original, translated in zip(originals, sentences_translated):
                 sentence_count += 1
-                print(f"Original: {tokenizer.decode(original, skip_special_tokens=True)}")
+                print(f"Original: {original}")
                 print(f"Translated: {translated}")
                 print(f"Latency: {latency:.2f} ms")
 
@@ -5,6 +5,12 @@ import tritonclient.grpc.aio
 from tritonclient.utils import np_to_triton_dtype
 from transformers import AutoTokenizer
 import numpy as np
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+from nllb_serving.detokenize import Detokenizer
 
 async def main(filename="sent3.txt", model_name="nllb", server_address="127.0.0.1:8001"):
     """
@@ -25,6 +31,8 @@ async def main(filename="sent3.txt", model_name="nllb", server_address="127.0.0.
 
     client = tritonclient.grpc.aio.InferenceServerClient(server_address)
     tokenizer = AutoTokenizer.from_pretrained("facebook/nllb-200-distilled-600M", src_lang="en")
+    # Drops padding, EOS and language codes, which batch_decode printed
+    detokenizer = Detokenizer(tokenizer)
 
     with open(filename, "r") as file:
         for line in file:
@@ -64,7 +72,7 @@ async def main(filename="sent3.txt", model_name="nllb", server_address="127.0.0.
                 end_translate = time.time()
                 latency = (end_translate - start_translate) * 1000  # milliseconds
                 total_latency += latency
-                translated_text = tokenizer.batch_decode(out_tokens)
+                translated_text = detokenizer.decode(out_tokens)
 
                 # Print translated sentence and memory usage
                 print(f"Original: {sentence}")
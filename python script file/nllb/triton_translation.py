@@ -2,6 +2,12 @@ import tritonclient.grpc.aio
 from tritonclient.utils import np_to_triton_dtype
 from transformers import AutoTokenizer
 import numpy as np
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from nllb_serving.detokenize import Detokenizer
 
 async def main(filename="sentences.txt", model_name="nllb", server_address="localhost:8001"):
     """
@@ -26,6 +32,8 @@ async def main(filename="sentences.txt", model_name="nllb", server_address="loca
         return
 
     tokenizer = AutoTokenizer.from_pretrained("facebook/nllb-200-distilled-600M", src_lang="en")
+    # Drops padding, EOS and language codes, which batch_decode printed
+    detokenizer = Detokenizer(tokenizer)
 
     with open(filename, "r") as file:
         for line in file:
@@ -57,7 +65,7 @@ async def main(filename="sentences.txt", model_name="nllb", server_address="loca
                     end_translate = time.time()
                     latency = (end_translate - start_translate) * 1000  # milliseconds
                     total_latency += latency
-                    translated_text = tokenizer.batch_decode(out_tokens)
+                    translated_text = detokenizer.decode(out_tokens)
 
                     # Print translated sentence
                     print(f"Original: {sentence}")
@@ -0,0 +1,48 @@
+import pytest
+import torch
+from transformers import M2M100Config, M2M100ForConditionalGeneration
+
+EOS = 2
+PAD = 1
+LANG_CODE = 3
+
+
+def tiny_model(seed, layers=2):
+    """
+    Randomly initialised M2M100 with a 16-token vocabulary, laid out like NLLB
+    (pad 1, EOS 2 as the decoder start token). EOS is made likely enough to
+    end some rows early.
+    """
+    torch.manual_seed(seed)
+    config = M2M100Config(
+        vocab_size=16, d_model=16, encoder_layers=layers, decoder_layers=layers, encoder_attention_heads=2,
+        decoder_attention_heads=2, encoder_ffn_dim=32, decoder_ffn_dim=32, max_position_embeddings=64,
+        pad_token_id=PAD, eos_token_id=EOS, bos_token_id=0, decoder_start_token_id=EOS, dropout=0.0,
+        init_std=0.5,
+    )
+    model = M2M100ForConditionalGeneration(config).eval()
+    with torch.no_grad():
+        model.model.shared.weight[EOS] *= 3
+    return model
+
+
+@pytest.fixture(scope="session")
+def target():
+    return tiny_model(3)
+
+
+@pytest.fixture(scope="session")
+def batch():
+    """Six rows of mixed length (one padded), which the target finishes at different steps."""
+    torch.manual_seed(3)
+    input_ids = torch.randint(4, 16, (6, 9))
+    attention_mask = torch.ones_like(input_ids)
+    input_ids[3, 6:] = PAD
+    attention_mask[3, 6:] = 0
+    return input_ids, attention_mask
+
+
+def greedy_generate(model, batch, max_length):
+    input_ids, attention_mask = batch
+    return model.generate(input_ids, attention_mask=attention_mask, max_length=max_length, num_beams=1,
+                          do_sample=False, forced_bos_token_id=LANG_CODE)
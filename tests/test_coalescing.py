@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from nllb_serving.server.batcher import DynamicBatcher
+from nllb_serving.server.coalescing import InflightCoalescer
+
+KEY = ("eng_Latn", "asm_Beng")
+
+
+class BlockingModel:
+    """run_batch that records every sentence it runs and waits for `release` (or raises `error`)."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.ran = []
+
+    def __call__(self, key, texts):
+        self.ran.extend(texts)
+        self.started.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return [text.upper() for text in texts]
+
+
+@pytest.fixture
+def model():
+    return BlockingModel()
+
+
+def coalescer_for(model):
+    return InflightCoalescer(DynamicBatcher(model, max_batch_size=64, max_queue_delay=0.0).start())
+
+
+def test_concurrent_identical_sentences_run_once(model):
+    coalescer = coalescer_for(model)
+    try:
+        first = coalescer.submit(KEY, ["hello"])
+        assert model.started.wait(5)
+        with ThreadPoolExecutor(8) as pool:
+            waiters = list(pool.map(lambda _: coalescer.submit(KEY, ["hello"]), range(8)))
+        model.release.set()
+        assert [future.result(timeout=5) for future in [first] + waiters] == [["HELLO"]] * 9
+    finally:
+        model.release.set()
+        coalescer.batcher.stop()
+    assert model.ran == ["hello"]
+    assert coalescer._inflight == {}
+
+
+def test_only_new_sentences_of_a_request_are_queued(model):
+    coalescer = coalescer_for(model)
+    try:
+        first = coalescer.submit(KEY, ["a"])
+        assert model.started.wait(5)
+        mixed = coalescer.submit(KEY, ["b", "a", "b"])
+        model.release.set()
+        assert first.result(timeout=5) == ["A"]
+        assert mixed.result(timeout=5) == ["B", "A", "B"]
+    finally:
+        model.release.set()
+        coalescer.batcher.stop()
+    assert sorted(model.ran) == ["a", "b"]
+
+
+def test_failure_reaches_every_waiter_and_is_not_cached():
+    model = BlockingModel(error=RuntimeError("model failed"))
+    coalescer = coalescer_for(model)
+    try:
+        futures = [coalescer.submit(KEY, ["hello"])]
+        assert model.started.wait(5)
+        futures += [coalescer.submit(KEY, ["hello"]) for _ in range(3)]
+        model.release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError, match="model failed"):
+                future.result(timeout=5)
+        assert coalescer._inflight == {}
+
+        # The next request runs the sentence again instead of reusing the failure
+        model.error = None
+        assert coalescer.submit(KEY, ["hello"]).result(timeout=5) == ["HELLO"]
+    finally:
+        model.release.set()
+        coalescer.batcher.stop()
+    assert model.ran == ["hello", "hello"]
+
+
+def test_different_language_pairs_are_not_coalesced(model):
+    coalescer = coalescer_for(model)
+    model.release.set()
+    try:
+        first = coalescer.submit(KEY, ["hello"])
+        other = coalescer.submit(("eng_Latn", "hin_Deva"), ["hello"])
+        assert first.result(timeout=5) == other.result(timeout=5) == ["HELLO"]
+    finally:
+        coalescer.batcher.stop()
+    assert model.ran == ["hello", "hello"]
+
+
+def test_more_urgent_sentences_do_not_wait_on_less_urgent_ones(model):
+    coalescer = coalescer_for(model)
+    try:
+        running = coalescer.submit(KEY, ["x"])
+        assert model.started.wait(5)
+        bulk = coalescer.submit(KEY, ["hello"], priority=1)
+        interactive = coalescer.submit(KEY, ["hello"], priority=0)
+        model.release.set()
+        assert bulk.result(timeout=5) == interactive.result(timeout=5) == ["HELLO"]
+        assert running.result(timeout=5) == ["X"]
+    finally:
+        model.release.set()
+        coalescer.batcher.stop()
+    assert sorted(model.ran) == ["hello", "hello", "x"]
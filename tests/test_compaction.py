@@ -0,0 +1,30 @@
+import torch
+
+from conftest import EOS, LANG_CODE, greedy_generate
+from nllb_serving.compaction import CompactingDecoder
+
+MAX_LENGTH = 20
+
+
+def test_matches_greedy_generate_while_dropping_finished_rows(target, batch):
+    greedy = greedy_generate(target, batch, MAX_LENGTH)
+    finish_steps = {int(row[2:].eq(EOS).nonzero()[0]) if row[2:].eq(EOS).any() else None for row in greedy}
+    # Rows end at several different steps, and some run to max_length
+    assert len(finish_steps - {None}) > 1 and None in finish_steps
+
+    output_ids, stats = CompactingDecoder(target).generate(*batch, forced_bos_token_id=LANG_CODE,
+                                                           max_length=MAX_LENGTH)
+    assert torch.equal(output_ids, greedy)
+    # Finished rows are no longer decoded
+    assert stats["row_steps"] < stats["steps"] * len(greedy)
+
+
+def test_stops_once_every_row_finished(target, batch):
+    input_ids, attention_mask = batch
+    # Rows 2 and 3 emit EOS right after the language code
+    rows = [2, 3]
+    batch = input_ids[rows], attention_mask[rows]
+    output_ids, stats = CompactingDecoder(target).generate(*batch, forced_bos_token_id=LANG_CODE,
+                                                           max_length=MAX_LENGTH)
+    assert torch.equal(output_ids, greedy_generate(target, batch, MAX_LENGTH))
+    assert output_ids.shape[1] < MAX_LENGTH
@@ -0,0 +1,62 @@
+import pytest
+
+from nllb_serving.server.controller import AIMDController
+
+
+def decide(controller, latency, batch_size, delay, backlog=0):
+    for _ in range(controller.interval):
+        controller.record(latency)
+    return controller.adjust(batch_size, delay, backlog)
+
+
+def test_waits_for_a_full_window():
+    controller = AIMDController(slo=0.1, interval=4)
+    for _ in range(3):
+        controller.record(1.0)
+    assert controller.adjust(8, 0.01) == (8, 0.01)
+
+
+def test_increases_additively_below_the_headroom():
+    controller = AIMDController(slo=0.1, interval=4, batch_step=2, delay_step=0.001)
+    batch_size, delay = decide(controller, 0.05, 8, 0.01)
+    assert batch_size == 10
+    assert delay == pytest.approx(0.011)
+
+
+def test_increase_is_capped():
+    controller = AIMDController(slo=0.1, interval=4, max_batch_size=9, max_delay=0.0105)
+    assert decide(controller, 0.05, 8, 0.01) == (9, 0.0105)
+
+
+def test_holds_between_headroom_and_slo():
+    controller = AIMDController(slo=0.1, interval=4, headroom=0.8)
+    assert decide(controller, 0.09, 8, 0.01) == (8, 0.01)
+
+
+def test_decreases_multiplicatively_above_the_slo():
+    controller = AIMDController(slo=0.1, interval=4, decrease=0.5)
+    batch_size, delay = decide(controller, 0.2, 8, 0.01)
+    assert batch_size == 4
+    assert delay == pytest.approx(0.005)
+
+
+def test_decrease_respects_the_minimums():
+    controller = AIMDController(slo=0.1, interval=4, min_batch_size=3, min_delay=0.0)
+    # Delays below 0.1 ms drop straight to the minimum
+    assert decide(controller, 0.2, 4, 0.00015) == (3, 0.0)
+
+
+def test_drains_a_backlog_instead_of_shrinking_batches():
+    controller = AIMDController(slo=0.1, interval=4, batch_step=2, decrease=0.5)
+    batch_size, delay = decide(controller, 0.2, 8, 0.01, backlog=8)
+    assert batch_size == 10
+    assert delay == pytest.approx(0.005)
+
+
+def test_decision_uses_the_configured_percentile():
+    controller = AIMDController(slo=0.1, interval=20, quantile=95)
+    # Two slow requests in twenty put the 95th percentile over the SLO
+    for latency in [0.01] * 18 + [0.5] * 2:
+        controller.record(latency)
+    batch_size, _ = controller.adjust(8, 0.01)
+    assert batch_size == 4
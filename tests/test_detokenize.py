@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast
+
+from nllb_serving.detokenize import Detokenizer
+
+WORDS = ["▁the", "▁cat", "▁sat", "▁on", "▁mat", "s", "▁", "a", "t", ".", ",", "▁'", "▁!", "▁?"]
+SENTENCES = ["the cat sat on the mat.", "cats , mats !", "ঀক é the", "a", "the cat 's mat ?"]
+
+
+def make_tokenizer(byte_fallback, clean_up=False):
+    """SentencePiece-style Unigram tokenizer laid out like NLLB's: specials, byte pieces, words, language codes."""
+    vocab = [(piece, 0.0) for piece in ("<s>", "<pad>", "</s>", "<unk>")]
+    vocab += [(f"<0x{value:02X}>", -1.0) for value in range(256)]
+    vocab += [(word, -2.0 - 0.1 * i) for i, word in enumerate(WORDS)]
+    backend = Tokenizer(models.Unigram(vocab, unk_id=3, byte_fallback=byte_fallback))
+    backend.pre_tokenizer = pre_tokenizers.Metaspace()
+    if byte_fallback:
+        backend.decoder = decoders.Sequence([
+            decoders.Replace("▁", " "), decoders.ByteFallback(), decoders.Fuse(), decoders.Strip(" ", 1, 0),
+        ])
+    else:
+        backend.decoder = decoders.Metaspace()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, bos_token="<s>", pad_token="<pad>", eos_token="</s>", unk_token="<unk>",
+        clean_up_tokenization_spaces=clean_up,
+    )
+    tokenizer.add_special_tokens({"additional_special_tokens": ["eng_Latn", "asm_Beng"]})
+    return tokenizer
+
+
+@pytest.fixture(params=[(True, False), (False, False), (True, True)],
+                ids=["byte-fallback", "metaspace", "clean-up"])
+def tokenizer(request):
+    return make_tokenizer(*request.param)
+
+
+def output_ids(tokenizer, sentences):
+    """Padded int32 batch laid out like generated OUTPUT_IDS: EOS, language code, tokens, EOS, padding."""
+    lang = tokenizer.convert_tokens_to_ids("asm_Beng")
+    rows = [[tokenizer.eos_token_id, lang] + ids + [tokenizer.eos_token_id]
+            for ids in tokenizer(sentences, add_special_tokens=False)["input_ids"]]
+    width = max(len(row) for row in rows)
+    return np.array([row + [tokenizer.pad_token_id] * (width - len(row)) for row in rows], dtype=np.int32)
+
+
+def reference(tokenizer, ids):
+    return tokenizer.batch_decode([list(map(int, row)) for row in ids], skip_special_tokens=True)
+
+
+def test_padded_batch_matches_batch_decode(tokenizer):
+    batch = output_ids(tokenizer, SENTENCES)
+    assert Detokenizer(tokenizer).decode(batch) == reference(tokenizer, batch)
+
+
+def test_byte_pieces_match_batch_decode(tokenizer):
+    # Characters outside the vocabulary, encoded as byte pieces; without a
+    # ByteFallback decoder they are left as literal pieces by both
+    batch = output_ids(make_tokenizer(byte_fallback=True), ["ঀক é", "é the"])
+    assert "<0xE0>" in tokenizer.convert_ids_to_tokens(batch[0].tolist())
+    assert Detokenizer(tokenizer).decode(batch) == reference(tokenizer, batch)
+
+
+def test_invalid_byte_runs_match_batch_decode(tokenizer):
+    byte = {value: tokenizer.convert_tokens_to_ids(f"<0x{value:02X}>") for value in (0xE0, 0xA6, 0xC3)}
+    the = tokenizer.convert_tokens_to_ids("▁the")
+    # A truncated three-byte character, and a lone lead byte at the end of the row
+    rows = [[byte[0xE0], byte[0xA6], the, byte[0xC3]], [the, byte[0xA6]]]
+    assert Detokenizer(tokenizer).decode(rows) == reference(tokenizer, rows)
+
+
+def test_empty_rows(tokenizer):
+    specials = [tokenizer.eos_token_id, tokenizer.convert_tokens_to_ids("eng_Latn"), tokenizer.pad_token_id]
+    the = tokenizer.convert_tokens_to_ids("▁the")
+    detokenizer = Detokenizer(tokenizer)
+    # Rows of only special tokens, and rows without any ids
+    padded = np.array([specials, [the] + specials[1:]], dtype=np.int32)
+    assert detokenizer.decode(padded) == reference(tokenizer, padded) == ["", "the"]
+    ragged = [[], specials, [the], []]
+    assert detokenizer.decode(ragged) == reference(tokenizer, ragged) == ["", "", "the", ""]
+    assert detokenizer.decode(np.zeros((2, 0), dtype=np.int32)) == ["", ""]
+    assert detokenizer.decode([]) == []
+
+
+def test_strip_drops_special_padding_and_out_of_vocabulary_ids(tokenizer):
+    the = tokenizer.convert_tokens_to_ids("▁the")
+    rows = [[tokenizer.eos_token_id, the, tokenizer.pad_token_id], [-1, len(tokenizer), the, the]]
+    ids, lengths = Detokenizer(tokenizer).strip(rows)
+    assert ids.tolist() == [the, the, the]
+    assert lengths.tolist() == [1, 2]
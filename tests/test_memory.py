@@ -0,0 +1,159 @@
+from types import SimpleNamespace
+
+import pytest
+
+from nllb_serving.memory import MIB, MemoryBudget, MemoryEstimator, resolve_budget
+from nllb_serving.metrics import MetricsRegistry
+from nllb_serving.server.batcher import DynamicBatcher
+
+
+class TokenEstimator:
+    """Estimate of one byte per padded token and target, so budgets read as token counts."""
+
+    def estimate(self, batch_size, source_length, targets=1):
+        return batch_size * source_length * targets
+
+
+def test_batch_that_fits_is_not_split():
+    ranges, stats = MemoryBudget(TokenEstimator(), budget_bytes=100).split([10, 7, 10, 3])
+    assert ranges == [(0, 4)]
+    assert stats == {"estimate_bytes": 40, "sub_batches": 1, "oversized_rows": 0}
+
+
+def test_batch_splits_into_even_sub_batches():
+    ranges, stats = MemoryBudget(TokenEstimator(), budget_bytes=40).split([10] * 12)
+    assert ranges == [(0, 4), (4, 8), (8, 12)]
+    assert stats["sub_batches"] == 3
+    assert stats["estimate_bytes"] == 120
+
+
+def test_sub_batches_are_padded_to_their_longest_row():
+    # [10, 10, 20] would pad to 60 tokens; the long row starts the next sub-batch
+    ranges, _ = MemoryBudget(TokenEstimator(), budget_bytes=40).split([10, 10, 20, 20, 5])
+    assert ranges == [(0, 2), (2, 4), (4, 5)]
+
+
+def test_targets_multiply_the_estimate():
+    budget = MemoryBudget(TokenEstimator(), budget_bytes=40)
+    assert budget.split([10] * 4, targets=1)[0] == [(0, 4)]
+    assert budget.split([10] * 4, targets=2)[0] == [(0, 2), (2, 4)]
+
+
+def test_row_over_the_budget_runs_alone():
+    ranges, stats = MemoryBudget(TokenEstimator(), budget_bytes=20).split([5, 5, 100, 5, 5])
+    assert ranges == [(0, 2), (2, 3), (3, 5)]
+    assert stats["oversized_rows"] == 1
+
+
+def test_single_oversized_row_is_one_sub_batch():
+    ranges, stats = MemoryBudget(TokenEstimator(), budget_bytes=20).split([100])
+    assert ranges == [(0, 1)]
+    assert stats["oversized_rows"] == 1
+
+
+def test_every_row_over_the_budget():
+    ranges, stats = MemoryBudget(TokenEstimator(), budget_bytes=20).split([50, 60, 70])
+    assert ranges == [(0, 1), (1, 2), (2, 3)]
+    assert stats["oversized_rows"] == 3
+
+
+def test_empty_batch():
+    assert MemoryBudget(TokenEstimator(), budget_bytes=20).split([])[0] == [(0, 0)]
+
+
+def test_split_metrics():
+    metrics = MetricsRegistry()
+    budget = MemoryBudget(TokenEstimator(), budget_bytes=20, metrics=metrics)
+    budget.split([5, 5, 100, 5, 5])
+    budget.split([5])
+    assert metrics.gauge("nllb_memory_budget_bytes").value() == 20
+    assert metrics.gauge("nllb_batch_memory_estimate_bytes").value() == 5
+    assert metrics.counter("nllb_memory_split_batches_total").value() == 1
+    assert metrics.counter("nllb_memory_sub_batches_total").value() == 3
+    assert metrics.counter("nllb_memory_oversized_rows_total").value() == 1
+
+
+def test_estimator_grows_with_every_dimension():
+    config = SimpleNamespace(
+        d_model=1024, encoder_attention_heads=16, encoder_ffn_dim=4096, decoder_layers=12,
+        decoder_attention_heads=16, decoder_ffn_dim=4096, vocab_size=256206,
+    )
+    estimator = MemoryEstimator(config, element_bytes=4, max_length=128)
+    base = estimator.estimate(8, 32)
+    assert estimator.estimate(16, 32) > base
+    assert estimator.estimate(8, 64) > base
+    assert estimator.estimate(8, 32, targets=2) > base
+    assert MemoryEstimator(config, element_bytes=2, max_length=128).estimate(8, 32) < base
+    assert MemoryEstimator(config, max_length=128, num_beams=4).estimate(8, 32) > base
+
+
+def test_resolve_budget():
+    assert resolve_budget(None) is None
+    assert resolve_budget("0") is None
+    assert resolve_budget("off") is None
+    assert resolve_budget("512") == 512 * MIB
+    assert resolve_budget(1.5) == int(1.5 * MIB)
+    assert 0 < resolve_budget("auto", shares=4) < resolve_budget("auto")
+    with pytest.raises(ValueError):
+        resolve_budget("-1")
+    with pytest.raises(ValueError):
+        resolve_budget("lots")
+
+
+def test_batcher_runs_sub_batches_and_fails_only_the_failed_range():
+    calls = []
+
+    def run_batch(key, texts):
+        calls.append(texts)
+        if "bad" in texts:
+            raise RuntimeError("out of memory")
+        return [text.upper() for text in texts]
+
+    batcher = DynamicBatcher(run_batch, max_batch_size=4, max_queue_delay=0.05,
+                             split_batch=lambda key, texts: [(0, 2), (2, 3)])
+    futures = batcher.submit_all([("k", ["a"], 0, None), ("k", ["b"], 0, None), ("k", ["bad"], 0, None)])
+    batcher.start()
+    try:
+        assert futures[0].result(timeout=5) == ["A"]
+        assert futures[1].result(timeout=5) == ["B"]
+        with pytest.raises(RuntimeError):
+            futures[2].result(timeout=5)
+    finally:
+        batcher.stop()
+    assert calls == [["a", "b"], ["bad"]]
+
+
+def test_batcher_fails_a_range_with_the_wrong_number_of_results():
+    def run_batch(key, texts):
+        return [text.upper() for text in texts if text != "dropped"]
+
+    batcher = DynamicBatcher(run_batch, max_batch_size=4, max_queue_delay=0.05,
+                             split_batch=lambda key, texts: [(0, 2), (2, 3)])
+    futures = batcher.submit_all([("k", ["a"], 0, None), ("k", ["dropped"], 0, None), ("k", ["c"], 0, None)])
+    batcher.start()
+    try:
+        for future in futures[:2]:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=5)
+        # The later range keeps its own results instead of shifting into the gap
+        assert futures[2].result(timeout=5) == ["C"]
+    finally:
+        batcher.stop()
+
+
+def test_batcher_survives_a_failing_split():
+    plans = iter([ValueError("bad budget")])
+
+    def split_batch(key, texts):
+        error = next(plans, None)
+        if error is not None:
+            raise error
+        return [(0, len(texts))]
+
+    batcher = DynamicBatcher(lambda key, texts: texts, split_batch=split_batch).start()
+    try:
+        with pytest.raises(ValueError):
+            batcher.submit("k", ["a"]).result(timeout=5)
+        assert batcher.submit("k", ["b"]).result(timeout=5) == ["b"]
+    finally:
+        batcher.stop()
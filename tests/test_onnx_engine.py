@@ -0,0 +1,17 @@
+import pytest
+import torch
+
+from conftest import LANG_CODE, greedy_generate
+from nllb_serving.onnx_engine import OnnxEngine, export_onnx
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+MAX_LENGTH = 20
+
+
+def test_exported_model_matches_greedy_generate(target, batch, tmp_path):
+    export_onnx(target, str(tmp_path))
+    engine = OnnxEngine(str(tmp_path), providers=["CPUExecutionProvider"])
+    output_ids = engine.generate(*batch, forced_bos_token_id=LANG_CODE, max_length=MAX_LENGTH)
+    assert torch.equal(output_ids, greedy_generate(target, batch, MAX_LENGTH))
@@ -0,0 +1,213 @@
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from nllb_serving.protocol import MessageReader, decode_message, encode_message, make_request
+from nllb_serving.router import NoReplicaAvailable, ReplicaSet, StandardRouter
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeReplica:
+    """
+    Local standard-protocol server that answers with its own address.
+
+    Requests with the text "hold" wait for `release`, so they stay
+    outstanding on the router.
+    """
+
+    def __init__(self):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.address = f"127.0.0.1:{self.server.getsockname()[1]}"
+        self.release = threading.Event()
+        self.holding = threading.Event()
+        self.connections = []
+        threading.Thread(target=self._accept, args=(self.server,), daemon=True).start()
+
+    def _accept(self, server):
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        reader = MessageReader(conn)
+        with conn:
+            while (message := reader.read()) is not None:
+                if "command" in message:
+                    conn.sendall(encode_message({"requests": 0}))
+                    continue
+                if message["text"] == "hold":
+                    self.holding.set()
+                    self.release.wait(5)
+                conn.sendall(encode_message({"translated_text": message["text"], "replica": self.address}))
+
+    def restart(self):
+        """Drop every open connection and listen again on the same port."""
+        # shutdown wakes the blocked accept so the port is really released
+        self.server.shutdown(socket.SHUT_RDWR)
+        self.server.close()
+        for conn in self.connections:
+            conn.shutdown(socket.SHUT_RDWR)
+        self.connections = []
+        self.server = socket.create_server(("127.0.0.1", int(self.address.rsplit(":", 1)[1])))
+        threading.Thread(target=self._accept, args=(self.server,), daemon=True).start()
+
+    def close(self):
+        self.release.set()
+        self.server.close()
+
+
+@pytest.fixture
+def replicas():
+    live = [FakeReplica(), FakeReplica()]
+    yield live, f"127.0.0.1:{free_port()}"
+    for replica in live:
+        replica.close()
+
+
+def start_router(addresses, **options):
+    replica_set = ReplicaSet(addresses, failure_threshold=2, **options)
+    router = StandardRouter(replica_set, timeout=5.0)
+    port = free_port()
+    threading.Thread(target=router.serve_forever, kwargs={"port": port}, daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            threading.Event().wait(0.02)
+    return router, port
+
+
+def check_all(router):
+    for replica in router.replica_set.replicas:
+        try:
+            ok = router.check(replica)
+        except Exception:
+            ok = False
+        router.replica_set.record_check(replica, ok)
+
+
+def translate(port, text, source="eng_Latn", target="asm_Beng"):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(encode_message(make_request(text, source, target)))
+        return decode_message(sock.makefile("rb").readline())
+
+
+def by_address(replica_set, address):
+    return next(replica for replica in replica_set.replicas if replica.address == address)
+
+
+def test_acquire_picks_the_least_loaded_replica():
+    replica_set = ReplicaSet(["a:1", "b:2", "c:3"])
+    first = replica_set.acquire()
+    second = replica_set.acquire()
+    third = replica_set.acquire()
+    assert len({first, second, third}) == 3
+    replica_set.release(first)
+    replica_set.release(third)
+    assert replica_set.acquire() in (first, third)
+    assert by_address(replica_set, second.address).outstanding == 1
+
+
+def test_failures_eject_a_replica_until_it_recovers():
+    replica_set = ReplicaSet(["a:1", "b:2"], failure_threshold=2)
+    a = by_address(replica_set, "a:1")
+    replica_set.record_check(a, False)
+    assert a.healthy
+    replica_set.record_check(a, False)
+    assert not a.healthy
+    assert all(replica_set.acquire() is not a for _ in range(4))
+    replica_set.record_check(a, True)
+    assert a.healthy
+
+
+def test_affinity_yields_to_load_beyond_the_slack():
+    replica_set = ReplicaSet(["a:1", "b:2"], affinity=True, affinity_slack=2)
+    preferred = replica_set._preferred(replica_set.replicas, "eng_Latn>asm_Beng")
+    # Within the slack the pair stays on its replica while the other one idles
+    assert [replica_set.acquire("eng_Latn>asm_Beng") for _ in range(3)] == [preferred] * 3
+    assert replica_set.acquire("eng_Latn>asm_Beng") is not preferred
+
+
+def test_all_replicas_excluded_raises():
+    replica_set = ReplicaSet(["a:1"])
+    with pytest.raises(NoReplicaAvailable):
+        replica_set.acquire(exclude=replica_set.replicas)
+
+
+def test_dead_replica_is_ejected_by_health_checks(replicas):
+    live, dead = replicas
+    router, port = start_router([replica.address for replica in live] + [dead])
+    replica_set = router.replica_set
+    check_all(router)
+    check_all(router)
+    assert [replica.healthy for replica in replica_set.replicas] == [True, True, False]
+    answered = {translate(port, f"sentence {i}")["replica"] for i in range(6)}
+    assert answered == {replica.address for replica in live}
+
+
+def test_requests_retry_around_a_dead_replica(replicas):
+    live, dead = replicas
+    router, port = start_router([dead] + [replica.address for replica in live])
+    # No health checks: forwarded requests find the dead replica themselves
+    responses = [translate(port, f"sentence {i}") for i in range(8)]
+    assert all(response["replica"] != dead for response in responses)
+    assert not by_address(router.replica_set, dead).healthy
+
+
+def test_routes_to_the_least_loaded_replica(replicas):
+    live, dead = replicas
+    router, port = start_router([replica.address for replica in live] + [dead])
+    check_all(router)
+    check_all(router)
+    with ThreadPoolExecutor(1) as pool:
+        held = pool.submit(translate, port, "hold")
+        busy = None
+        for _ in range(100):
+            busy = next((replica for replica in live if replica.holding.is_set()), None)
+            if busy is not None:
+                break
+            threading.Event().wait(0.02)
+        assert busy is not None
+        idle = next(replica for replica in live if replica is not busy)
+        # While one request is outstanding on `busy`, everything else goes to `idle`
+        assert {translate(port, f"sentence {i}")["replica"] for i in range(5)} == {idle.address}
+        busy.release.set()
+        assert held.result(timeout=5)["replica"] == busy.address
+
+
+def test_language_pair_sticks_to_its_rendezvous_replica(replicas):
+    live, dead = replicas
+    router, port = start_router([replica.address for replica in live] + [dead], affinity=True)
+    replica_set = router.replica_set
+    check_all(router)
+    check_all(router)
+    healthy = [replica for replica in replica_set.replicas if replica.healthy]
+    for target in ("asm_Beng", "hin_Deva", "ben_Beng", "tam_Taml"):
+        expected = replica_set._preferred(healthy, f'eng_Latn>"{target}"').address
+        answered = {translate(port, f"sentence {i}", target=target)["replica"] for i in range(4)}
+        assert answered == {expected}
+
+
+def test_replica_restart_does_not_eject_it(replicas):
+    live, _ = replicas
+    router, port = start_router([replica.address for replica in live])
+    for i in range(4):
+        translate(port, f"sentence {i}")
+    # The router's pooled connections to both replicas are now closed by the peer
+    for replica in live:
+        replica.restart()
+    answered = {translate(port, f"sentence {i}")["replica"] for i in range(4)}
+    assert answered == {replica.address for replica in live}
+    assert [(replica.healthy, replica.failures) for replica in router.replica_set.replicas] == [(True, 0), (True, 0)]
@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from nllb_serving.server.batcher import BatchItem, DynamicBatcher
+from nllb_serving.server.scheduler import DeadlineExceeded, Overloaded, RequestQueue
+
+
+def test_queue_orders_by_priority_then_deadline_then_arrival():
+    queue = RequestQueue()
+    items = {
+        "bulk": BatchItem("k", ["a"], priority=1),
+        "late": BatchItem("k", ["b"], deadline=20.0),
+        "no_deadline": BatchItem("k", ["c"]),
+        "early": BatchItem("k", ["d"], deadline=10.0),
+        "no_deadline_2": BatchItem("k", ["e"]),
+        "urgent_bulk": BatchItem("k", ["f"], priority=1, deadline=5.0),
+    }
+    for item in items.values():
+        queue.push(item)
+
+    order = [name for item in queue for name, candidate in items.items() if candidate is item]
+    assert order == ["early", "late", "no_deadline", "no_deadline_2", "urgent_bulk", "bulk"]
+    assert queue.head() is items["early"]
+    assert queue.size == 6
+
+
+def test_queue_sheds_expired_items():
+    queue = RequestQueue()
+    expired = BatchItem("k", ["a", "b"], deadline=1.0, tokens=4)
+    due_now = BatchItem("k", ["c"], deadline=2.0, tokens=2)
+    live = BatchItem("k", ["d"], deadline=3.0, tokens=2)
+    for item in (live, expired, due_now):
+        queue.push(item)
+
+    assert queue.pop_expired(2.0) == [expired, due_now]
+    assert list(queue) == [live]
+    assert (queue.size, queue.tokens) == (1, 2)
+    assert queue.next_deadline() == 3.0
+
+
+def test_batcher_fails_requests_whose_deadline_passed():
+    ran = []
+    batcher = DynamicBatcher(lambda key, texts: ran.extend(texts) or texts).start()
+    try:
+        future = batcher.submit("k", ["late"], deadline=time.monotonic() - 1)
+        with pytest.raises(DeadlineExceeded):
+            future.result(timeout=5)
+        assert batcher.submit("k", ["live"]).result(timeout=5) == ["live"]
+    finally:
+        batcher.stop()
+    assert ran == ["live"]
+
+
+def test_batcher_rejects_requests_over_the_queue_bound():
+    started, release = threading.Event(), threading.Event()
+
+    def run_batch(key, texts):
+        started.set()
+        release.wait(5)
+        return texts
+
+    batcher = DynamicBatcher(run_batch, max_batch_size=1, max_queued_sentences=2).start()
+    try:
+        running = batcher.submit("k", ["running"])
+        assert started.wait(5)
+        queued = batcher.submit_all([("k", ["a"], 0, None), ("k", ["b"], 0, None)])
+        with pytest.raises(Overloaded) as rejected:
+            batcher.submit("k", ["c"])
+        assert rejected.value.retry_after > 0
+        release.set()
+        assert running.result(timeout=5) == ["running"]
+        assert [future.result(timeout=5) for future in queued] == [["a"], ["b"]]
+    finally:
+        release.set()
+        batcher.stop()
+
+
+def test_batcher_admits_nothing_of_a_submission_that_does_not_fit():
+    started, release = threading.Event(), threading.Event()
+
+    def run_batch(key, texts):
+        started.set()
+        release.wait(5)
+        return texts
+
+    batcher = DynamicBatcher(run_batch, max_batch_size=1, max_queued_sentences=2).start()
+    try:
+        batcher.submit("k", ["running"])
+        assert started.wait(5)
+        batcher.submit("k", ["a"])
+        with pytest.raises(Overloaded):
+            batcher.submit_all([("k", ["b"], 0, None), ("k", ["c"], 0, None)])
+        assert batcher._queue.size == 1
+    finally:
+        release.set()
+        batcher.stop()
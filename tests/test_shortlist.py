@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+import pytest
+import torch
+
+from conftest import EOS, LANG_CODE, PAD, greedy_generate, tiny_model
+from nllb_serving.metrics import MetricsRegistry
+from nllb_serving.shortlist import METADATA_KEY, VocabularyShortlist
+from nllb_serving.speculative import SpeculativeDecoder
+
+MAX_LENGTH = 20
+LANG = "asm_Beng"
+
+
+def save_shortlist(tmp_path, ids):
+    path = tmp_path / "shortlists.npz"
+    np.savez(path, **{LANG: np.array(sorted(ids), dtype=np.int32), METADATA_KEY: np.array(json.dumps({}))})
+    return path
+
+
+@pytest.fixture(scope="module")
+def greedy(target, batch):
+    output_ids = greedy_generate(target, batch, MAX_LENGTH)
+    finished = (output_ids[:, 2:] == EOS).any(dim=1)
+    assert finished.any() and not finished.all()
+    return output_ids
+
+
+def test_padded_batch_keeps_a_covering_shortlist(tmp_path, target, batch, greedy):
+    # Every token greedy emits, but not the whole vocabulary
+    ids = set(greedy.unique().tolist()) | {EOS, PAD, LANG_CODE}
+    assert len(ids) < target.config.vocab_size
+    metrics = MetricsRegistry()
+    messages = []
+    shortlist = VocabularyShortlist(target, save_shortlist(tmp_path, ids), audit_interval=1, min_audits=1,
+                                    metrics=metrics, log=messages.append)
+    with shortlist.restrict(LANG, max_length=MAX_LENGTH) as restricted:
+        assert restricted
+        output_ids = greedy_generate(target, batch, MAX_LENGTH)
+
+    assert torch.equal(output_ids, greedy)
+    assert LANG not in shortlist.disabled
+    assert messages == []
+    assert metrics.counter("nllb_shortlist_misses_total").value() == 0
+    # Finished rows and the forced language code step are not audited
+    audited = metrics.counter("nllb_shortlist_audits_total").value()
+    live = ((greedy[:, 1:-1] != EOS) & (greedy[:, 1:-1] != PAD)).sum()
+    assert 0 < audited <= int(live)
+
+
+def test_speculative_verification_only_audits_the_greedy_path(tmp_path, target, batch, greedy):
+    # Positions after a rejected proposal see contexts greedy never reaches
+    ids = set(greedy.unique().tolist()) | {EOS, PAD, LANG_CODE}
+    shortlist = VocabularyShortlist(target, save_shortlist(tmp_path, ids), audit_interval=1, min_audits=1)
+    decoder = SpeculativeDecoder(target, tiny_model(103, layers=1), draft_length=3)
+    with shortlist.restrict(LANG, max_length=MAX_LENGTH):
+        output_ids, _ = decoder.generate(*batch, forced_bos_token_id=LANG_CODE, max_length=MAX_LENGTH)
+
+    assert torch.equal(output_ids, greedy)
+    assert LANG not in shortlist.disabled
+
+
+def test_shortlist_missing_greedy_tokens_falls_back(tmp_path, target, batch, greedy):
+    emitted = greedy[:, 2:][(greedy[:, 2:] != EOS) & (greedy[:, 2:] != PAD)]
+    most_common = int(emitted.mode().values)
+    ids = set(range(target.config.vocab_size)) - {most_common}
+    messages = []
+    shortlist = VocabularyShortlist(target, save_shortlist(tmp_path, ids), audit_interval=1, min_audits=1,
+                                    log=messages.append)
+    with shortlist.restrict(LANG, max_length=MAX_LENGTH):
+        output_ids = greedy_generate(target, batch, MAX_LENGTH)
+
+    # Audited steps that miss use the full logits, so the output is unchanged
+    assert torch.equal(output_ids, greedy)
+    assert LANG in shortlist.disabled
+    assert len(messages) == 1 and LANG in messages[0]
+    assert not shortlist.available([LANG])
+
+
+def test_restrict_removes_its_decoder_hook(tmp_path, target):
+    shortlist = VocabularyShortlist(target, save_shortlist(tmp_path, range(16)))
+    lm_head = target.lm_head
+    with shortlist.restrict(LANG):
+        assert target.lm_head is not lm_head
+    assert target.lm_head is lm_head
+    assert not target.get_decoder()._forward_pre_hooks
@@ -0,0 +1,38 @@
+import pytest
+import torch
+
+from conftest import EOS, LANG_CODE, greedy_generate, tiny_model
+from nllb_serving.speculative import SpeculativeDecoder
+
+MAX_LENGTH = 20
+
+
+@pytest.fixture(scope="module")
+def greedy(target, batch):
+    output_ids = greedy_generate(target, batch, MAX_LENGTH)
+    # The comparison needs rows that finish early next to rows that run to max_length
+    finished = (output_ids[:, 2:] == EOS).any(dim=1)
+    assert finished.any() and not finished.all()
+    return output_ids
+
+
+@pytest.mark.parametrize("draft_length", [1, 2, 3, 5, 8])
+def test_matches_greedy_generate_with_a_different_draft(target, batch, greedy, draft_length):
+    decoder = SpeculativeDecoder(target, tiny_model(103, layers=1), draft_length=draft_length)
+    output_ids, stats = decoder.generate(*batch, forced_bos_token_id=LANG_CODE, max_length=MAX_LENGTH)
+    assert torch.equal(output_ids, greedy)
+    assert stats["passes"] >= 1
+    assert 0 <= stats["accepted"] <= stats["proposed"]
+
+
+@pytest.mark.parametrize("draft_length", [1, 4])
+def test_identical_draft_accepts_every_proposal(target, batch, greedy, draft_length):
+    decoder = SpeculativeDecoder(target, target, draft_length=draft_length)
+    output_ids, stats = decoder.generate(*batch, forced_bos_token_id=LANG_CODE, max_length=MAX_LENGTH)
+    assert torch.equal(output_ids, greedy)
+    assert stats["accepted"] == stats["proposed"] > 0
+
+
+def test_rejects_empty_drafts(target):
+    with pytest.raises(ValueError):
+        SpeculativeDecoder(target, target, draft_length=0)
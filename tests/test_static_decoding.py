@@ -0,0 +1,27 @@
+import pytest
+import torch
+
+from conftest import LANG_CODE, greedy_generate
+from nllb_serving.static_decoding import StaticDecoder, bucket
+
+MAX_LENGTH = 20
+
+
+def test_bucket_rounds_up_to_the_next_size():
+    assert bucket(3, (1, 2, 4, 8)) == 4
+    assert bucket(4, (1, 2, 4, 8)) == 4
+    assert bucket(9, (1, 2, 4, 8)) == 9
+
+
+def test_eager_step_matches_greedy_generate(target, batch):
+    # Batch 6 and source length 9 are both padded up to a bucket
+    decoder = StaticDecoder(target, compile=False, batch_buckets=(4, 8), length_buckets=(16, 32))
+    output_ids = decoder.generate(*batch, forced_bos_token_id=LANG_CODE, max_length=MAX_LENGTH)
+    assert torch.equal(output_ids, greedy_generate(target, batch, MAX_LENGTH))
+
+
+@pytest.mark.skip(reason="torch.compile takes about 30s; run manually after changing the decoder step")
+def test_compiled_step_matches_greedy_generate(target, batch):
+    decoder = StaticDecoder(target, compile=True, batch_buckets=(8,), length_buckets=(16, 32))
+    output_ids = decoder.generate(*batch, forced_bos_token_id=LANG_CODE, max_length=MAX_LENGTH)
+    assert torch.equal(output_ids, greedy_generate(target, batch, MAX_LENGTH))
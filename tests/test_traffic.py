@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from nllb_serving.traffic import SentencePool, TrafficRecorder, read_trace, replay
+
+
+class RecordingBackend:
+    """atranslate_chunk that notes when each request arrived, relative to the first."""
+
+    def __init__(self):
+        self.arrivals = []
+
+    async def atranslate_chunk(self, texts, source_lang, target_lang):
+        self.arrivals.append((asyncio.get_running_loop().time(), texts, source_lang, target_lang))
+        return texts
+
+
+def words_pool():
+    return SentencePool(["a", "a b", "a b c", "a b c d e f"], lambda text: len(text.split()))
+
+
+def test_replay_starts_at_the_first_record():
+    # Recorded an hour after the server started
+    records = [
+        {"t": 3600.0, "src": "eng_Latn", "tgt": "asm_Beng", "lengths": [2]},
+        {"t": 3600.2, "src": "eng_Latn", "tgt": "hin_Deva", "lengths": [3, 1]},
+        {"t": 3600.4, "src": "eng_Latn", "tgt": "asm_Beng", "lengths": [6]},
+    ]
+    backend = RecordingBackend()
+    stats = asyncio.run(replay(records, backend, words_pool(), speed=2.0))
+
+    assert stats["requests"] == 3 and stats["sentences"] == 4 and stats["errors"] == 0
+    assert stats["seconds"] < 0.5
+    first = backend.arrivals[0][0]
+    offsets = [arrival - first for arrival, *_ in backend.arrivals]
+    assert offsets[1] == pytest.approx(0.1, abs=0.05)
+    assert offsets[2] == pytest.approx(0.2, abs=0.05)
+    assert [texts for _, texts, _, _ in backend.arrivals] == [["a b"], ["a b c", "a"], ["a b c d e f"]]
+
+
+def test_recorded_trace_round_trip(tmp_path):
+    path = str(tmp_path / "trace.jsonl.gz")
+    recorder = TrafficRecorder(path, hash_content=True, source="standard")
+    recorder.record("eng_Latn", "asm_Beng", [2], contents=["a b"])
+    recorder.record("eng_Latn", ["asm_Beng", "hin_Deva"], [1, 3])
+    recorder.close()
+
+    header, records = read_trace(path)
+    assert header["source"] == "standard"
+    assert [record["lengths"] for record in records] == [[2], [1, 3]]
+    assert records[1]["tgt"] == ["asm_Beng", "hin_Deva"]
+    assert len(records[0]["hashes"]) == 1
+    assert records[0]["t"] <= records[1]["t"]